@@ -1,21 +1,29 @@
 import numpy as np
-import pandas as pd
+from lattice import convert_2d_lattice_to_helical_lattice, convert_helical_lattice_to_2d_lattice, chirality_map
+import metrics
+import session_memory
 import shiny
 import plotly
 from shinywidgets import render_widget
 from shiny.ui import div, HTML
 
-import plotly.express as px
-from shinywidgets import render_plotly
-
 import plotly.graph_objects as go
+from plotly.colors import qualitative
 from shiny import reactive
 
-from shiny import App, Inputs, Outputs, Session, reactive, render, ui
+from shiny import App, Inputs, Outputs, Session, reactive, render, req, ui
 from shiny.types import ImgData
 from shiny import session
 from shinywidgets import output_widget, render_widget
 from urllib.parse import urlencode, parse_qs
+from functools import lru_cache
+import asyncio
+import inspect
+import json
+import os
+import sys
+import time
+from starlette.routing import Route
 
 def get_client_url(input):
     d = input._map
@@ -55,8 +63,10 @@ app_ui = ui.page_fluid(
                 id="sidebar_accordion",
                 open=[]  # Ensure no panel is open by default
             ),
-            ui.input_radio_buttons("radio", "", ["Helical⇒2D", "2D⇒Helical"]),
+            ui.input_radio_buttons("radio", "", ["Helical⇒2D", "2D⇒Helical", "Chirality map", "Animation"]),
             ui.output_ui("conditional_inputs"), 
+            ui.input_checkbox("manual_apply", "Apply changes manually", value=False),
+            ui.panel_conditional("input.manual_apply", ui.input_action_button("apply", "Apply")),
             #ui.input_checkbox("share_url", "Show/Reload sharable URL", value=False),
             #ui.input_action_button("button", "Get URL Below"),
             #ui.output_ui("display_client_url"), 
@@ -68,7 +78,8 @@ app_ui = ui.page_fluid(
         ui.row(
             ui.column(12,  
                 ui.div(
-                    ui.h2("HelicalLattice: 2D Lattice ⇔ Helical Lattice")
+                    ui.h2("HelicalLattice: 2D Lattice ⇔ Helical Lattice"),
+                    ui.output_ui("compute_status")
                 )
             ),
             ui.column(4,
@@ -101,6 +112,24 @@ app_ui = ui.page_fluid(
             }
         });
     """),
+    ui.tags.script("""
+        // Report that the user is at the page, at most every 10 s, so that the server can rebuild the figures
+        // it evicted while the session was idle (see IDLE_EVICT_SECONDS)
+        (function() {
+            var last = 0;
+            function active() {
+                var now = Date.now();
+                if (document.visibilityState !== 'visible' || now - last < 10000 || !window.Shiny || !Shiny.setInputValue) return;
+                last = now;
+                Shiny.setInputValue('activity', now);
+            }
+            ['pointermove', 'pointerdown', 'keydown', 'wheel', 'visibilitychange'].forEach(function(name) {
+                document.addEventListener(name, active, {passive: true});
+            });
+            window.addEventListener('focus', active);
+            $(document).on('shiny:connected', active);
+        })();
+    """),
     ui.tags.style(
       """
         * { font-size: 10pt; padding:0; border: 0; margin: 0; }
@@ -111,6 +140,321 @@ app_ui = ui.page_fluid(
     )
 )
 
+MODE_PARAMETERS = {
+    "Helical⇒2D": ("twist", "rise", "csym", "diameter", "length", "primitive_unitcell", "horizontal", "lattice_size_factor", "marker_size", "figure_height"),
+    "2D⇒Helical": ("ax", "ay", "bx", "by", "na", "nb", "length", "lattice_size_factor", "marker_size", "figure_height"),
+    "Chirality map": ("ax", "ay", "bx", "by", "min_diameter", "max_diameter", "marker_size", "figure_height"),
+    "Animation": ("twist", "rise", "twist_end", "rise_end", "csym", "diameter", "length", "n_frames", "marker_size", "figure_height"),
+}
+
+# Conversions and figure building run in a thread pool so that a heavy session does not stall the other sessions
+# served by the same worker. With HELICALLATTICE_COMPUTE_WORKERS=0, or where threads are unavailable (shinylive),
+# they run inline on the event loop. A task that exceeds the timeout is reported as an error and its result dropped.
+COMPUTE_WORKERS = int(os.environ.get("HELICALLATTICE_COMPUTE_WORKERS", 4))
+COMPUTE_TIMEOUT_SECONDS = float(os.environ.get("HELICALLATTICE_COMPUTE_TIMEOUT_SECONDS", 30))
+COMPUTE_EXECUTOR = None
+if COMPUTE_WORKERS > 0 and sys.platform != "emscripten":
+  from concurrent.futures import ThreadPoolExecutor
+  COMPUTE_EXECUTOR = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix="helicallattice-compute")
+
+class ComputeSlot:
+  # Runs one computation at a time in the compute pool. A superseded computation is dropped if it has not started yet;
+  # a started one cannot be interrupted, so the next computation waits for it rather than piling up stale work in the pool.
+  def __init__(self):
+    self.future = None
+
+  async def run(self, fn, *args, **kwargs):
+    if COMPUTE_EXECUTOR is None:
+      return fn(*args, **kwargs)
+    if self.future is not None and not self.future.done():
+      await asyncio.wait([asyncio.wrap_future(self.future)])
+    self.future = COMPUTE_EXECUTOR.submit(fn, *args, **kwargs)
+    try:
+      return await asyncio.wait_for(asyncio.wrap_future(self.future), COMPUTE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+      raise TimeoutError(f"computation exceeded {COMPUTE_TIMEOUT_SECONDS:g} s") from None
+
+async def iterate_in_pool(iterator):
+  # the items of a blocking iterator, each one computed in the compute pool, e.g. the chunks of a long download
+  if COMPUTE_EXECUTOR is None:
+    for item in iterator:
+      yield item
+    return
+  loop = asyncio.get_running_loop()
+  done = object()
+  while (item := await loop.run_in_executor(COMPUTE_EXECUTOR, next, iterator, done)) is not done:
+    yield item
+
+# Cache of serialized figures shared by all workers and kept across restarts (see figure_cache.py).
+# HELICALLATTICE_FIGURE_CACHE is the SQLite file, empty to disable; HELICALLATTICE_FIGURE_CACHE_MB bounds its size.
+# Setting HELICALLATTICE_FIGURE_CACHE_WARMUP=1 fills it with the figures of the default view at startup.
+# The default file is in a directory of the user's cache that only the app's user can write to, unlike the shared
+# temporary directory.
+FIGURE_CACHE_PATH = os.environ.get("HELICALLATTICE_FIGURE_CACHE", os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "helicallattice", "figures.sqlite"))
+FIGURE_CACHE_MB = float(os.environ.get("HELICALLATTICE_FIGURE_CACHE_MB", 256))
+FIGURE_CACHE = None
+if FIGURE_CACHE_PATH and sys.platform != "emscripten":
+  import figure_cache
+  import sqlite3
+  try:
+    FIGURE_CACHE = figure_cache.FigureCache(FIGURE_CACHE_PATH, max_bytes=int(FIGURE_CACHE_MB*2**20))
+  except (OSError, sqlite3.Error) as e:
+    import warnings
+    warnings.warn(f"figure cache disabled, {FIGURE_CACHE_PATH} cannot be used: {e}")
+  FIGURE_CACHE_VERSION = figure_cache.source_fingerprint(*(os.path.join(os.path.dirname(os.path.abspath(__file__)), f) for f in ("app.py", "geometry.py", "lattice.py")), versions=(plotly.__version__, np.__version__))
+
+def figure_from_json(payload):
+  # a figure as stored in the figure cache by fig.to_json(), so already valid. Its arrays are typed-array dicts
+  return go.Figure(json.loads(payload), _validate=False)
+
+def build_figure(output_id, figure_function, parameters):
+  # figure_function(**parameters), from the figure cache if it holds this parameter set
+  t0 = time.perf_counter()
+  key = None
+  if FIGURE_CACHE is not None:
+    key = figure_cache.figure_key(figure_function.__name__, {**parameters, "webgl_threshold": WEBGL_POINT_THRESHOLD, "payload": PAYLOAD_MODE}, FIGURE_CACHE_VERSION)
+    payload = FIGURE_CACHE.get(key)
+    metrics.FIGURE_CACHE_LOOKUPS.inc(result="hit" if payload is not None else "miss")
+    if payload is not None:
+      fig = figure_from_json(payload)
+      metrics.RENDER_SECONDS.observe(time.perf_counter() - t0, output=output_id, source="cache")
+      metrics.FIGURE_POINTS.observe(metrics.figure_point_count(fig), output=output_id, backend=render_backend(fig), source="cache")
+      return fig
+  fig = figure_function(**parameters)
+  seconds = time.perf_counter() - t0
+  metrics.RENDER_SECONDS.observe(seconds, output=output_id, source="built")
+  metrics.FIGURE_POINTS.observe(metrics.figure_point_count(fig), output=output_id, backend=render_backend(fig), source="built")
+  metrics.log_if_slow(output_id, seconds, {**parameters, "backend": render_backend(fig)})
+  if PAYLOAD_MODE == "compact":
+    metrics.PAYLOAD_BYTES_SAVED.inc(compact_figure(fig), output=output_id)
+  if key is not None:
+    FIGURE_CACHE.put(key, fig.to_json())
+  return fig
+
+def build_figure_html(output_id, figure_function, parameters):
+  # the figure as an HTML fragment that draws it with the plotly.js of plotly_js_dependency()
+  fig = build_figure(output_id, figure_function, parameters)
+  return fig.to_html(full_html=False, include_plotlyjs=False, auto_play=False, div_id=f"{output_id}_figure", validate=False)
+
+def plotly_js_dependency():
+  # plotly.js as shipped with the plotly package, served by the app itself
+  from htmltools import HTMLDependency
+  return HTMLDependency("plotly.js", plotly.offline.get_plotlyjs_version(), source={"subdir": os.path.join(os.path.dirname(plotly.__file__), "package_data")}, script={"src": "plotly.min.js"})
+
+# Payload mode: "compact" rounds trace coordinates to a decimal step finer than PAYLOAD_PRECISION_PIXELS of a pixel
+# and sends them as float32 instead of float64 typed arrays; "full" sends them unchanged.
+PAYLOAD_MODE = os.environ.get("HELICALLATTICE_PAYLOAD", "compact")
+PAYLOAD_PRECISION_PIXELS = 0.1
+
+def base64_size(nbytes):
+  return 4*((nbytes+2)//3)
+
+def compact_arrays(arrays, height, precision_pixels=PAYLOAD_PRECISION_PIXELS):
+  # the float64 arrays of one axis rounded to a common decimal step and converted to float32,
+  # or None if float32 could not hold the rounded values to within the step
+  finite = [v[np.isfinite(v)] for v in arrays]
+  finite = [v for v in finite if v.size]
+  if not finite: return None
+  extent = max(v.max() for v in finite) - min(v.min() for v in finite)
+  limit = max(np.abs(v).max() for v in finite)
+  step = 10**np.floor(np.log10(max(extent, 1e-9)/height*precision_pixels))
+  if limit/step >= 2**24: return None
+  return [(np.round(v/step)*step).astype(np.float32) for v in arrays]
+
+def compact_figure(fig, precision_pixels=PAYLOAD_PRECISION_PIXELS):
+  # returns the number of bytes saved in the serialized figure
+  height = fig.layout.height or 500
+  saved = 0
+  for axis in ("x", "y", "z"):
+    values = [(trace, getattr(trace, axis, None)) for trace in fig.data]
+    values = [(trace, v) for trace, v in values if isinstance(v, np.ndarray) and v.dtype == np.float64 and v.size]
+    compacted = compact_arrays([v for _, v in values], height, precision_pixels)
+    if compacted is None: continue
+    for (trace, v), c in zip(values, compacted):
+      trace[axis] = None  # plotly skips assigning an array equal in value, e.g. already on the step, and would keep float64
+      trace[axis] = c
+      saved += base64_size(v.nbytes) - base64_size(c.nbytes)
+  return saved
+
+def lattice_2d(**parameters):
+  with metrics.timed(metrics.CONVERSION_SECONDS, conversion="helical_to_2d"):
+    return convert_helical_lattice_to_2d_lattice_cached(**parameters)
+
+def helical_lattice(**parameters):
+  with metrics.timed(metrics.CONVERSION_SECONDS, conversion="2d_to_helical"):
+    return convert_2d_lattice_to_helical_lattice_cached(**parameters)
+
+def helical_lattices(**parameters):
+  with metrics.timed(metrics.CONVERSION_SECONDS, conversion="chirality_map"):
+    return chirality_map_cached(**parameters)
+
+# The figure of each output as a function of the inputs it depends on: the argument names are the input ids,
+# except view, the part of the helix the user zoomed to in the unrolled view (see VIEW_SOURCES).
+def plot_helix_figure(diameter, length, twist, rise, csym, marker_size, figure_height, view):
+  return plot_helical_lattice(diameter, length, twist, rise, csym, marker_size=marker_size*0.6, figure_height=figure_height, view=view)
+
+def plot_helix_unrolled_figure(diameter, length, twist, rise, csym, marker_size, figure_height, view):
+  return plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_size=marker_size, figure_height=figure_height, view=view)
+
+def plot_2d_figure(twist, rise, csym, diameter, primitive_unitcell, horizontal, length, lattice_size_factor, marker_size, figure_height):
+  a, b, endpoint = lattice_2d(twist=twist, rise=rise, csym=csym, diameter=diameter, primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+  return plot_2d_lattice(a, b, endpoint, length=length, lattice_size_factor=lattice_size_factor, marker_size=marker_size, figure_height=figure_height)
+
+def plot_2d_2D_to_Helical_figure(ax, ay, bx, by, na, nb, length, lattice_size_factor, marker_size, figure_height):
+  return plot_2d_lattice((ax, ay), (bx, by), endpoint=(na, nb), length=length, lattice_size_factor=lattice_size_factor, marker_size=marker_size, figure_height=figure_height)
+
+def plot_helix_unrolled_2D_to_Helical_figure(ax, ay, bx, by, na, nb, length, marker_size, figure_height, view):
+  twist2, rise2, csym2, diameter2 = helical_lattice(a=(ax, ay), b=(bx, by), endpoint=(na, nb))
+  return plot_helical_lattice_unrolled(diameter2, length, twist2, rise2, csym2, marker_size=marker_size, figure_height=figure_height, view=view)
+
+def plot_helix_2D_to_Helical_figure(ax, ay, bx, by, na, nb, length, marker_size, figure_height, view):
+  twist2, rise2, csym2, diameter2 = helical_lattice(a=(ax, ay), b=(bx, by), endpoint=(na, nb))
+  return plot_helical_lattice(diameter2, length, twist2, rise2, csym2, marker_size=marker_size*0.6, figure_height=figure_height, view=view)
+
+def plot_chirality_map_figure(ax, ay, bx, by, min_diameter, max_diameter, marker_size, figure_height):
+  helices = helical_lattices(a=(ax, ay), b=(bx, by), min_diameter=min_diameter, max_diameter=max_diameter)
+  return plot_chirality_map((ax, ay), (bx, by), helices, min_diameter, max_diameter, marker_size=marker_size, figure_height=figure_height)
+
+def plot_animation_helix_figure(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, marker_size, figure_height):
+  return animate_helical_lattice(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, marker_size=marker_size*0.6, figure_height=figure_height)
+
+def plot_animation_unrolled_figure(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, marker_size, figure_height):
+  return animate_helical_lattice_unrolled(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, marker_size=marker_size, figure_height=figure_height)
+
+# The subunits exported for download (see export.py) as a function of the inputs of a mode: the whole helix, not only
+# the subunits plotted, and the equator na*a+nb*b of the 2D lattice it is rolled from, in the frame of the 2D plot
+def export_helix_parameters(twist, rise, csym, diameter, primitive_unitcell, horizontal, length):
+  a, b, (na, nb) = lattice_2d(twist=twist, rise=rise, csym=csym, diameter=diameter, primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+  return dict(twist=twist, rise=rise, csym=csym, diameter=diameter, length=length, equator=(float(na*a[0]+nb*b[0]), float(na*a[1]+nb*b[1])))
+
+def export_2D_to_Helical_parameters(ax, ay, bx, by, na, nb, length):
+  twist, rise, csym, diameter = helical_lattice(a=(ax, ay), b=(bx, by), endpoint=(na, nb))
+  return dict(twist=twist, rise=rise, csym=csym, diameter=diameter, length=length, equator=(na*ax+nb*bx, na*ay+nb*by))
+
+EXPORT_FUNCTIONS = {
+  "Helical⇒2D": export_helix_parameters,
+  "2D⇒Helical": export_2D_to_Helical_parameters,
+}
+
+# outputs whose zoom sets the view of the helix figures: zooming into the unrolled helix regenerates the subunits
+# of both helix views inside the visible z window, so a long helix is only ever sent a window at a time
+VIEW_SOURCES = ("plot_helix_unrolled", "plot_helix_unrolled_2D_to_Helical")
+
+FIGURE_FUNCTIONS = {
+  "plot_helix": plot_helix_figure,
+  "plot_helix_unrolled": plot_helix_unrolled_figure,
+  "plot_2d": plot_2d_figure,
+  "plot_2d_2D_to_Helical": plot_2d_2D_to_Helical_figure,
+  "plot_helix_unrolled_2D_to_Helical": plot_helix_unrolled_2D_to_Helical_figure,
+  "plot_helix_2D_to_Helical": plot_helix_2D_to_Helical_figure,
+  "plot_chirality_map": plot_chirality_map_figure,
+}
+
+# the mode that shows each output: the inputs applied are shared by all modes, but an output is only computed while
+# its mode is shown
+OUTPUT_MODES = {
+  "plot_helix": "Helical⇒2D",
+  "plot_helix_unrolled": "Helical⇒2D",
+  "plot_2d": "Helical⇒2D",
+  "plot_2d_2D_to_Helical": "2D⇒Helical",
+  "plot_helix_unrolled_2D_to_Helical": "2D⇒Helical",
+  "plot_helix_2D_to_Helical": "2D⇒Helical",
+  "plot_chirality_map": "Chirality map",
+  "chirality_table": "Chirality map",
+  "plot_animation_helix": "Animation",
+  "plot_animation_unrolled": "Animation",
+}
+
+# figures with animation frames, which a FigureWidget cannot play: they are sent whole as HTML and played by plotly.js
+ANIMATION_FUNCTIONS = {
+  "plot_animation_helix": plot_animation_helix_figure,
+  "plot_animation_unrolled": plot_animation_unrolled_figure,
+}
+
+# the initial values of the inputs in conditional_inputs
+DEFAULT_PARAMETERS = {
+  "twist": -81.1, "rise": 19.4, "csym": 1, "diameter": 290.0, "primitive_unitcell": False, "horizontal": True,
+  "ax": 34.65, "ay": 0.0, "bx": 10.63, "by": -23.01, "na": 16, "nb": 1, "min_diameter": 100.0, "max_diameter": 500.0,
+  "twist_end": -75.0, "rise_end": 20.0, "n_frames": 30,
+  "length": 1000.0, "lattice_size_factor": 1.25, "marker_size": 5.0, "figure_height": 800, "view": None,
+}
+
+def figure_parameter_names(figure_function):
+  return tuple(inspect.signature(figure_function).parameters)
+
+def warm_figure_cache(parameter_sets=(DEFAULT_PARAMETERS,)):
+  # build (or find) the figures of every output for these parameter sets, e.g. the default view everyone loads first
+  for parameters in parameter_sets:
+    for output_id, figure_function in {**FIGURE_FUNCTIONS, **ANIMATION_FUNCTIONS}.items():
+      build_figure(output_id, figure_function, {name: parameters[name] for name in figure_parameter_names(figure_function)})
+
+# Index of known 2D lattices for the reverse lookup next to the Helical⇒2D inputs (see lattice_index.py).
+# HELICALLATTICE_LATTICE_INDEX is the .npz file written by "python lattice_index.py build"; it is loaded on first use.
+LATTICE_INDEX_PATH = os.environ.get("HELICALLATTICE_LATTICE_INDEX", "")
+
+@lru_cache(maxsize=1)
+def known_lattices():
+  import lattice_index
+  return lattice_index.LatticeIndex.load(LATTICE_INDEX_PATH)
+
+# The figures of a session left idle for IDLE_EVICT_SECONDS are dropped and rebuilt, mostly from the figure cache,
+# once the session is used again, so that open but unused tabs do not hold on to the worker's memory.
+# Any input change or zoom, and the browser's report of the user at the page, count as use. 0 never evicts.
+IDLE_EVICT_SECONDS = float(os.environ.get("HELICALLATTICE_IDLE_EVICT_SECONDS", 900))
+
+DEBOUNCE_SECONDS = float(os.environ.get("HELICALLATTICE_DEBOUNCE_SECONDS", 0.5))
+
+def invalidate_later(delay):
+  # reactive.invalidate_later, but a timer cancelled while it waits for the reactive lock ends quietly. Shiny prints a
+  # traceback for it, which under load happens to debounce timers all the time: the next keystroke, or the end of
+  # the session, cancels a timer that is waiting for another session's flush
+  ctx = reactive.get_current_context()
+  deadline = time.monotonic() + delay
+  waiting = True
+
+  async def invalidate():
+    nonlocal waiting
+    try:
+      await asyncio.sleep(deadline - time.monotonic())
+      async with reactive.lock():
+        waiting = False  # the invalidation below must not cancel the flush it starts
+        ctx.invalidate()
+        await reactive.flush()
+    finally:
+      if unsubscribe: unsubscribe()
+
+  def cancel():
+    if waiting: task.cancel()
+
+  task = asyncio.create_task(invalidate())
+  ctx.on_invalidate(cancel)
+  current_session = shiny.session.get_current_session()
+  unsubscribe = current_session.on_ended(cancel) if current_session else None
+
+class AppliedInputs:
+  # debounced counterpart of the session's inputs: applied_input.twist() is the value of input.twist last applied to the plots
+  def __init__(self, names):
+    self._values = {name: reactive.value(None) for name in names}
+
+  def __getattr__(self, name):
+    value = self._values[name]
+    def get():
+      req(value() is not None)
+      return value()
+    return get
+
+  def __getitem__(self, name):
+    return getattr(self, name)
+
+  def is_set(self, names):
+    return all(self._values[name]() is not None for name in names)
+
+  def apply(self, params):
+    # only the changed values invalidate their dependents
+    for name, value in params.items():
+      if self._values[name]() != value:
+        self._values[name].set(value)
+
 def server(input, output, session):
     
     """@reactive.Effect
@@ -161,6 +505,295 @@ def server(input, output, session):
     """
 
 
+    compute_tasks = {}
+    view = reactive.value(None)  # axis ranges zoomed to in the unrolled helix view, None for the whole helix
+    memory = session_memory.SessionMemory(session.id)  # approximate bytes held by the outputs of this session
+    session.on_ended(memory.close)
+    evicted = reactive.value(False)  # the figures were dropped after IDLE_EVICT_SECONDS without use
+
+    @reactive.effect
+    @reactive.event(input.radio)
+    def _():
+        view.set(None)
+
+    def figure_widget_output(output_id, figure_function):
+        # Keep one persistent FigureWidget per output and patch it in place on input changes.
+        # The widget is only rebuilt when the mode or the trace structure (e.g. csym) changes;
+        # otherwise only the changed properties are sent to the browser inside a batch update.
+        # The figure is built off the event loop in an extended task, from the applied values of the inputs it depends on.
+        structure = reactive.value(None)
+        slot = ComputeSlot()
+        names = figure_parameter_names(figure_function)
+        held = {}  # approximate bytes held by the figure and by the widget of this output
+
+        def account(part, fig):
+            held[part] = session_memory.figure_bytes(fig)
+            memory.record(output_id, sum(held.values()))
+
+        @reactive.extended_task
+        async def build(parameters):
+            if parameters is None:
+                return None  # hidden or evicted: drop the figure
+            return await slot.run(build_figure, output_id, figure_function, parameters)
+
+        compute_tasks[output_id] = build
+
+        @reactive.effect
+        def _():
+            # outside its mode, or once evicted, the figure is dropped and nothing is computed for it
+            shown = input.radio() == OUTPUT_MODES[output_id] and not evicted()
+            parameters = {name: view() if name == "view" else applied_input[name]() for name in names} if shown else None
+            build.cancel()  # a newer parameter set supersedes the one being built, whose result is discarded
+            build.invoke(parameters)
+
+        @reactive.calc
+        def figure():
+            return build.result()
+
+        @reactive.effect
+        def _():
+            fig = figure()
+            account("figure", fig)
+            new_structure = None if fig is None else figure_structure(fig)
+            with reactive.isolate():
+                if new_structure != structure():
+                    structure.set(new_structure)
+
+        @output(id=output_id)
+        @render_widget
+        def _widget():
+            input.radio()
+            if structure() is None:
+                account("widget", None)
+                return None  # not built yet, or evicted: shinywidgets only lets go of the previous widget on None
+            with reactive.isolate():
+                fig = figure()
+            metrics.FIGURE_BYTES.observe(len(fig.to_json()), output=output_id, kind="full")
+            widget = go.FigureWidget(fig)
+            if output_id in VIEW_SOURCES:
+                widget.layout.on_change(record_view, "xaxis.range", "yaxis.range")
+            account("widget", widget)
+            return widget
+
+        patching = False
+
+        def record_view(layout, x_range, z_range):
+            # axis ranges set by the user's zoom or pan in the browser; the server's own patches are not zooms
+            if patching or x_range is None or z_range is None:
+                return
+            new_view = {"x": [float(v) for v in x_range], "z": [float(v) for v in z_range]}
+            with reactive.isolate():
+                if new_view != view():
+                    view.set(new_view)
+
+        @reactive.effect
+        def _():
+            nonlocal patching
+            fig = figure()
+            widget = _widget.widget
+            if fig is None:
+                return
+            patching = True
+            try:
+                nbytes = update_figure_widget(widget, fig)
+            finally:
+                patching = False
+            account("widget", widget)
+            if nbytes:
+                metrics.FIGURE_BYTES.observe(nbytes, output=output_id, kind="patch")
+
+    def figure_html_output(output_id, figure_function):
+        # animated figures are built like the widgets but sent whole, with all their frames, as HTML.
+        # They are only built while their mode is shown, as every frame is computed up front
+        slot = ComputeSlot()
+        names = figure_parameter_names(figure_function)
+
+        @reactive.extended_task
+        async def build(parameters):
+            if parameters is None:
+                return None
+            return await slot.run(build_figure_html, output_id, figure_function, parameters)
+
+        compute_tasks[output_id] = build
+
+        @reactive.effect
+        def _():
+            shown = input.radio() == OUTPUT_MODES[output_id] and not evicted()
+            parameters = {name: applied_input[name]() for name in names} if shown else None
+            build.cancel()
+            build.invoke(parameters)
+
+        @output(id=output_id)
+        @render.ui
+        def _html():
+            html = build.result()
+            memory.record(output_id, len(html or ""))
+            req(html is not None)
+            metrics.FIGURE_BYTES.observe(len(html), output=output_id, kind="full")
+            return ui.TagList(plotly_js_dependency(), ui.HTML(html))
+
+    # the helices of the chirality map are also listed in a table, computed like a figure
+    chirality_slot = ComputeSlot()
+
+    @reactive.extended_task
+    async def chirality_helices(parameters):
+        if parameters is None:
+            return None
+        return await chirality_slot.run(helical_lattices, **parameters)
+
+    compute_tasks["chirality_table"] = chirality_helices
+
+    @reactive.effect
+    def _():
+        shown = input.radio() == OUTPUT_MODES["chirality_table"] and not evicted()
+        parameters = dict(a=(applied_input.ax(), applied_input.ay()), b=(applied_input.bx(), applied_input.by()), min_diameter=applied_input.min_diameter(), max_diameter=applied_input.max_diameter()) if shown else None
+        chirality_helices.cancel()
+        chirality_helices.invoke(parameters)
+
+    @output
+    @render.ui
+    def chirality_table():
+        helices = chirality_helices.result()
+        req(helices is not None)  # not in the chirality map mode
+        return chirality_table_ui(helices, sort_by=input.chirality_sort(), descending=input.chirality_descending())
+
+    @output
+    @render.ui
+    def lattice_matches():
+        req(LATTICE_INDEX_PATH, input.match_twist_tolerance(), input.match_rise_tolerance())
+        matches = known_lattices().query(applied_input.twist(), applied_input.rise(), applied_input.csym(), applied_input.diameter(),
+            twist_tolerance=input.match_twist_tolerance(), rise_tolerance=input.match_rise_tolerance(), diameter_tolerance=input.match_diameter_tolerance() or None)
+        return lattice_matches_ui(matches)
+
+    # the coordinates of the whole helix shown, streamed chunk by chunk as the compute pool generates them
+    @render.download_button(filename=lambda: f"helical_lattice_{input.export_content()}.{input.export_format()}")
+    async def download_coordinates():
+        import export
+        export_function = EXPORT_FUNCTIONS[input.radio()]
+        parameters = export_function(**{name: applied_input[name]() for name in figure_parameter_names(export_function)})
+        try:
+            chunks = export.export_chunks(input.export_format(), input.export_content(), **parameters)
+        except ValueError as e:
+            ui.notification_show(f"Export failed: {e}", type="error", duration=10)
+            return
+        async for chunk in iterate_in_pool(chunks):
+            yield chunk
+
+    # the uploaded asymmetric unit, assembled with the helical symmetry shown along the whole helical length
+    assembly_slot = ComputeSlot()
+
+    def asu_upload():
+        # the uploaded file, None before any upload
+        return input.asu_model()[0] if input.asu_model.is_set() and input.asu_model() else None
+
+    @reactive.calc
+    def asu_model():
+        import assembly
+        upload = req(asu_upload())
+        return assembly.read_model(upload["datapath"], name=upload["name"])
+
+    @output
+    @render.ui
+    def asu_summary():
+        try:
+            model = asu_model()
+        except ValueError as e:
+            return ui.p(f"Could not read the model: {e}", style="color: red;")
+        return ui.p(f"{len(model)} atoms in {len(model.chains)} chains", style="color: grey;")
+
+    def assembly_name():
+        upload = asu_upload()
+        name = os.path.basename(upload["name"]) if upload else "asu"
+        for extension in (".gz", ".pdb", ".ent", ".cif", ".mmcif"):
+            name = name.removesuffix(extension)
+        return f"{name}_filament"
+
+    @render.download_button(filename=lambda: f"{assembly_name()}.{input.assembly_format()}")
+    async def download_assembly():
+        import assembly
+        if asu_upload() is None:
+            ui.notification_show("Upload a model of the asymmetric unit first", type="warning")
+            return
+        export_function = EXPORT_FUNCTIONS[input.radio()]
+        p = export_function(**{name: applied_input[name]() for name in figure_parameter_names(export_function)})
+        try:
+            model = asu_model()
+            chunks = await assembly_slot.run(assembly.assembly_chunks, input.assembly_format(), model, p["twist"], p["rise"], p["csym"], p["length"],
+                center=(input.axis_x() or 0.0, input.axis_y() or 0.0), name=assembly_name())
+        except (ValueError, TimeoutError) as e:
+            ui.notification_show(f"Assembly failed: {e}", type="error", duration=10)
+            return
+        async for chunk in iterate_in_pool(chunks):
+            yield chunk
+
+    @output
+    @render.ui
+    def compute_status():
+        statuses = {output_id: task.status() for output_id, task in compute_tasks.items()}
+        errors = []
+        for output_id, status in statuses.items():
+            if status == "error":
+                with reactive.isolate():
+                    error = compute_tasks[output_id].error()
+                errors.append(f"{output_id}: {error or type(error).__name__}")
+        if errors:
+            return ui.div(*[ui.p(e) for e in errors], style="color: red; text-align: center;")
+        if "running" in statuses.values():
+            return ui.div("Computing…", style="color: grey; text-align: center;")
+
+    # Inputs reach the plots only once they have been left unchanged for DEBOUNCE_SECONDS, or when Apply is clicked
+    # in manual mode, so typing "290" renders once instead of for "2", "29" and "290".
+    # A newer parameter set replaces the pending one before any work is started for it.
+    applied_input = AppliedInputs({name for names in MODE_PARAMETERS.values() for name in names})
+    pending = reactive.value(None)  # (parameter set, time of its last change)
+
+    @reactive.effect
+    def _():
+        params = {name: input[name]() for name in MODE_PARAMETERS[input.radio()]}
+        with reactive.isolate():
+            pending.set((params, time.monotonic()))
+            if not applied_input.is_set(params):
+                applied_input.apply(params)  # nothing is shown yet: apply the initial values at once
+
+    @reactive.effect
+    def _():
+        req(pending() is not None and not input.manual_apply())
+        params, changed = pending()
+        remaining = DEBOUNCE_SECONDS - (time.monotonic() - changed)
+        if remaining > 0:
+            invalidate_later(remaining)
+            return
+        with reactive.isolate():
+            applied_input.apply(params)
+
+    @reactive.effect
+    @reactive.event(input.apply)
+    def _():
+        req(pending() is not None)
+        applied_input.apply(pending()[0])
+
+    @reactive.effect
+    def _():
+        pending(), view()
+        memory.touch()
+        with reactive.isolate():
+            if evicted():
+                memory.evicted = False
+                evicted.set(False)  # rebuilds the figures
+        input.activity()  # reported by the browser while the user is at the page, unset until then
+
+    @reactive.effect
+    def _():
+        req(IDLE_EVICT_SECONDS > 0 and not evicted())
+        remaining = IDLE_EVICT_SECONDS - memory.idle_seconds()
+        if remaining > 0:
+            invalidate_later(remaining)
+            return
+        session_memory.EVICTIONS.inc()
+        session_memory.EVICTED_BYTES.inc(memory.total())
+        memory.evicted = True
+        evicted.set(True)
+
     @reactive.Effect
     def _():
         query_params = get_client_url_query_params(input)
@@ -216,6 +849,39 @@ def server(input, output, session):
                 ui.input_numeric("lattice_size_factor", "2D lattice size factor", value=1.25, min=1.0, step=0.1),
                 ui.input_numeric("marker_size", "Marker size (Å)", value=5.0, min=0.1, step=1.0),
                 ui.input_numeric("figure_height", "Plot height (pixels)", value=800, min=1, step=10),
+                *([
+                    ui.h5("Known 2D lattices with this helical symmetry"),
+                    ui.input_numeric("match_twist_tolerance", "Twist tolerance (°)", value=1.0, min=0.001, step=0.1),
+                    ui.input_numeric("match_rise_tolerance", "Rise tolerance (Å)", value=0.5, min=0.001, step=0.1),
+                    ui.input_numeric("match_diameter_tolerance", "Diameter tolerance (Å, 0: any)", value=20.0, min=0.0, step=1.0),
+                    ui.output_ui("lattice_matches"),
+                ] if LATTICE_INDEX_PATH else []),
+                export_inputs(),
+                assembly_inputs(),
+            )
+        elif input.radio() == "Chirality map":
+            return ui.TagList(
+                ui.input_numeric("ax", "Unit cell vector a.x (Å)", value=34.65, step=1.0),
+                ui.input_numeric("ay", "Unit cell vector a.y (Å)", value=0.0, step=1.0),
+                ui.input_numeric("bx", "Unit cell vector b.x (Å)", value=10.63, step=1.0),
+                ui.input_numeric("by", "Unit cell vector b.y (Å)", value=-23.01, step=1.0),
+                ui.input_numeric("min_diameter", "Minimal helical diameter (Å)", value=100.0, min=0.0, step=10.0),
+                ui.input_numeric("max_diameter", "Maximal helical diameter (Å)", value=500.0, min=0.1, step=10.0),
+                ui.input_numeric("marker_size", "Marker size (Å)", value=5.0, min=0.1, step=1.0),
+                ui.input_numeric("figure_height", "Plot height (pixels)", value=800, min=1, step=10),
+            )
+        elif input.radio() == "Animation":
+            return ui.TagList(
+                ui.input_numeric('twist', 'Start twist (°)', value=-81.1, min=-180., max=180., step=1.0),
+                ui.input_numeric('rise', 'Start rise (Å)', value=19.4, min=0.001, step=1.0),
+                ui.input_numeric('twist_end', 'End twist (°)', value=-75.0, min=-180., max=180., step=1.0),
+                ui.input_numeric('rise_end', 'End rise (Å)', value=20.0, min=0.001, step=1.0),
+                ui.input_numeric('csym', 'Axial symmetry', value=1, min=1, step=1),
+                ui.input_numeric('diameter', 'Helical diameter (Å)', value=290.0, min=0.1, step=1.0),
+                ui.input_numeric("length", "Helical length (Å)", value=1000.0, min=0.1, step=1.0),
+                ui.input_numeric("n_frames", "Frames", value=30, min=2, max=MAX_ANIMATION_FRAMES, step=1),
+                ui.input_numeric("marker_size", "Marker size (Å)", value=5.0, min=0.1, step=1.0),
+                ui.input_numeric("figure_height", "Plot height (pixels)", value=800, min=1, step=10),
             )
         elif input.radio() == "2D⇒Helical":
             return ui.TagList(
@@ -229,11 +895,37 @@ def server(input, output, session):
                 ui.input_numeric("lattice_size_factor", "2D lattice size factor", value=1.25, min=1.0, step=0.1),
                 ui.input_numeric("marker_size", "Marker size (Å)", value=5.0, min=0.1, step=1.0),
                 ui.input_numeric("figure_height", "Plot height (pixels)", value=800, min=1, step=10),
+                export_inputs(),
+                assembly_inputs(),
             )
 
     @output
     @render.ui
     def dynamic_plot():
+        if input.radio() == "Chirality map":
+            col2 = ui.column(7,
+                ui.h3("Chirality map: the helical lattices rolled up from the 2D lattice along each equator within the diameter range"),
+                output_widget("plot_chirality_map")
+            )
+            col3 = ui.column(5,
+                ui.h3("Helical lattices"),
+                ui.row(
+                    ui.column(6, ui.input_select("chirality_sort", "Sort by", {name: label for name, label in CHIRALITY_COLUMNS.items()}, selected="diameter")),
+                    ui.column(6, ui.input_checkbox("chirality_descending", "Descending", value=False)),
+                ),
+                ui.output_ui("chirality_table")
+            )
+            return ui.TagList(ui.row(col2, col3))
+        if input.radio() == "Animation":
+            col2 = ui.column(6,
+                ui.h3("Helical Lattice: morphing from the start to the end twist and rise"),
+                ui.output_ui("plot_animation_helix")
+            )
+            col3 = ui.column(6,
+                ui.h3("Helical Lattice: unrolled into a 2D lattice"),
+                ui.output_ui("plot_animation_unrolled")
+            )
+            return ui.TagList(ui.row(col2, col3))
         if input.radio() == "2D⇒Helical":
             col2 = ui.column(4,
                 ui.h3("2D Lattice: from which a block of area is selected to be rolled into a helix"),
@@ -263,110 +955,22 @@ def server(input, output, session):
 
         return ui.TagList(ui.row(col2, col3, col4))
     
-    @output
-    @render_widget
-    def plot_helix():
-        diameter = input.diameter()
-        length = input.length()
-        twist = input.twist()
-        rise = input.rise()
-        csym = input.csym()
-        marker_size = input.marker_size()
-        figure_height = input.figure_height()
-        fig = plot_helical_lattice(diameter, length, twist, rise, csym, marker_size=marker_size*0.6, figure_height=figure_height)
-        return fig
-    
-    @output
-    @render_widget
-    def plot_helix_unrolled():
-        diameter = input.diameter()
-        length = input.length()
-        twist = input.twist()
-        rise = input.rise()
-        csym = input.csym()
-        marker_size = input.marker_size()
-        figure_height = input.figure_height()
-        fig = plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_size=marker_size, figure_height=figure_height)
-        return fig
-    
-    @output
-    @render_widget
-    def plot_2d():
-      a, b, endpoint = convert_helical_lattice_to_2d_lattice(
-          twist=input.twist(),
-          rise=input.rise(),
-          csym=input.csym(),
-          diameter=input.diameter(),
-          primitive_unitcell=input.primitive_unitcell(),
-          horizontal=input.horizontal()
-      )
-      length = input.length()
-      lattice_size_factor = input.lattice_size_factor()
-      marker_size = input.marker_size()
-      figure_height = input.figure_height()
-      fig = plot_2d_lattice(a, b, endpoint, length=length, lattice_size_factor=lattice_size_factor, marker_size=marker_size, figure_height=figure_height)
-      return fig
-    
-    @output
-    @render_widget
-    def plot_2d_2D_to_Helical():
-      na = input.na()
-      nb = input.nb()
-      ax = input.ax()
-      ay = input.ay()
-      bx = input.bx()
-      by = input.by()
-      a = (ax, ay)
-      b = (bx, by)
-      length = input.length()
-      lattice_size_factor = input.lattice_size_factor()
-      marker_size = input.marker_size()
-      figure_height = input.figure_height()
-      fig = plot_2d_lattice(a, b, endpoint=(na, nb), length=length, lattice_size_factor=lattice_size_factor, marker_size=marker_size, figure_height=figure_height)
-      return fig
-
-    @output
-    @render_widget
-    def plot_helix_unrolled_2D_to_Helical():
-      na = input.na()
-      nb = input.nb()  # Fixed: was input.na()
-      ax = input.ax()
-      ay = input.ay()
-      bx = input.bx()
-      by = input.by()
-      a = (ax, ay)
-      b = (bx, by)
-      twist2, rise2, csym2, diameter2 = convert_2d_lattice_to_helical_lattice(a=a, b=b, endpoint=(na, nb))
-
-      length = input.length()
-      marker_size = input.marker_size()
-      figure_height = input.figure_height()
-      fig = plot_helical_lattice_unrolled(diameter2, length, twist2, rise2, csym2, marker_size=marker_size, figure_height=figure_height)
-      return fig
-
-    @output
-    @render_widget
-    def plot_helix_2D_to_Helical():
-        na = input.na()
-        nb = input.nb()
-        ax = input.ax()
-        ay = input.ay()
-        bx = input.bx()
-        by = input.by()
-        a = (ax, ay)
-        b = (bx, by)
-        twist2, rise2, csym2, diameter2 = convert_2d_lattice_to_helical_lattice(a=a, b=b, endpoint=(na, nb))
-        length = input.length()
-        marker_size = input.marker_size()
-        figure_height = input.figure_height()
-        fig = plot_helical_lattice(diameter2, length, twist2, rise2, csym2, marker_size=marker_size*0.6, figure_height=figure_height)
-        return fig
+    for output_id, figure_function in FIGURE_FUNCTIONS.items():
+        figure_widget_output(output_id, figure_function)
+    for output_id, figure_function in ANIMATION_FUNCTIONS.items():
+        figure_html_output(output_id, figure_function)
 
 
-    
-
 # Run the app
 app = App(app_ui, server)
+app.starlette_app.router.routes.insert(0, Route("/metrics", metrics.metrics_endpoint))
+app.starlette_app.router.routes.insert(0, Route("/sessions", session_memory.sessions_endpoint))
+
+if FIGURE_CACHE is not None and os.environ.get("HELICALLATTICE_FIGURE_CACHE_WARMUP"):
+  if COMPUTE_EXECUTOR is not None:
+    COMPUTE_EXECUTOR.submit(warm_figure_cache)
+  else:
+    warm_figure_cache()
 
 ui.head_content(
     ui.HTML(
@@ -386,7 +990,97 @@ ui.head_content(
 ui.head_content(ui.tags.title("Helical Lattice"))
 
 
-def plot_2d_lattice(a=(1, 0), b=(0, 1), endpoint=(10, 0), length=10, lattice_size_factor=1.25, marker_size=10, figure_height=500):
+def lattice_points_in_window(a, b, xmin, xmax, ymin, ymax):
+  # all lattice points i*a+j*b inside the window, one row of constant j at a time:
+  # for each j, the admissible i form a contiguous interval that is solved for directly
+  a = np.asarray(a, dtype=float)
+  b = np.asarray(b, dtype=float)
+  m = np.vstack((a, b)).T
+  corners = np.array([(xmin, ymin), (xmin, ymax), (xmax, ymin), (xmax, ymax)]).T
+  _, nbs = np.linalg.solve(m, corners)
+  j = np.arange(np.floor(nbs.min())-1, np.ceil(nbs.max())+2)
+  lo = np.full(j.shape, -np.inf)
+  hi = np.full(j.shape, np.inf)
+  for k, (vmin, vmax) in enumerate(((xmin, xmax), (ymin, ymax))):
+    r = j*b[k]
+    if a[k] > 0:
+      lo = np.maximum(lo, (vmin-r)/a[k])
+      hi = np.minimum(hi, (vmax-r)/a[k])
+    elif a[k] < 0:
+      lo = np.maximum(lo, (vmax-r)/a[k])
+      hi = np.minimum(hi, (vmin-r)/a[k])
+    else:
+      outside = (r < vmin) | (r > vmax)
+      lo[outside] = np.inf
+  valid = lo <= hi
+  lo = np.ceil(lo[valid])
+  hi = np.floor(hi[valid])
+  j = j[valid]
+  counts = np.maximum(hi-lo+1, 0).astype(np.int64)
+  total = int(counts.sum())
+  jj = np.repeat(j, counts)
+  ii = np.repeat(lo, counts) + (np.arange(total) - np.repeat(np.cumsum(counts)-counts, counts))
+  x = ii*a[0] + jj*b[0]
+  y = ii*a[1] + jj*b[1]
+  return x, y
+
+def count_lattice_points_in_window(a, b, xmin, xmax, ymin, ymax):
+  # cheap estimate (area ratio) used to keep the window within the point budget before enumerating
+  cell_area = abs(a[0]*b[1]-a[1]*b[0])
+  return (xmax-xmin)*(ymax-ymin)/cell_area
+
+def subunit_traces(trace_class, coords, labels=None):
+  # coords: {axis: array with one row per symmetry copy}. One marker trace per copy, in the default colors,
+  # names and hover text of a plotly express scatter colored by csym
+  csym = len(next(iter(coords.values())))
+  hover = "<br>".join(f"{(labels or {}).get(axis, axis)}=%{{{axis}}}" for axis in coords)
+  traces = []
+  for si in range(csym):
+    if csym>1:
+      style = dict(name=str(si), legendgroup=str(si), showlegend=True, hovertemplate=f"csym={si}<br>{hover}<extra></extra>")
+    else:
+      style = dict(name="", showlegend=False, hovertemplate=f"{hover}<extra></extra>")
+    color = qualitative.Plotly[si % len(qualitative.Plotly)]
+    traces.append(trace_class(mode="markers", marker=dict(color=color, symbol="circle"), **{axis: v[si] for axis, v in coords.items()}, **style))
+  return traces
+
+def subunit_figure(traces, csym):
+  fig = go.Figure(traces)
+  fig.update_layout(margin=dict(t=60))
+  if csym>1:
+    fig.update_layout(legend=dict(title_text="csym", tracegroupgap=0))
+  return fig
+
+WEBGL_POINT_THRESHOLD = int(os.environ.get("HELICALLATTICE_WEBGL_POINT_THRESHOLD", 2000))
+
+def apply_render_backend(fig, webgl_threshold=None):
+  # once any 2D trace exceeds the threshold, all of them are drawn with WebGL (Scattergl) so that they share
+  # one layer and styling; below it all stay SVG
+  if webgl_threshold is None: webgl_threshold = WEBGL_POINT_THRESHOLD
+  n = max((np.size(trace.x) for trace in fig.data if trace.type in ("scatter", "scattergl")), default=0)
+  backend = "webgl" if n > webgl_threshold else "svg"
+  trace_class, trace_type = (go.Scattergl, "scattergl") if backend == "webgl" else (go.Scatter, "scatter")
+  converted = [k for k, trace in enumerate(fig.data) if trace.type in ("scatter", "scattergl") and trace.type != trace_type]
+  if not converted:
+    return fig
+  # the other traces stay in place: the converted ones are appended, then all are put back in their order
+  kept = [k for k in range(len(fig.data)) if k not in converted]
+  traces = []
+  for k in converted:
+    props = fig.data[k].to_plotly_json()
+    props.pop("type")
+    traces.append(trace_class(props, skip_invalid=True))
+  fig.data = [fig.data[k] for k in kept]
+  fig.add_traces(traces)
+  order = kept + converted
+  fig.data = [fig.data[order.index(k)] for k in range(len(order))]
+  return fig
+
+def render_backend(fig):
+  # 3D traces are always drawn with WebGL
+  return "webgl" if any(trace.type in ("scattergl", "scatter3d") for trace in fig.data) else "svg"
+
+def plot_2d_lattice(a=(1, 0), b=(0, 1), endpoint=(10, 0), length=10, lattice_size_factor=1.25, marker_size=10, figure_height=500, max_points=50000, webgl_threshold=None):
   a = np.array(a)
   b = np.array(b)
   na, nb = endpoint
@@ -404,43 +1098,24 @@ def plot_2d_lattice(a=(1, 0), b=(0, 1), endpoint=(10, 0), length=10, lattice_siz
   ymin = y0 - pad
   ymax = y1 + pad
 
-  nas = []
-  nbs = []
-  m = np.vstack((a, b)).T
-  for v in [(xmin, ymin), (xmin, ymax), (xmax, ymin), (xmax, ymax)]:
-    tmp_a, tmp_b = np.linalg.solve(m, v)
-    nas.append(tmp_a)
-    nbs.append(tmp_b)
-  na_min = np.floor(sorted(nas)[0])-2
-  na_max = np.floor(sorted(nas)[-1])+2
-  nb_min = np.floor(sorted(nbs)[0])-2
-  nb_max = np.floor(sorted(nbs)[-1])+2
-
-  ia = np.arange(na_min, na_max)
-  ib = np.arange(nb_min, nb_max)
-  x = []
-  y = []
-  for j in ib:
-    for i in ia:
-      v = i*a+j*b
-      if xmin <= v[0] <= xmax and ymin <= v[1] <= ymax:
-        x.append(v[0])
-        y.append(v[1])
-
-  import pandas as pd
-  import plotly.express as px
-  import plotly.graph_objects as go
-
-  df = pd.DataFrame({'x':x, 'y':y})
-  fig = px.scatter(df, x='x', y='y')
+  # the window always holds the origin and the equator: beyond max_points lattice points, only the points i*a+j*b
+  # with i and j multiples of step are drawn, a sublattice step² times sparser that still contains the origin
+  step = 1
+  n_estimate = count_lattice_points_in_window(a, b, xmin, xmax, ymin, ymax)
+  if max_points and n_estimate > max_points:
+    import warnings
+    step = int(np.ceil(np.sqrt(n_estimate/max_points)))
+    warnings.warn(f"plot_2d_lattice: ~{int(n_estimate)} lattice points exceed max_points={max_points}, 1 in {step*step} of them is plotted")
+
+  x, y = lattice_points_in_window(step*a, step*b, xmin, xmax, ymin, ymax)
+
+  points = subunit_traces(go.Scatter, dict(x=x[None], y=y[None]))
 
   x, y = zip(*corner_points)
   x = [*x, 0]
   y = [*y, 0]
   rectangle = go.Scatter(x=x, y=y, fill="toself", mode='lines', line = dict(color='green', width=marker_size/5, dash='dash'))
-  fig.add_trace(rectangle)
-  
-  fig.data = (fig.data[1], fig.data[0])
+  fig = subunit_figure([rectangle, *points], csym=1)
 
   arrow_start = [0, 0]
   arrow_end = na*a
@@ -509,51 +1184,138 @@ def plot_2d_lattice(a=(1, 0), b=(0, 1), endpoint=(10, 0), length=10, lattice_siz
 
   #title = "$\\vec{a}=(" + f"{a[0]:.1f}, {a[1]:.1f})Å" + "\\quad\\vec{b}=(" +f"{b[0]:.1f}, {b[1]:.1f})Å" + "\\quad equator=(0,0) \\to" + f"{na}" + "\\vec{a}+" +f"{nb}" + "\\vec{b}$"
   title = f"a=({a[0]:.2f}, {a[1]:.2f})Å\tb=({b[0]:.2f}, {b[1]:.2f})Å<br>equator=(0,0)→{na}*a{'+' if nb>=0 else ''}{nb}*b\tcircumference={circumference:.2f}"
+  if step > 1:
+    title += f"<br>(overview: 1 in {step*step} lattice points shown)"
   fig.update_layout(title_text=title, title_x=0.5, title_xanchor="center")
   fig.update_layout(height=figure_height)
   fig.update_layout(paper_bgcolor='rgba(0, 0, 0, 0)', plot_bgcolor='rgba(0, 0, 0, 0)')
+  apply_render_backend(fig, webgl_threshold)
 
   return fig
 
-def plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_size=10, figure_height=800):
+CHIRALITY_COLUMNS = {"na": "na", "nb": "nb", "twist": "Twist (°)", "rise": "Rise (Å)", "csym": "csym", "diameter": "Diameter (Å)"}
+CHIRALITY_TABLE_ROWS = 200
+
+def plot_chirality_map(a, b, helices, min_diameter, max_diameter, marker_size=10, figure_height=800, webgl_threshold=None):
+  # like a nanotube chirality map: one marker per endpoint (na, nb) at its equator vector na*a+nb*b, colored by twist
+  a = np.array(a, dtype=float)
+  b = np.array(b, dtype=float)
+  x = helices["na"]*a[0] + helices["nb"]*b[0]
+  y = helices["na"]*a[1] + helices["nb"]*b[1]
+
+  customdata = np.column_stack([helices[name] for name in CHIRALITY_COLUMNS]).astype(np.float32)  # only shown to 2 decimals
+  hovertemplate = "na=%{customdata[0]} nb=%{customdata[1]}<br>twist=%{customdata[2]:.2f}° rise=%{customdata[3]:.2f}Å<br>csym=%{customdata[4]} diameter=%{customdata[5]:.2f}Å<extra></extra>"
+  marker = dict(size=marker_size, color=helices["twist"].astype(np.float32), colorscale="RdBu", cmid=0, colorbar=dict(title=dict(text="twist (°)")))
+  points = go.Scatter(x=x, y=y, mode="markers", marker=marker, customdata=customdata, hovertemplate=hovertemplate, showlegend=False)
+
+  # arcs at the two ends of the diameter range, on the side of a where the endpoints lie (nb > 0)
+  start = np.arctan2(a[1], a[0])
+  side = 1 if a[0]*b[1]-a[1]*b[0] > 0 else -1
+  theta = start + side*np.linspace(0, np.pi, 181)
+  arcs = [go.Scatter(x=np.pi*d*np.cos(theta), y=np.pi*d*np.sin(theta), mode="lines", line=dict(color="grey", width=1, dash="dash"), hoverinfo="skip", showlegend=False) for d in (min_diameter, max_diameter)]
+
+  fig = go.Figure([*arcs, points])
+  fig.update_yaxes(scaleanchor="x", scaleratio=1)
+  fig.update_layout(
+    xaxis=dict(title="X (Å)", constrain="domain"),
+    yaxis=dict(title="Y (Å)", constrain="domain")
+  )
+  title = f"a=({a[0]:.2f}, {a[1]:.2f})Å\tb=({b[0]:.2f}, {b[1]:.2f})Å<br>{len(helices)} helices with diameter {min_diameter:g}-{max_diameter:g}Å"
+  fig.update_layout(title_text=title, title_x=0.5, title_xanchor="center")
+  fig.update_layout(height=figure_height, margin=dict(t=60))
+  fig.update_layout(paper_bgcolor='rgba(0, 0, 0, 0)', plot_bgcolor='rgba(0, 0, 0, 0)')
+  apply_render_backend(fig, webgl_threshold)
+
+  return fig
+
+def chirality_table_ui(helices, sort_by="diameter", descending=False, max_rows=CHIRALITY_TABLE_ROWS):
+  # the first max_rows helices in the chosen order, as an HTML table
+  order = np.argsort(helices[sort_by], kind="stable")
+  if descending: order = order[::-1]
+  rows = helices[order[:max_rows]]
+  header = ui.tags.tr(*[ui.tags.th(label) for label in CHIRALITY_COLUMNS.values()])
+  body = [ui.tags.tr(*[ui.tags.td(f"{row[name]:.2f}" if helices.dtype[name].kind == "f" else str(row[name])) for name in CHIRALITY_COLUMNS]) for row in rows]
+  note = f"first {len(rows)} of {len(helices)} helices" if len(rows) < len(helices) else f"{len(helices)} helices"
+  return ui.div(
+    ui.tags.table(ui.tags.thead(header), ui.tags.tbody(*body), class_="table table-sm table-striped"),
+    ui.p(note, style="text-align: center; color: grey;"),
+    style="max-height: 800px; overflow-y: auto;"
+  )
+
+def lattice_matches_ui(matches):
+  # the 2D lattices and endpoints found by known_lattices().query, nearest first
+  if not len(matches):
+    return ui.p("no match within the tolerances", style="color: grey;")
+  header = ui.tags.tr(*[ui.tags.th(label) for label in ("lattice", "na", "nb", "twist", "rise", "diameter")])
+  body = [ui.tags.tr(ui.tags.td(m["name"]), ui.tags.td(str(m["na"])), ui.tags.td(str(m["nb"])), ui.tags.td(f"{m['twist']:.2f}"), ui.tags.td(f"{m['rise']:.2f}"), ui.tags.td(f"{m['diameter']:.1f}"),
+    title=f"a=({m['ax']:.2f}, {m['ay']:.2f})Å b=({m['bx']:.2f}, {m['by']:.2f})Å") for m in matches]
+  return ui.tags.table(ui.tags.thead(header), ui.tags.tbody(*body), class_="table table-sm table-striped")
+
+EXPORT_CONTENTS = {"helix": "Helix: x, y, z", "unrolled": "Unrolled: twist, arc, z", "lattice": "2D lattice: x, y"}
+EXPORT_FORMATS = {"csv": "CSV", "npz": "NumPy .npz", "pdb": "PDB pseudo-atoms"}
+
+def export_inputs():
+  # download of the coordinates of all subunits of the helix, of any length
+  return ui.TagList(
+    ui.h5("Export coordinates"),
+    ui.input_select("export_content", "Coordinates", EXPORT_CONTENTS),
+    ui.input_select("export_format", "Format", EXPORT_FORMATS),
+    ui.download_button("download_coordinates", "Download"),
+  )
+
+ASSEMBLY_FORMATS = {"cif": "mmCIF", "pdb": "PDB", "npy": "NumPy .npy: copy, atom, xyz"}
+
+def assembly_inputs():
+  # the filament built from an uploaded model of its asymmetric unit with the helical symmetry shown, see assembly.py
+  return ui.TagList(
+    ui.h5("Build the filament from a subunit model"),
+    ui.input_file("asu_model", "Asymmetric unit (PDB or mmCIF)", accept=[".pdb", ".ent", ".cif", ".mmcif", ".gz"]),
+    ui.output_ui("asu_summary"),
+    ui.input_numeric("axis_x", "Helical axis x (Å)", value=0.0, step=1.0),
+    ui.input_numeric("axis_y", "Helical axis y (Å)", value=0.0, step=1.0),
+    ui.input_select("assembly_format", "Format", ASSEMBLY_FORMATS),
+    ui.download_button("download_assembly", "Download"),
+  )
+
+def wrapped_helix_segments(twist, rise, offset, i0, i1):
+  # a helix is a straight line (offset+twist*i, rise*i) in the unrolled plane: one segment per turn,
+  # broken exactly where it wraps across 0/360°, with NaN gaps so that all segments fit in one trace
+  phase0, phase1 = sorted((offset+twist*i0, offset+twist*i1))
+  if twist == 0:
+    return np.array([phase0 % 360]*2), np.array([rise*i0, rise*i1])
+  wraps = np.arange(np.floor(phase0/360)+1, np.ceil(phase1/360))*360
+  i = np.concatenate(([i0], np.sort((wraps-offset)/twist), [i1]))
+  start, end = i[:-1], i[1:]
+  turn = 360*np.floor((offset+twist*(start+end)/2)/360)
+  gap = np.full(start.shape, np.nan)
+  x = np.clip(np.column_stack((offset+twist*start-turn, offset+twist*end-turn, gap)).ravel()[:-1], 0, 360)
+  y = np.column_stack((rise*start, rise*end, gap)).ravel()[:-1]
+  return x, y
+
+def helical_lattice_title(diameter, twist, rise, csym):
+  pitch = rise*abs(360/twist) if twist else np.inf
+  return f"pitch={pitch:.2f}Å\ttwist={twist:.2f}° rise={rise:.2f}Å sym=c{csym}<br>diameter={diameter:.2f}Å circumference={np.pi*diameter:.2f}Å"
+
+UNROLLED_LABELS = {"x": "arc (Å)", "y": "z (Å)"}  # hover labels of the subunits in the unrolled plane
+
+def twist_arrow(twist, rise, circumference):
+  # annotation position of the arrow from one subunit to the next, drawn from the left or right edge of the unrolled plane
+  x0 = 0 if twist>=0 else circumference
+  return dict(x=x0+twist/360*circumference, y=rise, ax=x0, ay=0)
+
+def plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_size=10, figure_height=800, view=None, webgl_threshold=None):
+  # view: {"x": [x0, x1], "z": [z0, z1]} axis ranges the user zoomed to, None for the whole helix
+  # the subunits are drawn in Å on the plane of the 2D lattice, with the x axis labelled in degrees of twist
   circumference = np.pi*diameter
-  if rise>0:
-    n = min(int(length/2/rise)+2, 1000)
-    i = np.arange(-n, n+1)
-    xs = []
-    ys = []
-    syms = []
-    for si in range(csym):
-      x = np.fmod(twist * i + si/csym*360, 360)
-      x[x> 360] -= 360
-      x[x< 0] += 360
-      y = rise * i
-      xs.append(x)
-      ys.append(y)
-      syms.append(np.array([si]*len(x)))
-  x = np.concatenate(xs)
-  y = np.concatenate(ys)
-  sym = np.concatenate(syms)
-
-  import pandas as pd
-  df = pd.DataFrame({'x':x, 'y':y, 'csym':sym})
-  df["csym"] = df["csym"].astype(str)
-  
-  import plotly.express as px
-  import plotly.graph_objects as go
-  fig = px.scatter(df, x='x', y='y', color='csym' if csym>1 else None)
+  import geometry
+  z0, z1 = geometry.view_window(length, view)
+  subunits = geometry.helical_subunits(twist, rise, csym, z0, z1, geometry.max_subunits(figure_height))
+  x, y = subunits.planar(diameter/2)
+
+  fig = subunit_figure(subunit_traces(go.Scatter, dict(x=x, y=y), UNROLLED_LABELS), csym)
 
-  if twist>=0:
-    arrow_start = [0, 0]
-    arrow_end = [twist, rise]
-  else:
-    arrow_start = [360, 0]
-    arrow_end = [360+twist, rise]
   fig.add_annotation(
-    x=arrow_end[0],
-    y=arrow_end[1],
-    ax= arrow_start[0],
-    ay= arrow_start[1],
+    **twist_arrow(twist, rise, circumference),
     xref="x",
     yref="y",
     axref="x",
@@ -566,99 +1328,75 @@ def plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_si
     opacity=1.0
   )
 
-  i = np.arange(-n, n+1, 0.01)
-  for si in range(csym):
-    x = np.fmod(twist * i + si/csym*360, 360)
-    x[x> 360] -= 360
-    x[x< 0] += 360
-    y = rise * i
-    color = fig.data[si].marker.color
-    line = go.Scatter(x=x, y=y, mode ='lines', line = dict(color=color, width=marker_size/10, dash='dot'), opacity=1, showlegend=False)
-    fig.add_trace(line)
-  equator = go.Scatter(x=[0,360], y=[0,0], xaxis='x', line = dict(color='grey', width=marker_size/3, dash='dash'))
+  # the helices cross the plane once per turn over the whole window: in an overview with more turns than subunits
+  # shown, they would only fill the plane
+  if abs(twist)*(subunits.i1-subunits.i0)/360 <= len(subunits.i):
+    for si in range(csym):
+      x, y = wrapped_helix_segments(twist, rise, si/csym*360, subunits.i0, subunits.i1)
+      color = fig.data[si].marker.color
+      line = go.Scatter(x=x/360*circumference, y=y, mode ='lines', line = dict(color=color, width=marker_size/10, dash='dot'), opacity=1, showlegend=False)
+      fig.add_trace(line)
+  equator = go.Scatter(x=[0,circumference], y=[0,0], xaxis='x', line = dict(color='grey', width=marker_size/3, dash='dash'))
   fig.add_trace(equator)
   fig.update_traces(marker_size=marker_size, showlegend=False)
 
   fig.update_yaxes(
     scaleanchor = "x",
-    scaleratio = 360/circumference
+    scaleratio = 1
   )
   fig.update_layout(
-    xaxis =dict(title='twist (°)', range=[0,360], tickvals=np.linspace(0,360,13), constrain='domain'),
-    yaxis =dict(title='rise (Å)', range=[-length/2, length/2], constrain='domain'),
+    xaxis =dict(title='twist (°)', range=view["x"] if view else [0,circumference], tickvals=np.linspace(0,circumference,13), ticktext=[str(v) for v in range(0,361,30)], constrain='domain'),
+    yaxis =dict(title='rise (Å)', range=view["z"] if view else [-length/2, length/2], constrain='domain'),
   )
   
-  title = f"pitch={rise*abs(360/twist):.2f}Å\ttwist={twist:.2f}° rise={rise:.2f}Å sym=c{csym}<br>diameter={diameter:.2f}Å circumference={circumference:.2f}Å"
+  title = helical_lattice_title(diameter, twist, rise, csym)
+  if not subunits.complete:
+    title += f"<br>(overview: 1 in {subunits.step} subunits shown)"
   fig.update_layout(title_text=title, title_x=0.5, title_xanchor="center")
   fig.update_layout(height=figure_height)
   fig.update_layout(paper_bgcolor='rgba(0, 0, 0, 0)', plot_bgcolor='rgba(0, 0, 0, 0)')
+  apply_render_backend(fig, webgl_threshold)
 
   return fig
 
-def plot_helical_lattice(diameter, length, twist, rise, csym,  marker_size = 10, figure_height=500):
-  if rise>0:
-    n = min(int(length/2/rise)+2, 1000)
-    i = np.arange(-n, n+1)
-    xs = []
-    ys = []
-    zs = []
-    syms = []
-    for si in range(csym):
-      x = diameter/2 * np.cos(np.deg2rad(twist)*i+si/csym*2*np.pi)
-      y = diameter/2 * np.sin(np.deg2rad(twist)*i+si/csym*2*np.pi)
-      z = i * rise
-      xs.append(x)
-      ys.append(y)
-      zs.append(z)
-      syms.append(np.array([si]*len(z)))
-  x = np.concatenate(xs)
-  y = np.concatenate(ys)
-  z = np.concatenate(zs)
-  sym = np.concatenate(syms)
-
-  import pandas as pd
-  df = pd.DataFrame({'x':x, 'y':y, 'z':z, 'csym':sym})
-  df["csym"] = df["csym"].astype(str)
-  
-  import plotly.express as px
-  import plotly.graph_objects as go
-  fig = px.scatter_3d(df, x='x', y='y', z='z', labels={'x': 'X (Å)', 'y':'Y (Å)', 'z':'Z (Å)'}, color='csym' if csym>1 else None)
+def plot_helical_lattice(diameter, length, twist, rise, csym,  marker_size = 10, figure_height=500, view=None):
+  # view: as in plot_helical_lattice_unrolled, only its z range is used
+  import geometry
+  z0, z1 = geometry.view_window(length, view)
+  subunits = geometry.helical_subunits(twist, rise, csym, z0, z1, geometry.max_subunits(figure_height))
+  x, y, z = subunits.cylinder(diameter/2)
+
+  labels = {'x': 'X (Å)', 'y':'Y (Å)', 'z':'Z (Å)'}
+  fig = subunit_figure(subunit_traces(go.Scatter3d, dict(x=x, y=y, z=z), labels), csym)
+  fig.update_scenes(xaxis_title_text=labels['x'], yaxis_title_text=labels['y'], zaxis_title_text=labels['z'])
   fig.update_traces(marker_size = marker_size)
 
-  i = np.arange(-n, n+1, 5./(abs(twist)))
-  for si in range(csym):
-    x = diameter/2 * np.cos(np.deg2rad(twist)*i+si/csym*2*np.pi)
-    y = diameter/2 * np.sin(np.deg2rad(twist)*i+si/csym*2*np.pi)
-    z = i * rise
-    color = fig.data[si].marker.color
-    spiral = go.Scatter3d(x=x, y=y, z=z, mode ='lines', line = dict(color=color, width=marker_size/2), opacity=1, showlegend=False)
-    fig.add_trace(spiral)
-
-  def cylinder(r, h, z0=0, n_points=100, nv =50):
-    theta = np.linspace(0, 2*np.pi, n_points)
-    v = np.linspace(z0, z0+h, nv )
-    theta, v = np.meshgrid(theta, v)
-    x = r*np.cos(theta)
-    y = r*np.sin(theta)
-    z = v
-    return x, y, z
-  
-  def equator_circle(r, z, n_points=36):
-    theta = np.linspace(0, 2*np.pi, n_points)
-    x= r*np.cos(theta)
-    y = r*np.sin(theta)
-    z0 = z*np.ones(theta.shape)
-    return x, y, z0
-
-  x, y, z = cylinder(r=diameter/2-marker_size/2, h=length, z0=-length/2)
+  # curves and the cylinder are sampled to a sub-pixel chord error at this figure height, within a point budget
+  tolerance = geometry.CHORD_TOLERANCE_PIXELS * geometry.pixel_size(max(z1-z0, diameter)+2*marker_size, figure_height)
+
+  # all csym spirals in one trace, colored like their subunits
+  x, y, z, copy = geometry.helix_spirals(diameter/2, twist, rise, csym, subunits.i0, subunits.i1, tolerance)
+  colors = [trace.marker.color for trace in fig.data[:csym]]
+  if csym>1:
+    colorscale = [[v, color] for k, color in enumerate(colors) for v in (k/csym, (k+1)/csym)]
+    line = dict(color=copy, colorscale=colorscale, cmin=-0.5, cmax=csym-0.5, width=marker_size/2)
+  else:
+    line = dict(color=colors[0], width=marker_size/2)
+  spiral = go.Scatter3d(x=x, y=y, z=z, mode ='lines', line = line, opacity=1, showlegend=False)
+  fig.add_trace(spiral)
+
+  n_points = geometry.circle_points(diameter/2, tolerance)
+  x, y, z = geometry.cylinder_surface(r=diameter/2-marker_size/2, h=z1-z0, z0=z0, n_points=n_points)
   colorscale = [[0, 'white'], [1, 'white']]
   cyl = go.Surface(x=x, y=y, z=z, colorscale = colorscale, showscale=False, opacity=0.8)
   fig.add_trace(cyl)
-  x, y, z = equator_circle(r=diameter/2, z=0)
+  x, y, z = geometry.circle(r=diameter/2, z=0, n_points=n_points)
   equator = go.Scatter3d(x=x, y=y, z=z, mode ='lines', line = dict(color='grey', width=marker_size/2, dash='dash'), opacity=1, showlegend=False)
   fig.add_trace(equator)
 
-  title = f"pitch={rise*abs(360/twist):.2f}Å\ttwist={twist:.2f}° rise={rise:.2f}Å sym=c{csym}<br>diameter={diameter:.2f}Å circumference={np.pi*diameter:.2f}Å"
+  title = helical_lattice_title(diameter, twist, rise, csym)
+  if not subunits.complete:
+    title += f"<br>(overview: 1 in {subunits.step} subunits shown)"
   fig.update_layout(title_text=title, title_x=0.5, title_xanchor="center")
 
   camera = dict(
@@ -671,7 +1409,7 @@ def plot_helical_lattice(diameter, length, twist, rise, csym,  marker_size = 10,
   fig.update_scenes(
     xaxis =dict(range=[-diameter/2-marker_size, diameter/2+marker_size]),
     yaxis =dict(range=[-diameter/2-marker_size, diameter/2+marker_size]),
-    zaxis =dict(range=[-length/2-marker_size, length/2+marker_size])
+    zaxis =dict(range=[z0-marker_size, z1+marker_size])
   )
 
   fig.update_scenes(xaxis_visible=False, yaxis_visible=False, zaxis_visible=False, camera_projection_type='orthographic', aspectmode='data')
@@ -680,145 +1418,170 @@ def plot_helical_lattice(diameter, length, twist, rise, csym,  marker_size = 10,
 
   return fig
 
-def convert_2d_lattice_to_helical_lattice(a=(1, 0), b=(0, 1), endpoint=(10, 0)):
-  def set_to_periodic_range(v, min=-180, max=180):
-    from math import fmod
-    tmp = fmod(v-min, max-min)
-    if tmp>=0: tmp+=min
-    else: tmp+=max
-    return tmp
-  def length(v):
-    return np.linalg.norm(v)
-  def transform_vector(v, vref=(1, 0)):
-    ang = np.arctan2(vref[1], vref[0])
-    cos = np.cos(ang)
-    sin = np.sin(ang)
-    m = [[cos, sin], [-sin, cos]]
-    v2 = np.dot(m, v.T)
-    return v2
-  def on_equator(v, epsilon=0.5):
-      # test if b vector is on the equator
-      if abs(v[1]) > epsilon: return 0
-      return 1
-  
-  a, b, endpoint = map(np.array, (a, b, endpoint))
-  na, nb = endpoint
-  v_equator = na*a + nb*b
-  circumference = length(v_equator)
-  va = transform_vector(a, v_equator)
-  vb = transform_vector(b, v_equator)
-  minLength = max(1.0, min(np.linalg.norm(va), np.linalg.norm(vb)) * 0.9)
-  vs_on_equator = []
-  vs_off_equator = []
-  epsilon = 0.5
-  maxI = 10
-  for i in range(-maxI, maxI + 1):
-      for j in range(-maxI, maxI + 1):
-          if i or j:
-              v = i * va + j * vb
-              v[0] = set_to_periodic_range(v[0], min=0, max=circumference)
-              if np.linalg.norm(v) > minLength:
-                  if v[1]<0: v *= -1
-                  if on_equator(v, epsilon=epsilon):
-                      vs_on_equator.append(v)
-                  else:
-                      vs_off_equator.append(v)
-  twist, rise, csym = 0, 0, 1
-  if vs_on_equator:
-      vs_on_equator.sort(key=lambda v: abs(v[0]))
-      best_spacing = abs(vs_on_equator[0][0])
-      csym_f = circumference / best_spacing
-      expected_spacing = circumference/round(csym_f)
-      if abs(best_spacing - expected_spacing)/expected_spacing < 0.05:
-          csym = int(round(csym_f))
-  if vs_off_equator:
-      vs_off_equator.sort(key=lambda v: (abs(round(v[1]/epsilon)), abs(v[0])))
-      twist, rise = vs_off_equator[0]
-      twist *= 360/circumference
-      twist = set_to_periodic_range(twist, min=-360/(2*csym), max=360/(2*csym))
-  diameter = circumference/np.pi
-  return twist, rise, csym, diameter
-
-def convert_helical_lattice_to_2d_lattice(twist=30, rise=20, csym=1, diameter=100, primitive_unitcell=False, horizontal=True):
-  def angle90(v1, v2):  # angle between two vectors, ignoring vector polarity [0, 90]
-      p = np.dot(v1, v2)/(np.linalg.norm(v1)*np.linalg.norm(v2))
-      p = np.clip(abs(p), 0, 1)
-      ret = np.rad2deg(np.arccos(p))  # 0<=angle<90
-      return ret
-  def transform_vector(v, vref=(1, 0)):
-    ang = np.arctan2(vref[1], vref[0])
-    cos = np.cos(ang)
-    sin = np.sin(ang)
-    m = [[cos, sin], [-sin, cos]]
-    v2 = np.dot(m, v.T)
-    return v2
-  
-  imax = int(5*360/abs(twist))
-  n = np.tile(np.arange(-imax, imax), reps=(2,1)).T
-  v = np.array([twist, rise], dtype=float) * n
-  if csym>1:
-    vs = []
-    for ci in range(csym):
-      tmp = v * 1.0
-      tmp[:, 0] += ci/csym * 360
-      vs.append(tmp)
-    v = np.vstack(vs)
-  v[:, 0] = np.fmod(v[:, 0], 360)
-  v[v[:, 0]<0, 0] += 360
-  v[:, 0] *= np.pi*diameter/360 # convert x-axis values from angles to distances
-  dist = np.linalg.norm(v, axis=1)
-  dist_indices = np.argsort(dist)
-
-  v = v[dist_indices] # now sorted from short to long distance
-  err = 1.0 # max angle between 2 vectors to consider non-parallel
-  vb = v[1]
-  for i in range(1, len(v)):
-    if angle90(vb, v[i])> err:
-      va = v[i]
-      break
-
-  ve = np.array([np.pi*diameter, 0])
-  m = np.vstack((va, vb)).T
-  na, nb = np.linalg.solve(m, ve)
-  endpoint = (round(na), round(nb))
-  
-  if not primitive_unitcell:
-    # find alternative unit cell vector pairs that has smallest angular difference to the helical equator
-    vabs = []
-    for ia in range(-1, 2):
-      for ib in range(-1, 2):
-        vabs.append(ia*va+ib*vb)
-    vabs_good = []
-    area = np.linalg.norm( np.cross(va, vb) )
-    for vai, vatmp in enumerate(vabs):
-      for vbi in range(vai+1, len(vabs)):
-        vbtmp = vabs[vbi]
-        areatmp = np.linalg.norm( np.cross(vatmp, vbtmp) )
-        if abs(areatmp-area)>err: continue
-        vabs_good.append( (vatmp, vbtmp) )
-    dist = []
-    for vi, (vatmp, vbtmp) in enumerate(vabs_good):
-        m = np.vstack((vatmp, vbtmp)).T
-        na, nb = np.linalg.solve(m, ve)
-        if abs(na-round(na))>1e-3: continue
-        if abs(nb-round(nb))>1e-3: continue
-        dist.append((abs(na)+abs(nb), -round(na), -round(nb), round(na), round(nb), vatmp, vbtmp))
-    if len(dist):
-      dist.sort(key=lambda x: x[:3])
-      na, nb, va, vb = dist[0][3:]
-      if np.linalg.norm(vb)>np.linalg.norm(va):
-        va, vb = vb, va
-        na, nb = nb, na
-      endpoint = (na, nb)
-
-  if va[0]<0:
-    va *= -1
-    vb *= -1
-    na *= -1
-    nb *= -1
-
-  if horizontal:
-    vb = transform_vector(vb, vref=va)
-    va = np.array([np.linalg.norm(va), 0.0])
-
-  return va, vb, endpoint
\ No newline at end of file
+MAX_ANIMATION_FRAMES = 120
+ANIMATION_FRAME_MS = 100
+
+def animation_frames(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, figure_height):
+  import geometry
+  n_frames = int(np.clip(n_frames, 2, MAX_ANIMATION_FRAMES))
+  max_subunits = geometry.max_frame_subunits(figure_height, csym, n_frames)
+  return geometry.HelicalSubunitFrames(twist, rise, twist_end, rise_end, csym, -length/2, length/2, max_subunits, n_frames)
+
+def animation_title(diameter, frames, k, csym):
+  title = helical_lattice_title(diameter, frames.twist[k], frames.rise[k], csym)
+  if not frames.complete:
+    title += f"<br>(overview: 1 in {frames.step} subunits shown)"
+  return title
+
+def add_animation_controls(fig, frames):
+  # play/pause buttons and a slider over the frames: playback runs in plotly.js without any server round trip
+  play = dict(frame=dict(duration=ANIMATION_FRAME_MS, redraw=True), transition=dict(duration=0), fromcurrent=True, mode="immediate")
+  pause = dict(frame=dict(duration=0, redraw=True), transition=dict(duration=0), mode="immediate")
+  steps = [dict(label=f"{twist:.2f}°, {rise:.2f}Å", method="animate", args=[[str(k)], pause]) for k, (twist, rise) in enumerate(zip(frames.twist, frames.rise))]
+  fig.update_layout(
+    updatemenus=[dict(type="buttons", direction="left", x=0, y=0, xanchor="left", yanchor="top", pad=dict(t=60),
+      buttons=[dict(label="▶", method="animate", args=[None, play]), dict(label="❚❚", method="animate", args=[[None], pause])])],
+    sliders=[dict(active=0, x=0.15, len=0.85, y=0, yanchor="top", pad=dict(t=60), currentvalue=dict(prefix="twist, rise: "), steps=steps)],
+    margin=dict(b=140),
+  )
+  return fig
+
+def set_animation_frames(fig, frames):
+  # frames: go.Frame properties as dicts; the figure shows the first frame. They are compacted like the traces
+  # (compact_figure) and attached as dicts without validation, which would take seconds for thousands of frame traces
+  if PAYLOAD_MODE == "compact":
+    for axis in ("x", "y", "z"):
+      traces = [trace for frame in frames for trace in frame["data"] if isinstance(trace.get(axis), np.ndarray)]
+      compacted = compact_arrays([trace[axis] for trace in traces], fig.layout.height or 500)
+      for trace, c in zip(traces, compacted or ()):
+        trace[axis] = c
+  first = frames[0]
+  for index, trace in zip(first["traces"], first["data"]):
+    fig.data[index].update({name: value for name, value in trace.items() if name != "type"})
+  fig.update_layout(first["layout"])
+  return go.Figure(dict(data=[trace.to_plotly_json() for trace in fig.data], layout=fig.layout.to_plotly_json(), frames=frames), _validate=False)
+
+def animate_helical_lattice_unrolled(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, marker_size=10, figure_height=800, webgl_threshold=None):
+  # plot_helical_lattice_unrolled of the start parameter set, with one frame per parameter set of the morph to the end
+  # parameter set. Frames replace the subunit and helix traces, the twist arrow and the title
+  frames = animation_frames(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, figure_height)
+  fig = plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_size=marker_size, figure_height=figure_height, webgl_threshold=webgl_threshold)
+  x, y = frames.planar(diameter/2)
+  arrow = fig.layout.annotations[0].to_plotly_json()
+  types = [trace.type for trace in fig.data]
+
+  fig_frames = []
+  for k in range(len(frames)):
+    data = [dict(type=types[si], x=x[k, si], y=y[k, si]) for si in range(csym)]
+    for si in range(csym):
+      lx, ly = wrapped_helix_segments(frames.twist[k], frames.rise[k], si/csym*360, frames.i0[k], frames.i1[k])
+      data.append(dict(type=types[csym+si], x=lx/360*np.pi*diameter, y=ly))
+    layout = dict(title_text=animation_title(diameter, frames, k, csym), annotations=[{**arrow, **twist_arrow(frames.twist[k], frames.rise[k], np.pi*diameter)}])
+    fig_frames.append(dict(data=data, traces=list(range(2*csym)), name=str(k), layout=layout))
+  return set_animation_frames(add_animation_controls(fig, frames), fig_frames)
+
+def animate_helical_lattice(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, marker_size=10, figure_height=500):
+  # plot_helical_lattice of the start parameter set, with one frame per parameter set of the morph to the end
+  # parameter set. Frames replace the subunit and spiral traces and the title
+  import geometry
+  frames = animation_frames(diameter, length, twist, rise, twist_end, rise_end, csym, n_frames, figure_height)
+  fig = plot_helical_lattice(diameter, length, twist, rise, csym, marker_size=marker_size, figure_height=figure_height)
+  x, y, z = frames.cylinder(diameter/2)
+  tolerance = geometry.CHORD_TOLERANCE_PIXELS * geometry.pixel_size(max(length, diameter)+2*marker_size, figure_height)
+
+  fig_frames = []
+  for k in range(len(frames)):
+    data = [dict(type="scatter3d", x=x[k, si], y=y[k, si], z=z[k, si]) for si in range(csym)]
+    sx, sy, sz, copy = geometry.helix_spirals(diameter/2, frames.twist[k], frames.rise[k], csym, frames.i0[k], frames.i1[k], tolerance, max_points=geometry.MAX_FRAME_POINTS//len(frames))
+    spiral = dict(type="scatter3d", x=sx, y=sy, z=sz)
+    if csym>1:
+      spiral["line"] = dict(color=copy)
+    data.append(spiral)
+    fig_frames.append(dict(data=data, traces=list(range(csym+1)), name=str(k), layout=dict(title_text=animation_title(diameter, frames, k, csym))))
+  return set_animation_frames(add_animation_controls(fig, frames), fig_frames)
+
+# Conversions are pure functions of a handful of geometry parameters, so their results are memoized
+# in a bounded LRU cache at module level. It is shared by all sessions served by this worker process.
+# Parameters are quantized before lookup so that float noise from the numeric inputs maps to the same entry.
+CONVERSION_CACHE_SIZE = 256
+CONVERSION_CACHE_DIGITS = 6
+
+def quantize(v, digits=CONVERSION_CACHE_DIGITS):
+  return round(float(v), digits)
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def _convert_2d_lattice_to_helical_lattice_cached(a, b, endpoint):
+  twist, rise, csym, diameter = convert_2d_lattice_to_helical_lattice(a=a, b=b, endpoint=endpoint)
+  return float(twist), float(rise), int(csym), float(diameter)
+
+@lru_cache(maxsize=CONVERSION_CACHE_SIZE)
+def _convert_helical_lattice_to_2d_lattice_cached(twist, rise, csym, diameter, primitive_unitcell, horizontal):
+  va, vb, endpoint = convert_helical_lattice_to_2d_lattice(twist=twist, rise=rise, csym=csym, diameter=diameter, primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+  # tuples, not arrays: cached values are shared and must not be modified in place by callers
+  return tuple(map(float, va)), tuple(map(float, vb)), tuple(map(int, endpoint))
+
+def convert_2d_lattice_to_helical_lattice_cached(a=(1, 0), b=(0, 1), endpoint=(10, 0)):
+  a = tuple(quantize(v) for v in a)
+  b = tuple(quantize(v) for v in b)
+  endpoint = tuple(int(n) for n in endpoint)
+  return _convert_2d_lattice_to_helical_lattice_cached(a, b, endpoint)
+
+def convert_helical_lattice_to_2d_lattice_cached(twist=30, rise=20, csym=1, diameter=100, primitive_unitcell=False, horizontal=True):
+  return _convert_helical_lattice_to_2d_lattice_cached(quantize(twist), quantize(rise), int(csym), quantize(diameter), bool(primitive_unitcell), bool(horizontal))
+
+@lru_cache(maxsize=16)
+def _chirality_map_cached(a, b, min_diameter, max_diameter):
+  helices = chirality_map(a, b, min_diameter, max_diameter)
+  helices.flags.writeable = False
+  return helices
+
+def chirality_map_cached(a=(1, 0), b=(0, 1), min_diameter=100, max_diameter=500):
+  return _chirality_map_cached(tuple(quantize(v) for v in a), tuple(quantize(v) for v in b), quantize(min_diameter), quantize(max_diameter))
+
+def conversion_cache_info():
+  # hits/misses/currsize of the shared conversion caches of this worker process
+  return {
+    "convert_2d_lattice_to_helical_lattice": _convert_2d_lattice_to_helical_lattice_cached.cache_info()._asdict(),
+    "convert_helical_lattice_to_2d_lattice": _convert_helical_lattice_to_2d_lattice_cached.cache_info()._asdict(),
+    "chirality_map": _chirality_map_cached.cache_info()._asdict(),
+  }
+
+metrics.CallbackMetric("helicallattice_conversion_cache_total", "Lookups in the shared conversion caches of this worker", "counter",
+  lambda: {(name, result): info[result] for name, info in conversion_cache_info().items() for result in ("hits", "misses")},
+  ("conversion", "result"))
+
+def figure_structure(fig):
+  # trace count and types: a FigureWidget can be patched in place only while these stay the same
+  return tuple(trace.type for trace in fig.data)
+
+def replacing_properties(old, new):
+  # new, with None for every property of old that it lacks: trace.update merges into the current properties,
+  # and a property that a new figure drops (e.g. hovertemplate) would otherwise stay on the widget
+  update = dict(new)
+  for key, value in old.items():
+    if key not in new and key != "uid":
+      update[key] = None
+    elif isinstance(value, dict) and isinstance(new.get(key), dict):
+      update[key] = replacing_properties(value, new[key])
+  return update
+
+def update_figure_widget(widget, fig):
+  if figure_structure(widget) != figure_structure(fig):
+    return 0  # the output re-renders a new widget for this figure
+  # plotly only sends properties whose values differ from the widget's current state,
+  # so e.g. a marker_size change becomes a restyle of marker sizes and a twist change a restyle of x/y/z
+  layout = fig.layout.to_plotly_json()
+  layout.pop("template", None)  # constant across figures, and shinywidgets adjusts the widget's own copy
+  layout.pop("margin", None)  # likewise: shinywidgets sets the widget's margins when it renders it
+  sent = []
+  def record(change):
+    if change["new"]: sent.append(change["new"])
+  widget.observe(record, names="_py2js_update")
+  try:
+    with widget.batch_update():
+      for trace, new_trace in zip(widget.data, fig.data):
+        trace.update(replacing_properties(trace.to_plotly_json(), new_trace.to_plotly_json()))
+      widget.layout.update(layout)
+  finally:
+    widget.unobserve(record, names="_py2js_update")
+  return sum(metrics.widget_message_bytes(msg) for msg in sent)  # serialized size of the patch sent to the browser
@@ -0,0 +1,339 @@
+"""
+Helical assembly of a filament from an atomic model of its asymmetric unit, free of any UI dependency.
+
+The asymmetric unit is read from a PDB or mmCIF file (first model only). Copy (i, k) of it is rotated by
+twist*i + k*360/csym degrees about the helical axis and shifted by rise*i along it, for all subunits within ±length/2
+of the input copy, as in export.py. The helical axis runs along z through (center_x, center_y). One vectorized kernel
+transforms all atoms of a block of copies at once into a single (copy, atom, xyz) buffer. The buffer is memory-mapped
+to a temporary file beyond MEMMAP_BYTES, so the size of an assembly is not bound by memory.
+
+The assembly is written from the buffer a block at a time, as PDB, mmCIF or a NumPy .npy of the buffer. PDB and mmCIF
+records are laid out as fixed-width byte rows per atom. Only the serial number, chain id and coordinate columns are
+filled in per copy, with vectorized number formatting, so even million-atom filaments take seconds. Each copy of
+each chain gets its own chain id: A..Z, AA.. in mmCIF, cycling over 62 characters in PDB.
+
+  python assembly.py asu.cif filament.cif --twist -81.1 --rise 19.4 --csym 1 --length 5000
+  python assembly.py asu.pdb filament.npy --twist 22.04 --rise 1.41 --length 1e5 --center 150 150
+"""
+
+import gzip
+import io
+import os
+import re
+import string
+import tempfile
+
+import numpy as np
+
+from export import subunit_range
+
+MEMMAP_BYTES = 256*2**20
+BLOCK_ATOMS = 200000
+PDB_CHAINS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+PDB_RANGE = (-999.999, 9999.999)  # what the 8.3f coordinate fields hold
+FORMATS = ("pdb", "cif", "npy")
+CIF_COLUMNS = ("group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id", "label_asym_id", "label_seq_id",
+  "pdbx_PDB_ins_code", "Cartn_x", "Cartn_y", "Cartn_z", "occupancy", "B_iso_or_equiv", "pdbx_formal_charge", "auth_seq_id",
+  "auth_comp_id", "auth_asym_id", "auth_atom_id", "pdbx_PDB_model_num")
+
+class Model:
+  # the atoms of an asymmetric unit: xyz (atoms, 3) in Å and the fields of their ATOM/HETATM records, str arrays but
+  # occupancy and bfactor
+  FIELDS = ("record", "name", "altloc", "resname", "chain", "resseq", "icode", "element", "charge")
+
+  def __init__(self, xyz, occupancy, bfactor, **fields):
+    if not len(xyz):
+      raise ValueError("no ATOM or HETATM records")
+    self.xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+    self.occupancy = np.asarray(occupancy, dtype=float)
+    self.bfactor = np.asarray(bfactor, dtype=float)
+    for name in self.FIELDS:
+      setattr(self, name, np.asarray(fields[name], dtype=str))
+    self.chains, self.chain_index = np.unique(self.chain, return_inverse=True)
+
+  def __len__(self):
+    return len(self.xyz)
+
+def read_model(path, name=None):
+  # PDB or mmCIF, told apart by the extension of name (e.g. of an upload, default path) or else by the content
+  name = (name or path).lower()
+  with open(path, "rb") as f:
+    data = f.read()
+  if name.endswith(".gz"):
+    data = gzip.decompress(data)
+    name = name[:-3]
+  text = data.decode("ascii", errors="replace")
+  if name.endswith((".cif", ".mmcif")) or (not name.endswith((".pdb", ".ent")) and "_atom_site." in text):
+    return parse_cif(text)
+  return parse_pdb(text)
+
+def parse_pdb(text):
+  rows = []
+  for line in text.splitlines():
+    if line.startswith("ENDMDL"):
+      break
+    if line.startswith(("ATOM  ", "HETATM")):
+      line = line.ljust(80)
+      try:
+        xyz = float(line[30:38]), float(line[38:46]), float(line[46:54])
+      except ValueError:
+        raise ValueError(f"invalid coordinates in {line.rstrip()!r}") from None
+      name = line[12:16].strip()
+      rows.append((xyz, float(line[54:60]) if line[54:60].strip() else 1.0, float(line[60:66]) if line[60:66].strip() else 0.0,
+        line[0:6].strip(), name, line[16].strip(), line[17:20].strip(), line[21].strip(), line[22:26].strip(), line[26].strip(),
+        line[76:78].strip() or name.lstrip(string.digits)[:1], line[78:80].strip()))
+  if not rows:
+    raise ValueError("no ATOM or HETATM records")
+  xyz, occupancy, bfactor, *fields = zip(*rows)
+  return Model(xyz, occupancy, bfactor, **dict(zip(Model.FIELDS, fields)))
+
+CIF_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+
+def parse_cif(text):
+  # the _atom_site loop of the first data block; multi-line (;) values are not supported in it
+  lines = text.splitlines()
+  start = next((k for k in range(len(lines)-1) if lines[k].strip() == "loop_" and lines[k+1].startswith("_atom_site.")), None)
+  if start is None:
+    raise ValueError("no _atom_site loop")
+  tags, k = [], start+1
+  while k < len(lines) and lines[k].startswith("_atom_site."):
+    tags.append(lines[k].split()[0][len("_atom_site."):])
+    k += 1
+  tokens = []
+  while k < len(lines) and not lines[k].startswith(("_", "loop_", "#", "data_")):
+    if lines[k].startswith(";"):
+      raise ValueError("multi-line values in the _atom_site loop are not supported")
+    tokens += [next(g for g in m.groups() if g is not None) for m in CIF_TOKEN.finditer(lines[k])]
+    k += 1
+  if not tokens or len(tokens) % len(tags):
+    raise ValueError(f"the _atom_site loop has {len(tokens)} values for {len(tags)} columns")
+  values = np.array(tokens, dtype=object).reshape(-1, len(tags))
+  def column(*names, default=""):
+    for name in names:
+      if name in tags:
+        return np.array([("" if v in (".", "?") else v) for v in values[:, tags.index(name)]], dtype=str)
+    return np.full(len(values), default, dtype=str)
+  models = column("pdbx_PDB_model_num")
+  first = models == models[0]
+  try:
+    xyz = np.column_stack([column(f"Cartn_{axis}").astype(float) for axis in "xyz"])
+    occupancy = np.where(column("occupancy") == "", "1", column("occupancy")).astype(float)
+    bfactor = np.where(column("B_iso_or_equiv") == "", "0", column("B_iso_or_equiv")).astype(float)
+  except ValueError as e:
+    raise ValueError(f"invalid number in the _atom_site loop: {e}") from None
+  fields = dict(record=column("group_PDB", default="ATOM"), name=column("auth_atom_id", "label_atom_id"), altloc=column("label_alt_id"),
+    resname=column("auth_comp_id", "label_comp_id"), chain=column("auth_asym_id", "label_asym_id"), resseq=column("auth_seq_id", "label_seq_id"),
+    icode=column("pdbx_PDB_ins_code"), element=column("type_symbol"), charge=column("pdbx_formal_charge"))
+  return Model(xyz[first], occupancy[first], bfactor[first], **{name: v[first] for name, v in fields.items()})
+
+def helical_transforms(twist, rise, csym, length):
+  # rotation (degrees) and shift (Å) of each copy (i, k), i-major: the copies of a subunit along the helix are adjacent
+  i0, i1 = subunit_range(rise, length)
+  i = np.repeat(np.arange(i0, i1+1), csym)
+  k = np.tile(np.arange(csym), max(i1-i0+1, 0))
+  return twist*i + k*360/csym, rise*i
+
+def transform_block(xyz, angle, shift, center, out):
+  # xyz (atoms, 3) rotated by each angle about the axis through center and shifted along it: out is (copies, atoms, 3)
+  c, s = np.cos(np.deg2rad(angle))[:, None], np.sin(np.deg2rad(angle))[:, None]
+  x, y = xyz[:, 0]-center[0], xyz[:, 1]-center[1]
+  out[..., 0] = c*x - s*y + center[0]
+  out[..., 1] = s*x + c*y + center[1]
+  out[..., 2] = xyz[:, 2] + shift[:, None]
+
+def assembly_coordinates(model, twist, rise, csym, length, center=(0, 0), path=None):
+  # the (copy, atom, xyz) float64 buffer of the assembly: an .npy file memory-mapped at path if given, else in memory or,
+  # beyond MEMMAP_BYTES, memory-mapped to an anonymous temporary file
+  angle, shift = helical_transforms(twist, rise, csym, length)
+  shape = (len(angle), len(model), 3)
+  if path is not None:
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=shape)
+  elif 8*np.prod(shape) > MEMMAP_BYTES:
+    out = np.memmap(tempfile.TemporaryFile(), dtype=np.float64, mode="w+", shape=shape)
+  else:
+    out = np.empty(shape)
+  block = max(1, BLOCK_ATOMS//len(model))
+  for start in range(0, len(angle), block):
+    transform_block(model.xyz, angle[start:start+block], shift[start:start+block], center, out[start:start+block])
+  return out
+
+def text_columns(values, width=None, right=False):
+  # str values padded with spaces into an (n, width) array of ASCII bytes; width defaults to the longest value
+  values = np.asarray(values, dtype=str)
+  width = width or max(int(np.char.str_len(values).max(initial=1)), 1)
+  values = np.char.rjust(values, width) if right else np.char.ljust(values, width)
+  return np.frombuffer(values.astype(f"S{width}").tobytes(), np.uint8).reshape(len(values), width)
+
+def fixed_width(values, width, decimals=0):
+  # numbers right-aligned in fields of width characters, with decimals digits after the point, as an (n, width) array
+  # of ASCII bytes: a vectorized f"{v:{width}.{decimals}f}" for numbers that fit, but for ties rounded in the last
+  # digit and -0.000 written 0.000
+  digits = np.round(np.asarray(values, dtype=float)*10**decimals).astype(np.int64)
+  unsigned = digits >= 0
+  digits = np.abs(digits)
+  out = np.full((len(digits), width), ord(" "), np.uint8)
+  point = width-1-decimals if decimals else width
+  units = point-1
+  for col in range(width-1, -1, -1):
+    if col == point:
+      out[:, col] = ord(".")
+      continue
+    shown = digits > 0 if col < units else slice(None)
+    out[shown, col] = (ord("0") + digits[shown] % 10).astype(np.uint8)
+    digits //= 10
+    if col <= units and col > 0:
+      sign = ~unsigned & (digits == 0)
+      out[sign, col-1] = ord("-")
+      unsigned |= sign
+  return out
+
+def chain_label(n):
+  # 0, 1, .. 25, 26, .. as A, B, .. Z, AA, ..
+  label = ""
+  n += 1
+  while n:
+    n, r = divmod(n-1, 26)
+    label = chr(ord("A")+r) + label
+  return label
+
+def record_chunks(rows, chain_index, serial_column, chain_columns, xyz_columns, coordinates, chain_ids, serial_modulus=None):
+  # the (atoms, width) byte rows of the records of one copy, repeated for each copy BLOCK_ATOMS at a time with the
+  # serial number, chain id and coordinate columns (start, width) filled in. chain_ids(n, width) gives the ids of the
+  # chains n of all copies, numbered copy by copy, as (len(n), width) bytes
+  n_copies, n_atoms = coordinates.shape[:2]
+  n_chains = int(chain_index.max())+1
+  block = max(1, BLOCK_ATOMS//n_atoms)
+  for start in range(0, n_copies, block):
+    stop = min(start+block, n_copies)
+    out = np.empty((stop-start, n_atoms, rows.shape[1]), np.uint8)
+    out[:] = rows
+    serial = np.arange(start*n_atoms, stop*n_atoms) + 1
+    if serial_modulus:
+      serial %= serial_modulus
+    c0, w = serial_column
+    out[..., c0:c0+w] = fixed_width(serial, w).reshape(stop-start, n_atoms, w)
+    chains = (np.arange(start, stop)[:, None]*n_chains + np.arange(n_chains)).ravel()
+    for c0, w in chain_columns:
+      out[..., c0:c0+w] = chain_ids(chains, w).reshape(stop-start, n_chains, w)[:, chain_index]
+    for axis, (c0, w) in enumerate(xyz_columns):
+      out[..., c0:c0+w] = fixed_width(coordinates[start:stop, :, axis].ravel(), w, 3).reshape(stop-start, n_atoms, w)
+    yield out.tobytes()
+
+def pdb_name(name, element):
+  # atom names start in column 13 if as long as 4 characters or of a 2-letter element, else in column 14
+  return name.ljust(4) if len(name) >= 4 or len(element) == 2 else f" {name:<3}"
+
+def pdb_rows(model):
+  # the ATOM/HETATM records of the asymmetric unit as (atoms, 81) bytes, serial number, chain id and coordinates blank
+  lines = [f"{r:<6}{0:5d} {pdb_name(n, e)}{a:1}{rn:>3}  {rs:>4}{ic:1}   {0:8.3f}{0:8.3f}{0:8.3f}{o:6.2f}{b:6.2f}          {e:>2}{ch:<2}\n"
+    for r, n, a, rn, rs, ic, o, b, e, ch in zip(model.record, model.name, model.altloc, model.resname, model.resseq, model.icode,
+      model.occupancy.tolist(), model.bfactor.tolist(), model.element, model.charge)]
+  if any(len(line) != 81 for line in lines):
+    raise ValueError("atom, residue or element names too long for PDB records: write mmCIF instead")
+  return text_columns(lines, 81)
+
+def pdb_chunks(model, rows, coordinates, parameters):
+  yield "".join(f"REMARK   1 {name.upper()} {value}\n" for name, value in parameters.items()).encode()
+  pdb_chain_ids = np.frombuffer(PDB_CHAINS.encode(), np.uint8)
+  yield from record_chunks(rows, model.chain_index, (6, 5), [(21, 1)], [(30, 8), (38, 8), (46, 8)], coordinates,
+    lambda n, w: pdb_chain_ids[n % len(PDB_CHAINS)][:, None], serial_modulus=100000)
+  yield b"END\n"
+
+def cif_value(value):
+  if value == "":
+    return "."
+  if "'" in value:
+    return f'"{value}"'
+  if value[0] in "_#$\"[];" or value in (".", "?") or value.lower().startswith(("data_", "loop_", "save_", "global_", "stop_")):
+    return f"'{value}'"
+  return value
+
+def cif_chunks(model, coordinates, parameters, name="filament"):
+  yield (f"data_{name}\n#\n" + "".join(f"# {key} {value}\n" for key, value in parameters.items()) + "loop_\n" +
+    "".join(f"_atom_site.{column}\n" for column in CIF_COLUMNS)).encode()
+  n_copies, n_atoms = coordinates.shape[:2]
+  n_chains = len(model.chains)
+  lo, hi = (coordinates.min(), coordinates.max()) if coordinates.size else (0, 0)
+  widths = {"id": len(str(n_copies*n_atoms)), "label_asym_id": len(chain_label(max(n_copies*n_chains-1, 0))),
+    **{f"Cartn_{axis}": max(len(f"{lo:.3f}"), len(f"{hi:.3f}")) for axis in "xyz"}}
+  widths["auth_asym_id"] = widths["label_asym_id"]
+  fields = {"group_PDB": model.record, "type_symbol": model.element, "label_atom_id": model.name, "label_alt_id": model.altloc,
+    "label_comp_id": model.resname, "label_seq_id": model.resseq, "pdbx_PDB_ins_code": model.icode, "occupancy": [f"{v:.2f}" for v in model.occupancy],
+    "B_iso_or_equiv": [f"{v:.2f}" for v in model.bfactor], "pdbx_formal_charge": model.charge, "auth_seq_id": model.resseq,
+    "auth_comp_id": model.resname, "auth_atom_id": model.name, "pdbx_PDB_model_num": ["1"]*n_atoms}
+  columns, offsets, start = [], {}, 0
+  for column in CIF_COLUMNS:
+    if column in widths:
+      block = np.full((n_atoms, widths[column]), ord(" "), np.uint8)
+    else:
+      block = text_columns([cif_value(v) for v in fields[column]])
+    offsets[column] = (start, block.shape[1])
+    columns += [block, np.full((n_atoms, 1), ord(" "), np.uint8)]
+    start += block.shape[1]+1
+  columns[-1] = np.full((n_atoms, 1), ord("\n"), np.uint8)
+  yield from record_chunks(np.hstack(columns), model.chain_index, offsets["id"], [offsets["label_asym_id"], offsets["auth_asym_id"]], [offsets[f"Cartn_{axis}"] for axis in "xyz"],
+    coordinates, lambda n, w: text_columns([chain_label(k) for k in n], w))
+  yield b"#\n"
+
+def npy_chunks(coordinates):
+  # the buffer as an .npy file, a block of copies at a time
+  header = io.BytesIO()
+  np.lib.format.write_array_header_2_0(header, {"descr": "<f8", "fortran_order": False, "shape": coordinates.shape})
+  yield header.getvalue()
+  block = max(1, BLOCK_ATOMS//max(coordinates.shape[1], 1))
+  for start in range(0, len(coordinates), block):
+    yield np.ascontiguousarray(coordinates[start:start+block], dtype="<f8").tobytes()
+
+def check(fmt, twist, rise, csym, length):
+  if fmt not in FORMATS:
+    raise ValueError(f"unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+  if rise <= 0 or length <= 0 or csym < 1:
+    raise ValueError("rise and length must be positive and csym at least 1")
+
+def assembly_chunks(fmt, model, twist, rise, csym, length, center=(0, 0), name="filament"):
+  # the assembly as a generator of bytes chunks, once its coordinates are all computed
+  check(fmt, twist, rise, csym, length)
+  coordinates = assembly_coordinates(model, twist, rise, csym, length, center)
+  parameters = {"twist": float(twist), "rise": float(rise), "csym": int(csym), "length": float(length), "center": [float(v) for v in center]}
+  if fmt == "npy":
+    return npy_chunks(coordinates)
+  if fmt == "pdb":
+    lo, hi = (coordinates.min(), coordinates.max()) if coordinates.size else (0, 0)
+    if lo < PDB_RANGE[0] or hi > PDB_RANGE[1]:
+      raise ValueError(f"PDB coordinates must be within {PDB_RANGE[0]}..{PDB_RANGE[1]} Å but these span {lo:.0f}..{hi:.0f} Å: write mmCIF instead")
+    return pdb_chunks(model, pdb_rows(model), coordinates, parameters)
+  return cif_chunks(model, coordinates, parameters, name=re.sub(r"\W", "_", name) or "filament")
+
+def main(argv=None):
+  import argparse
+  import time
+  parser = argparse.ArgumentParser(description="Build a helical filament from a model of its asymmetric unit")
+  parser.add_argument("input", help="asymmetric unit: .pdb, .ent or .cif, optionally gzipped")
+  parser.add_argument("output", help="assembly: .pdb, .cif, or .npy of its (copy, atom, xyz) coordinates")
+  parser.add_argument("--twist", type=float, required=True, help="twist (°)")
+  parser.add_argument("--rise", type=float, required=True, help="rise (Å)")
+  parser.add_argument("--csym", type=int, default=1, help="axial symmetry (default: %(default)s)")
+  parser.add_argument("--length", type=float, required=True, help="helical length (Å)")
+  parser.add_argument("--center", type=float, nargs=2, default=(0.0, 0.0), metavar=("X", "Y"), help="where the helical axis crosses the xy plane (Å, default: 0 0)")
+  args = parser.parse_args(argv)
+  t0 = time.perf_counter()
+  try:
+    model = read_model(args.input)
+    fmt = os.path.splitext(args.output)[1].lstrip(".").lower()
+    check(fmt, args.twist, args.rise, args.csym, args.length)
+    if fmt == "npy":
+      coordinates = assembly_coordinates(model, args.twist, args.rise, args.csym, args.length, args.center, path=args.output)
+      coordinates.flush()
+      n_copies = len(coordinates)
+    else:
+      n_copies = len(helical_transforms(args.twist, args.rise, args.csym, args.length)[0])
+      chunks = assembly_chunks(fmt, model, args.twist, args.rise, args.csym, args.length, args.center, name=os.path.splitext(os.path.basename(args.output))[0])
+      with open(args.output, "wb") as f:
+        for chunk in chunks:
+          f.write(chunk)
+  except ValueError as e:
+    parser.error(str(e))
+  print(f"{n_copies} copies of {len(model)} atoms written to {args.output} in {time.perf_counter()-t0:.2f} s")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,328 @@
+"""
+Benchmarks of the geometry/plot builders over parameter grids that include the pathological cases seen in production:
+tiny twist, twist near +/-180, csym up to 20, helices at the 1000-subunit cap and large 2D lattice size factors.
+
+For each case the wall time (best of --repeat runs), the peak memory allocated during one run (tracemalloc) and,
+for figures, the size of the serialized figure JSON in bytes are recorded. The startup cases run in a fresh
+interpreter each time: importing the app, and importing it plus building and serializing the three figures of
+the default view (first paint), which is what a shinylive cold start waits for after the wheels are loaded. Results can be saved as a baseline and
+later runs compared against it with configurable regression thresholds:
+
+  python benchmark.py --save-baseline                  # record benchmark_baseline.json
+  python benchmark.py                                  # compare against it, exit status 1 on regression or without a baseline
+  python benchmark.py -k plot_helical --time-threshold 1.5 --json results.json
+
+--check instead compares the fast conversions with the reference implementations they replaced, over fixed grids:
+
+  python benchmark.py --check                          # exit status 1 on a mismatch
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+def helical_cases():
+  # name suffix, (twist, rise, csym, diameter, length)
+  return [
+    ("default", (-81.1, 19.4, 1, 290.0, 1000.0)),
+    ("tiny_twist", (0.01, 19.4, 1, 290.0, 1000.0)),
+    ("twist_near_180", (179.9, 19.4, 1, 290.0, 1000.0)),
+    ("twist_near_-180", (-179.9, 19.4, 1, 290.0, 1000.0)),
+    ("csym20", (-81.1, 19.4, 20, 290.0, 1000.0)),
+    ("subunit_cap", (-81.1, 1.4, 1, 290.0, 2800.0)),
+    ("subunit_cap_csym12", (-81.1, 1.4, 12, 290.0, 2800.0)),
+  ]
+
+def lattice_2d_cases():
+  # name suffix, (a, b, endpoint, length, lattice_size_factor)
+  return [
+    ("default", ((34.65, 0.0), (10.63, -23.01), (16, 1), 1000.0, 1.25)),
+    ("small_cell", ((5.0, 0.0), (1.5, -4.0), (100, 1), 1000.0, 1.25)),
+    ("large_size_factor", ((34.65, 0.0), (10.63, -23.01), (16, 1), 1000.0, 5.0)),
+    ("long_small_cell", ((2.0, 0.0), (0.6, -1.7), (250, 3), 3000.0, 3.0)),
+  ]
+
+def chirality_cases():
+  # name suffix, (a, b, min_diameter, max_diameter)
+  return [
+    ("default", ((34.65, 0.0), (10.63, -23.01), 100.0, 500.0)),
+    ("wide_range", ((34.65, 0.0), (10.63, -23.01), 50.0, 1000.0)),
+    ("small_cell", ((5.0, 0.0), (1.5, -4.0), 20.0, 200.0)),
+  ]
+
+def animation_cases():
+  # name suffix, (twist, rise, twist_end, rise_end, csym, diameter, length, n_frames)
+  return [
+    ("default", (-81.1, 19.4, -75.0, 20.0, 1, 290.0, 1000.0, 30)),
+    ("frame_cap_csym20", (-10.0, 2.0, 10.0, 40.0, 20, 290.0, 100000.0, 120)),
+  ]
+
+def startup_cases():
+  twist, rise, csym, diameter, length = helical_cases()[0][1]
+  import_app = "import app"
+  first_paint = "\n".join([
+    "import app",
+    f"a, b, endpoint = app.convert_helical_lattice_to_2d_lattice(twist={twist}, rise={rise}, csym={csym}, diameter={diameter})",
+    f"app.plot_2d_lattice(a, b, endpoint, length={length}, lattice_size_factor=1.25, marker_size=5.0, figure_height=800).to_json()",
+    f"app.plot_helical_lattice_unrolled({diameter}, {length}, {twist}, {rise}, {csym}, marker_size=5.0, figure_height=800).to_json()",
+    f"app.plot_helical_lattice({diameter}, {length}, {twist}, {rise}, {csym}, marker_size=3.0, figure_height=800).to_json()",
+  ])
+  return [("startup[import_app]", import_app), ("startup[first_paint]", first_paint)]
+
+def helical_to_2d_check_grid():
+  # (twist, rise, csym, diameter) rows compared with the reference search; tiny twists are left out as the
+  # reference takes seconds for each of them
+  twists = (-179.9, -135.0, -81.1, -30.0, 7.5, 45.0, 120.0, 180.0)
+  return [(twist, rise, csym, diameter) for twist in twists for rise in (1.4, 19.4, 60.0) for csym in (1, 2, 3, 5, 12, 20) for diameter in (100.0, 290.0, 1000.0)]
+
+def check_helical_to_2d():
+  # the reduction must find a cell of the reference's area whose vectors are nowhere longer. Equal-length
+  # ties may be resolved to another cell, and where the reference's window misses the shortest vectors the
+  # reduction's are shorter
+  import warnings
+  import numpy as np
+  import lattice
+  twist, rise, csym, diameter = np.array(helical_to_2d_check_grid()).T
+  failures = []
+  for primitive_unitcell in (True, False):
+    with warnings.catch_warnings():
+      warnings.simplefilter("error", RuntimeWarning)  # the reduction must not compute with inf/nan silently
+      new = lattice.batch_convert_helical_lattice_to_2d_lattice(twist, rise, csym, diameter, primitive_unitcell=primitive_unitcell)
+    ref = lattice.batch_convert_helical_lattice_to_2d_lattice(twist, rise, csym, diameter, primitive_unitcell=primitive_unitcell, method="reference")
+    identical = np.all([np.isclose(new[name], ref[name], rtol=1e-6, atol=1e-6) for name in new.dtype.names], axis=0)
+    area = [np.abs(r["ax"]*r["by"] - r["ay"]*r["bx"]) for r in (new, ref)]
+    lengths = [np.sort([np.hypot(r["ax"], r["ay"]), np.hypot(r["bx"], r["by"])], axis=0) for r in (new, ref)]
+    same_area = np.isclose(area[0], area[1], rtol=1e-6)
+    same_lengths = np.isclose(lengths[0], lengths[1], rtol=1e-6).all(axis=0)
+    not_longer = (lengths[0] <= lengths[1]*(1+1e-6)).all(axis=0)
+    print(f"helical -> 2D, primitive_unitcell={primitive_unitcell}: {len(new)} sets, {identical.sum()} identical, "
+      f"{(~identical & same_lengths).sum()} equal-length ties, {(~same_lengths & not_longer).sum()} shorter than the reference")
+    for k in np.flatnonzero(~same_area | ~not_longer):
+      failures.append(f"helical -> 2D twist={twist[k]} rise={rise[k]} csym={csym[k]:.0f} diameter={diameter[k]} primitive_unitcell={primitive_unitcell}: "
+        f"area {area[0][k]:.3f} vs {area[1][k]:.3f}, lengths {lengths[0][:, k].round(3).tolist()} vs {lengths[1][:, k].round(3).tolist()}")
+  return failures
+
+def lattice_2d_check_grid():
+  # (a, b, (na, nb)) rows compared with the reference search, from small endpoints inside its -10..10 window
+  # to wide tubes far beyond it
+  lattices = [((34.65, 0.0), (10.63, -23.01)), ((5.0, 0.0), (1.5, -4.0)), ((10.0, 0.0), (0.0, 10.0)), ((20.0, 0.0), (10.0, 17.32)), ((47.0, 0.0), (-8.3, 51.2))]
+  endpoints = [(na, nb) for na in (1, 2, 3, 5, 8, 12, 16, 20, 30, 45, 60, 100, 200) for nb in (-60, -20, -7, -3, -1, 0, 1, 2, 4, 9, 15, 40)]
+  return [(a, b, endpoint) for a, b in lattices for endpoint in endpoints]
+
+def window_result(a, b, endpoint, maxI=10, epsilon=0.5):
+  # the exact search restricted to the candidates the reference's -maxI..maxI window holds: a candidate (i, j)
+  # is in it when some (i, j) + m*(na, nb), the same vector after wrapping around the circumference, is
+  import numpy as np
+  import lattice
+  na, nb = endpoint[:, 0], endpoint[:, 1]
+  v_equator = na[:, None]*a + nb[:, None]*b
+  circumference = np.linalg.norm(v_equator, axis=1)
+  ang = np.arctan2(v_equator[:, 1], v_equator[:, 0])
+  cos, sin = np.cos(ang)[:, None], np.sin(ang)[:, None]
+  va = np.hstack((cos*a[:, 0:1]+sin*a[:, 1:2], -sin*a[:, 0:1]+cos*a[:, 1:2]))
+  vb = np.hstack((cos*b[:, 0:1]+sin*b[:, 1:2], -sin*b[:, 0:1]+cos*b[:, 1:2]))
+  minLength = np.maximum(1.0, np.minimum(np.linalg.norm(va, axis=1), np.linalg.norm(vb, axis=1)) * 0.9)
+  g, k_max = lattice.rise_levels(va, vb, na, nb, circumference, minLength, epsilon)
+  i, j, mask = lattice.geometric_candidates(na, nb, g, k_max)
+
+  def shifts(i, n):
+    # the range of m with |i + m*n| <= maxI, empty when lo > hi
+    n = n[:, None]
+    step = np.where(n == 0, 1, n)
+    inside = np.abs(i) <= maxI
+    lo = np.where(n == 0, np.where(inside, -np.inf, np.inf), np.ceil(np.where(n > 0, -maxI-i, maxI-i)/step))
+    hi = np.where(n == 0, np.where(inside, np.inf, -np.inf), np.floor(np.where(n > 0, maxI-i, -maxI-i)/step))
+    return lo, hi
+  (lo_i, hi_i), (lo_j, hi_j) = shifts(i, na), shifts(j, nb)
+  in_window = np.maximum(lo_i, lo_j) <= np.minimum(hi_i, hi_j)
+  ret = np.empty(len(a), dtype=lattice.HELICAL_DTYPE)
+  lattice.select_helical_parameters(ret, np.arange(len(a)), i, j, mask & in_window, va, vb, circumference, minLength, epsilon)
+  dy = np.abs(va[:, 0]*vb[:, 1] - va[:, 1]*vb[:, 0])*g/circumference  # the rise between the lines of lattice points
+  return ret, dy
+
+def check_2d_to_helical(epsilon=0.5):
+  # where the reference's window holds the vectors of the exact answer, both must agree. Elsewhere the exact search
+  # must find a vector at a rise level no higher than the reference's, and when no lattice line lies within epsilon
+  # of the equator, the equatorial repeat (na, nb)/gcd(na, nb) gives csym = gcd(na, nb)
+  import numpy as np
+  import lattice
+  rows = lattice_2d_check_grid()
+  a, b, endpoint = (np.array([row[k] for row in rows], dtype=float if k < 2 else np.int64) for k in range(3))
+  new = lattice.batch_convert_2d_lattice_to_helical_lattice(a, b, endpoint)
+  ref = np.array([lattice.convert_2d_lattice_to_helical_lattice_reference(a[k], b[k], endpoint[k]) for k in range(len(rows))])
+  window, dy = window_result(a, b, endpoint, epsilon=epsilon)
+
+  def same(r1, r2):
+    # twists are compared modulo 360/csym, as +180/csym and -180/csym are the same helix
+    period = 360/r1["csym"]
+    dtwist = np.abs(np.mod(r1["twist"] - r2["twist"] + period/2, period) - period/2)
+    return (dtwist < 1e-6) & np.isclose(r1["rise"], r2["rise"], atol=1e-6) & (r1["csym"] == r2["csym"])
+  ref = np.rec.fromarrays(ref.T, names=("twist", "rise", "csym", "diameter"))
+  covered = same(window, new)
+  identical = same(new, ref)
+  level = [np.abs(np.round(r["rise"]/epsilon)) for r in (new, ref)]
+  gcd = np.gcd(endpoint[:, 0], endpoint[:, 1])
+  ok = np.where(covered, identical, (level[0] <= level[1]) & ((dy <= epsilon) | (new["csym"] == gcd)))
+  print(f"2D -> helical: {len(rows)} sets, {covered.sum()} within the reference window, {(covered & identical).sum()} of them identical; "
+    f"{(~covered).sum()} beyond it, {(~covered & (new['csym'] == gcd)).sum()} of them with csym = gcd(na, nb)")
+  return [f"2D -> helical a={rows[k][0]} b={rows[k][1]} endpoint={rows[k][2]}: {new[k].tolist()} vs reference {ref[k].tolist()}" + ("" if covered[k] else f", gcd {gcd[k]}")
+    for k in np.flatnonzero(~ok)]
+
+def check_figure_cache():
+  # a figure read back from the figure cache must report the same points and retained bytes as the figure built
+  import app
+  import metrics
+  import session_memory
+  failures = []
+  for output_id, figure_function in app.FIGURE_FUNCTIONS.items():
+    parameters = {name: app.DEFAULT_PARAMETERS[name] for name in app.figure_parameter_names(figure_function)}
+    built = figure_function(**parameters)
+    if app.PAYLOAD_MODE == "compact":
+      app.compact_figure(built)
+    cached = app.figure_from_json(built.to_json())
+    counts = [(metrics.figure_point_count(fig), session_memory.figure_bytes(fig)) for fig in (built, cached)]
+    if counts[0] != counts[1]:
+      failures.append(f"figure cache {output_id}: built (points, bytes) {counts[0]} vs cached {counts[1]}")
+  print(f"figure cache: {len(app.FIGURE_FUNCTIONS)} default figures read back")
+  return failures
+
+def check_conversions():
+  # compares the conversions and the figure cache with their references, returns the exit status
+  failures = check_helical_to_2d() + check_2d_to_helical() + check_figure_cache()
+  for failure in failures:
+    print(f"MISMATCH {failure}")
+  if not failures:
+    print("all conversions agree with their references")
+  return 1 if failures else 0
+
+def measure_startup(code, repeat):
+  # wall time of running code in a fresh interpreter, minus the time of an empty interpreter
+  def run(code):
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-W", "ignore", "-c", code], check=True, cwd=os.path.dirname(DEFAULT_BASELINE))
+    return time.perf_counter() - t0
+  empty = min(run("pass") for _ in range(repeat))
+  return {"time": min(run(code) for _ in range(repeat)) - empty}
+
+def build_cases():
+  import app
+  import lattice
+  cases = []
+  for name, (twist, rise, csym, diameter, length) in helical_cases():
+    cases.append((f"plot_helical_lattice[{name}]", True, lambda twist=twist, rise=rise, csym=csym, diameter=diameter, length=length: app.plot_helical_lattice(diameter, length, twist, rise, csym, marker_size=3.0, figure_height=800)))
+    cases.append((f"plot_helical_lattice_unrolled[{name}]", True, lambda twist=twist, rise=rise, csym=csym, diameter=diameter, length=length: app.plot_helical_lattice_unrolled(diameter, length, twist, rise, csym, marker_size=5.0, figure_height=800)))
+    cases.append((f"convert_helical_lattice_to_2d_lattice[{name}]", False, lambda twist=twist, rise=rise, csym=csym, diameter=diameter: lattice.convert_helical_lattice_to_2d_lattice(twist=twist, rise=rise, csym=csym, diameter=diameter)))
+  for name, (a, b, endpoint, length, lattice_size_factor) in lattice_2d_cases():
+    cases.append((f"plot_2d_lattice[{name}]", True, lambda a=a, b=b, endpoint=endpoint, length=length, lattice_size_factor=lattice_size_factor: app.plot_2d_lattice(a, b, endpoint, length=length, lattice_size_factor=lattice_size_factor, marker_size=5.0, figure_height=800)))
+    cases.append((f"convert_2d_lattice_to_helical_lattice[{name}]", False, lambda a=a, b=b, endpoint=endpoint: lattice.convert_2d_lattice_to_helical_lattice(a=a, b=b, endpoint=endpoint)))
+  for name, (a, b, min_diameter, max_diameter) in chirality_cases():
+    cases.append((f"chirality_map[{name}]", False, lambda a=a, b=b, min_diameter=min_diameter, max_diameter=max_diameter: lattice.chirality_map(a, b, min_diameter, max_diameter)))
+    cases.append((f"plot_chirality_map[{name}]", True, lambda a=a, b=b, min_diameter=min_diameter, max_diameter=max_diameter: app.plot_chirality_map(a, b, lattice.chirality_map(a, b, min_diameter, max_diameter), min_diameter, max_diameter, marker_size=5.0, figure_height=800)))
+  for name, (twist, rise, twist_end, rise_end, csym, diameter, length, n_frames) in animation_cases():
+    args = (diameter, length, twist, rise, twist_end, rise_end, csym, n_frames)
+    cases.append((f"animate_helical_lattice[{name}]", True, lambda args=args: app.animate_helical_lattice(*args, marker_size=3.0, figure_height=800)))
+    cases.append((f"animate_helical_lattice_unrolled[{name}]", True, lambda args=args: app.animate_helical_lattice_unrolled(*args, marker_size=5.0, figure_height=800)))
+  return cases
+
+def measure(fn, is_figure, repeat):
+  times = []
+  for _ in range(repeat):
+    t0 = time.perf_counter()
+    ret = fn()
+    times.append(time.perf_counter() - t0)
+  tracemalloc.start()
+  try:
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  result = {"time": min(times), "peak_memory": peak}
+  if is_figure:
+    result["figure_bytes"] = len(ret.to_json())
+  return result
+
+def compare(results, baseline, thresholds):
+  # a metric regresses when it exceeds its baseline value by more than the threshold ratio
+  regressions = []
+  for name, metrics in results.items():
+    if name not in baseline: continue
+    for metric, threshold in thresholds.items():
+      if metric not in metrics or metric not in baseline[name]: continue
+      old, new = baseline[name][metric], metrics[metric]
+      if old > 0 and new > old*threshold:
+        regressions.append((name, metric, old, new))
+  return regressions
+
+def format_value(metric, v):
+  if metric == "time": return f"{v*1e3:.2f} ms"
+  return f"{v/1024:.1f} KiB"
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the HelicalLattice geometry/plot builders")
+  parser.add_argument("-k", dest="pattern", default="", help="only run cases whose name contains this string")
+  parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the best is reported (default: %(default)s)")
+  parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file (default: %(default)s)")
+  parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline instead of comparing")
+  parser.add_argument("--time-threshold", type=float, default=1.25, help="allowed wall time ratio to baseline (default: %(default)s)")
+  parser.add_argument("--memory-threshold", type=float, default=1.25, help="allowed peak memory ratio to baseline (default: %(default)s)")
+  parser.add_argument("--size-threshold", type=float, default=1.05, help="allowed serialized figure size ratio to baseline (default: %(default)s)")
+  parser.add_argument("--json", help="also write the results to this JSON file")
+  parser.add_argument("--check", action="store_true", help="compare the conversions with their reference implementations instead of timing, exit status 1 on a mismatch")
+  args = parser.parse_args(argv)
+
+  import warnings
+  warnings.simplefilter("ignore")  # e.g. plot_2d_lattice's point budget warning
+  if args.check:
+    return check_conversions()
+
+  results = {}
+  for name, code in startup_cases():
+    if args.pattern not in name: continue
+    results[name] = measure_startup(code, args.repeat)
+    print(f"{name:60s} {results[name]['time']*1e3:10.2f} ms", flush=True)
+  for name, is_figure, fn in build_cases():
+    if args.pattern not in name: continue
+    results[name] = measure(fn, is_figure, args.repeat)
+    r = results[name]
+    size = f"{r['figure_bytes']/1024:10.1f} KiB" if "figure_bytes" in r else ""
+    print(f"{name:60s} {r['time']*1e3:10.2f} ms {r['peak_memory']/1024:10.1f} KiB peak {size}", flush=True)
+
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=1)
+
+  if args.save_baseline:
+    baseline = {}
+    if os.path.exists(args.baseline):
+      with open(args.baseline) as f:
+        baseline = json.load(f)
+    baseline.update(results)
+    with open(args.baseline, "w") as f:
+      json.dump(baseline, f, indent=1)
+    print(f"baseline saved to {args.baseline}")
+    return 0
+
+  if not os.path.exists(args.baseline):
+    print(f"no baseline at {args.baseline} to compare with, run with --save-baseline to create one")
+    return 1
+  with open(args.baseline) as f:
+    baseline = json.load(f)
+  thresholds = {"time": args.time_threshold, "peak_memory": args.memory_threshold, "figure_bytes": args.size_threshold}
+  regressions = compare(results, baseline, thresholds)
+  for name in results:
+    if name not in baseline:
+      print(f"NOT COMPARED {name}: not in the baseline")
+  for name, metric, old, new in regressions:
+    print(f"REGRESSION {name} {metric}: {format_value(metric, old)} -> {format_value(metric, new)} ({new/old:.2f}x > {thresholds[metric]}x)")
+  if not regressions:
+    print(f"no regressions against {args.baseline}")
+  return 1 if regressions else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
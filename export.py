@@ -0,0 +1,210 @@
+"""
+Streaming export of the subunit coordinates of a helical lattice of any length, as CSV, NPZ or PDB pseudo-atoms.
+
+Subunits are generated CHUNK_SUBUNITS indices at a time, one symmetry copy after the other, and each chunk is
+encoded and handed on before the next one is computed. An export of millions of subunits therefore never exists in
+memory as a whole, and its first bytes are ready at once. The phases are those of the plots (geometry.HelicalSubunits):
+subunit i of copy k is at twist*i + k*360/csym degrees and z = rise*i, for all z within ±length/2. Three views of the
+same subunits can be exported:
+
+  helix     i, copy, x, y, z: position on the helix (Å), around the z axis
+  unrolled  i, copy, twist (°, in [0, 360)), arc (Å along the circumference), z (Å)
+  lattice   i, copy, x, y: the subunit as a point of the 2D lattice the helix is rolled from, given the equator
+            vector na*a+nb*b of that lattice; the equator runs from the origin along it
+
+  python export.py helix.csv --twist -81.1 --rise 19.4 --diameter 290 --length 1e6
+  python export.py lattice.npz --content lattice --twist -81.1 --rise 19.4 --diameter 290 --length 1e4 --equator 565.0 -709.4
+"""
+
+import string
+import zipfile
+
+import numpy as np
+
+COLUMNS = {
+  "helix": ("i", "copy", "x", "y", "z"),
+  "unrolled": ("i", "copy", "twist", "arc", "z"),
+  "lattice": ("i", "copy", "x", "y"),
+}
+FORMATS = ("csv", "npz", "pdb")
+CHUNK_SUBUNITS = 50000
+PDB_CHAINS = string.ascii_uppercase + string.ascii_lowercase + string.digits
+PDB_RANGE = (-999.999, 9999.999)  # what the 8.3f coordinate fields hold
+PDB_ATOM = "ATOM  {:5d}  CA  ALA {}{:4d}    {:8.3f}{:8.3f}{:8.3f}  1.00  0.00           C  \n"
+
+def subunit_range(rise, length):
+  # indices i0..i1 of the subunits within ±length/2
+  return int(np.ceil(-length/2/rise)), int(np.floor(length/2/rise))
+
+def subunit_count(rise, csym, length):
+  i0, i1 = subunit_range(rise, length)
+  return max(i1-i0+1, 0)*csym
+
+def coordinate_dtype(content):
+  return np.dtype([(name, "i8" if name in ("i", "copy") else "f8") for name in COLUMNS[content]])
+
+def coordinate_chunks(content, twist, rise, csym, diameter, length, equator=None, chunk_size=CHUNK_SUBUNITS):
+  # structured arrays of at most chunk_size subunits, all of one copy
+  if content not in COLUMNS:
+    raise ValueError(f"unknown content {content!r}, expected one of {', '.join(COLUMNS)}")
+  if content == "lattice" and equator is None:
+    raise ValueError("the lattice content needs the equator vector of the 2D lattice")
+  dtype = coordinate_dtype(content)
+  i0, i1 = subunit_range(rise, length)
+  circumference = np.pi*diameter
+  if equator is not None:
+    v0 = np.asarray(equator, dtype=float)
+    v1 = np.array([-v0[1], v0[0]])/np.linalg.norm(v0)  # along the helical axis, as in the 2D lattice plot
+  for copy in range(int(csym)):
+    for start in range(i0, i1+1, chunk_size):
+      i = np.arange(start, min(start+chunk_size, i1+1))
+      phase = np.mod(twist*i + copy*360/csym, 360)
+      z = rise*i
+      chunk = np.empty(len(i), dtype)
+      chunk["i"] = i
+      chunk["copy"] = copy
+      if content == "helix":
+        angle = np.deg2rad(phase)
+        chunk["x"] = diameter/2*np.cos(angle)
+        chunk["y"] = diameter/2*np.sin(angle)
+        chunk["z"] = z
+      elif content == "unrolled":
+        chunk["twist"] = phase
+        chunk["arc"] = phase/360*circumference
+        chunk["z"] = z
+      else:
+        chunk["x"] = phase/360*v0[0] + z*v1[0]
+        chunk["y"] = phase/360*v0[1] + z*v1[1]
+      yield chunk
+
+def coordinate_bounds(content, rise, diameter, length, equator=None):
+  # (min, max) over all exported coordinates, without generating them
+  i0, i1 = subunit_range(rise, length)
+  z0, z1 = rise*i0, rise*i1
+  if content == "helix":
+    return min(-diameter/2, z0), max(diameter/2, z1)
+  if content == "unrolled":
+    return min(0.0, z0), max(np.pi*diameter, z1)
+  v0 = np.asarray(equator, dtype=float)
+  v1 = np.array([-v0[1], v0[0]])/np.linalg.norm(v0)
+  corners = np.array([s*v0 + z*v1 for s in (0, 1) for z in (z0, z1)])
+  return corners.min(), corners.max()
+
+def check(fmt, content, twist, rise, csym, diameter, length, equator=None):
+  # raises ValueError for an export that cannot be written, before any of it is
+  if fmt not in FORMATS:
+    raise ValueError(f"unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+  if content not in COLUMNS:
+    raise ValueError(f"unknown content {content!r}, expected one of {', '.join(COLUMNS)}")
+  if rise <= 0 or length <= 0 or csym < 1:
+    raise ValueError("rise and length must be positive and csym at least 1")
+  if content == "lattice" and equator is None:
+    raise ValueError("the lattice content needs the equator vector of the 2D lattice")
+  if fmt == "pdb":
+    lo, hi = coordinate_bounds(content, rise, diameter, length, equator)
+    if lo < PDB_RANGE[0] or hi > PDB_RANGE[1]:
+      raise ValueError(f"PDB coordinates must be within {PDB_RANGE[0]}..{PDB_RANGE[1]} Å but these span {lo:.0f}..{hi:.0f} Å: export them as CSV or NPZ")
+
+class ChunkSink:
+  # write-only, unseekable file collecting what zipfile writes until it is taken
+  def __init__(self):
+    self.parts = []
+
+  def write(self, data):
+    self.parts.append(bytes(data))
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def take(self):
+    data = b"".join(self.parts)
+    self.parts = []
+    return data
+
+def csv_chunks(chunks, content):
+  # rows are formatted from columns converted to Python lists, several times faster than np.savetxt
+  yield ",".join(COLUMNS[content]) + "\n"
+  row = ",".join("%d" if name in ("i", "copy") else "%.4f" for name in COLUMNS[content]) + "\n"
+  for chunk in chunks:
+    yield "".join(map(row.__mod__, zip(*(chunk[name].tolist() for name in COLUMNS[content]))))
+
+def npz_chunks(chunks, content, count, parameters):
+  # an .npz as np.savez writes it: the parameters as 0-d arrays and the subunits as one structured array
+  # "coordinates". Zip members written to an unseekable file carry their sizes after their data, so only the
+  # row count is needed up front, for the .npy header
+  sink = ChunkSink()
+  with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+    for name, value in parameters.items():
+      with zf.open(f"{name}.npy", "w") as f:
+        np.lib.format.write_array(f, np.asarray(value), allow_pickle=False)
+    with zf.open("coordinates.npy", "w", force_zip64=True) as f:
+      header = {"descr": np.lib.format.dtype_to_descr(coordinate_dtype(content)), "fortran_order": False, "shape": (count,)}
+      np.lib.format.write_array_header_2_0(f, header)
+      for chunk in chunks:
+        f.write(chunk.tobytes())
+        yield sink.take()
+  yield sink.take()
+
+def pdb_chunks(chunks, content, parameters):
+  # one CA pseudo-atom per subunit and one chain per symmetry copy. Atom serial and residue numbers wrap around
+  # past the 99999 and 9999 the format holds, and chain ids after 62 copies
+  yield "".join(f"REMARK   1 {name.upper()} {value}\n" for name, value in parameters.items())
+  serial = 0
+  copy = None
+  for chunk in chunks:
+    if copy is not None and chunk["copy"][0] != copy:
+      yield "TER\n"
+    if chunk["copy"][0] != copy:
+      copy, residue = int(chunk["copy"][0]), 0
+    if content == "helix":
+      x, y, z = chunk["x"], chunk["y"], chunk["z"]
+    elif content == "unrolled":
+      x, y, z = chunk["arc"], chunk["z"], np.zeros(len(chunk))
+    else:
+      x, y, z = chunk["x"], chunk["y"], np.zeros(len(chunk))
+    chain = PDB_CHAINS[copy % len(PDB_CHAINS)]
+    lines = [PDB_ATOM.format((serial+k+1) % 100000, chain, (residue+k+1) % 10000, *xyz) for k, xyz in enumerate(zip(x.tolist(), y.tolist(), z.tolist()))]
+    serial += len(chunk)
+    residue += len(chunk)
+    yield "".join(lines)
+  yield "TER\nEND\n"
+
+def export_chunks(fmt, content, twist, rise, csym, diameter, length, equator=None, chunk_size=CHUNK_SUBUNITS):
+  # the export as a generator of str (csv, pdb) or bytes (npz) chunks
+  check(fmt, content, twist, rise, csym, diameter, length, equator)
+  chunks = coordinate_chunks(content, twist, rise, csym, diameter, length, equator, chunk_size)
+  parameters = {"twist": float(twist), "rise": float(rise), "csym": int(csym), "diameter": float(diameter), "length": float(length)}
+  if equator is not None:
+    parameters["equator"] = [float(v) for v in equator]
+  if fmt == "csv":
+    return csv_chunks(chunks, content)
+  if fmt == "npz":
+    return npz_chunks(chunks, content, subunit_count(rise, csym, length), parameters)
+  return pdb_chunks(chunks, content, parameters)
+
+def main(argv=None):
+  import argparse
+  import os
+  parser = argparse.ArgumentParser(description="Export the subunit coordinates of a helical lattice of any length")
+  parser.add_argument("output", help="output file: .csv, .npz or .pdb")
+  parser.add_argument("--content", choices=tuple(COLUMNS), default="helix", help="(default: %(default)s)")
+  parser.add_argument("--twist", type=float, required=True, help="twist (°)")
+  parser.add_argument("--rise", type=float, required=True, help="rise (Å)")
+  parser.add_argument("--csym", type=int, default=1, help="axial symmetry (default: %(default)s)")
+  parser.add_argument("--diameter", type=float, required=True, help="helical diameter (Å)")
+  parser.add_argument("--length", type=float, required=True, help="helical length (Å)")
+  parser.add_argument("--equator", type=float, nargs=2, metavar=("X", "Y"), help="equator vector na*a+nb*b of the 2D lattice (Å), for --content lattice")
+  args = parser.parse_args(argv)
+  fmt = os.path.splitext(args.output)[1].lstrip(".").lower()
+  try:
+    chunks = export_chunks(fmt, args.content, args.twist, args.rise, args.csym, args.diameter, args.length, args.equator)
+  except ValueError as e:
+    parser.error(str(e))
+  with open(args.output, "wb") as f:
+    for chunk in chunks:
+      f.write(chunk.encode() if isinstance(chunk, str) else chunk)
+  print(f"{subunit_count(args.rise, args.csym, args.length)} subunits written to {args.output}")
+
+if __name__ == "__main__":
+  main()
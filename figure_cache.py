@@ -0,0 +1,144 @@
+"""
+On-disk cache of serialized figures, shared by all worker processes and kept across restarts.
+
+Entries are zlib-compressed figure JSON in a SQLite database, keyed by a hash of the figure function, its input
+values and a fingerprint of the code that builds it. SQLite's file locking makes the cache safe for concurrent
+readers and writers in several processes; each thread uses its own connection. When the stored payloads exceed
+max_bytes, the least recently used entries are evicted. Their total size is kept up to date by triggers, so a write
+does not sum the whole table, and the time an entry was last used is only rewritten once it is LAST_USED_RESOLUTION
+seconds old, so most hits do not write at all.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS figures (
+  key TEXT PRIMARY KEY,
+  payload BLOB NOT NULL,
+  size INTEGER NOT NULL,
+  last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS figures_last_used ON figures (last_used);
+CREATE TABLE IF NOT EXISTS totals (
+  id INTEGER PRIMARY KEY CHECK (id = 0),
+  bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM figures;
+CREATE TRIGGER IF NOT EXISTS figures_insert AFTER INSERT ON figures BEGIN
+  UPDATE totals SET bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS figures_update AFTER UPDATE OF size ON figures BEGIN
+  UPDATE totals SET bytes = bytes + NEW.size - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS figures_delete AFTER DELETE ON figures BEGIN
+  UPDATE totals SET bytes = bytes - OLD.size WHERE id = 0;
+END;
+"""
+LAST_USED_RESOLUTION = 60.0  # seconds, the precision of the least-recently-used order
+EVICT_BATCH = 64
+
+def canonical(value, digits=6):
+  # equal inputs must give equal keys: floats are rounded (like the conversion caches) and ints/floats unified
+  if isinstance(value, bool) or value is None or isinstance(value, str):
+    return value
+  if isinstance(value, (int, float)):
+    value = round(float(value), digits)
+    return int(value) if value.is_integer() else value
+  if isinstance(value, (list, tuple)):
+    return [canonical(v, digits) for v in value]
+  if isinstance(value, dict):
+    return {str(k): canonical(v, digits) for k, v in value.items()}
+  raise TypeError(f"cannot use {type(value).__name__} in a figure cache key")
+
+def figure_key(name, parameters, version=""):
+  text = json.dumps({"name": name, "parameters": canonical(parameters), "version": version}, sort_keys=True)
+  return hashlib.sha256(text.encode()).hexdigest()
+
+def source_fingerprint(*paths, versions=()):
+  # changes whenever one of the files that build the figures, or a library version that shapes them, changes,
+  # so a deploy never serves stale figures
+  h = hashlib.sha256()
+  for path in paths:
+    with open(path, "rb") as f:
+      h.update(f.read())
+  for version in versions:
+    h.update(str(version).encode())
+  return h.hexdigest()[:16]
+
+class FigureCache:
+  def __init__(self, path, max_bytes=256*2**20, timeout=30.0):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.timeout = timeout
+    self.local = threading.local()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    db = self.connection()
+    try:
+      # in one transaction, so that of several workers starting together one creates the triggers and the total
+      db.executescript(f"BEGIN IMMEDIATE;\n{SCHEMA}COMMIT;")
+    except BaseException:
+      if db.in_transaction:
+        db.execute("ROLLBACK")
+      raise
+
+  def connection(self):
+    db = getattr(self.local, "db", None)
+    if db is None:
+      db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+      db.execute("PRAGMA journal_mode=WAL")
+      db.execute("PRAGMA synchronous=NORMAL")
+      self.local.db = db
+    return db
+
+  def get(self, key):
+    db = self.connection()
+    row = db.execute("SELECT payload, last_used FROM figures WHERE key = ?", (key,)).fetchone()
+    if row is None:
+      return None
+    now = time.time()
+    if now - row[1] > LAST_USED_RESOLUTION:
+      db.execute("UPDATE figures SET last_used = ? WHERE key = ?", (now, key))
+    return zlib.decompress(row[0]).decode()
+
+  def put(self, key, figure_json):
+    payload = zlib.compress(figure_json.encode(), 6)
+    db = self.connection()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+      # an upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the delete trigger
+      db.execute("INSERT INTO figures (key, payload, size, last_used) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (key) DO UPDATE SET payload = excluded.payload, size = excluded.size, last_used = excluded.last_used", (key, payload, len(payload), time.time()))
+      self.evict(db)
+      db.execute("COMMIT")
+    except BaseException:
+      db.execute("ROLLBACK")
+      raise
+
+  def total_bytes(self, db=None):
+    return (db or self.connection()).execute("SELECT bytes FROM totals WHERE id = 0").fetchone()[0]
+
+  def evict(self, db):
+    # the least recently used entries, a batch at a time, until the total fits
+    total = self.total_bytes(db)
+    while total > self.max_bytes:
+      rows = db.execute("SELECT key, size FROM figures ORDER BY last_used LIMIT ?", (EVICT_BATCH,)).fetchall()
+      if not rows:
+        break
+      for key, size in rows:
+        db.execute("DELETE FROM figures WHERE key = ?", (key,))
+        total -= size
+        if total <= self.max_bytes:
+          break
+
+  def stats(self):
+    db = self.connection()
+    return {"entries": db.execute("SELECT COUNT(*) FROM figures").fetchone()[0], "bytes": self.total_bytes(db)}
+
+  def clear(self):
+    self.connection().execute("DELETE FROM figures")
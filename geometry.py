@@ -0,0 +1,168 @@
+"""
+Scene geometry for the helix views, free of any UI dependency.
+
+The subunits of a helical lattice are indexed once per parameter set (HelicalSubunits); the 3D and the unrolled
+views are derived from the same phase and rise arrays, so the two views always show the same subunits. The unrolled
+view draws them on the plane of the 2D lattice, in Å. Only the subunits inside the z window that is viewed are
+indexed, at most as many as the plot height can resolve, so a helix of any length has a bounded size per view. The
+frames of an animation are indexed together (HelicalSubunitFrames), within one budget for all frames as they are
+sent at once.
+
+Curves and surfaces are sampled just finely enough that their chord error stays below a tolerance given in
+screen pixels, and never with more than a fixed point budget, so the 3D figure has a bounded size for any
+twist, rise, csym, diameter and length. Unit circle/cylinder templates are cached and only rescaled per call.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+CHORD_TOLERANCE_PIXELS = 0.5
+MIN_CIRCLE_POINTS = 13
+MAX_CIRCLE_POINTS = 101
+MAX_SPIRAL_POINTS = 20000
+SUBUNIT_ROWS_PER_PIXEL = 2.5
+MAX_FRAME_POINTS = 100000
+
+def max_subunits(figure_height):
+  # subunits per helix drawn in one view: denser than this, neighboring subunits fall within the same pixel row
+  return max(int(figure_height*SUBUNIT_ROWS_PER_PIXEL), 100)
+
+def max_frame_subunits(figure_height, csym, n_frames):
+  # subunits per helix and frame of an animation, whose frames are all sent at once: MAX_FRAME_POINTS subunits
+  # (and as many spiral points) in all frames together
+  return max(min(max_subunits(figure_height), MAX_FRAME_POINTS//(csym*n_frames)), 10)
+
+def subunit_range(rise, z0, z1, max_subunits):
+  # indices i0..i1 of the subunits of one helix covering the z window, and the step that keeps every step-th of them
+  # within max_subunits. i0 is a multiple of step, so that panning an overview keeps the same subunits
+  i0, i1 = int(np.floor(z0/rise))-1, int(np.ceil(z1/rise))+1
+  step = -(-(i1-i0+1)//max_subunits)
+  return i0//step*step, i1, step
+
+class HelicalSubunits:
+  # subunits i = i0..i1 of the csym helices covering the z window [z0, z1], one row per symmetry copy: phase (degrees)
+  # and z (Å) of each subunit. A window holding more than max_subunits per helix is an overview: every step-th subunit
+  # over the whole window is indexed and complete is False. The arrays are read-only as instances are shared through
+  # helical_subunits
+  def __init__(self, twist, rise, csym, z0, z1, max_subunits):
+    self.i0, self.i1, self.step = subunit_range(rise, z0, z1, max_subunits)
+    self.complete = self.step == 1
+    self.i = np.arange(self.i0, self.i1+1, self.step)
+    self.phase = twist*self.i[None, :] + (np.arange(csym)/csym*360)[:, None]
+    self.z = np.broadcast_to(rise*self.i, self.phase.shape)
+    for a in (self.i, self.phase):
+      a.flags.writeable = False
+
+  def unrolled(self):
+    # (angle in [0, 360), z) of the helical lattice cut along the axis and unrolled
+    return np.mod(self.phase, 360), self.z
+
+  def planar(self, r):
+    # (arc length in [0, 2*pi*r), z) in Å of the unrolled subunits of a helix of radius r: the plane of its 2D lattice
+    angle, z = self.unrolled()
+    return np.deg2rad(angle)*r, z
+
+  def cylinder(self, r):
+    # (x, y, z) of the subunits on a cylinder of radius r
+    phase = np.deg2rad(self.phase)
+    return r*np.cos(phase), r*np.sin(phase), self.z
+
+class HelicalSubunitFrames:
+  # the subunits of n_frames parameter sets morphing linearly from (twist, rise) to (twist_end, rise_end), indexed in
+  # one pass: phase and z are (frame, copy, subunit) arrays. All frames share the indices i0..i1 (every step-th) that
+  # cover the z window at the smallest rise; frame k only shows i0[k]..i1[k], its own range, and is NaN beyond it
+  def __init__(self, twist, rise, twist_end, rise_end, csym, z0, z1, max_subunits, n_frames):
+    t = np.linspace(0, 1, n_frames)
+    self.twist = twist + (twist_end-twist)*t
+    self.rise = rise + (rise_end-rise)*t
+    i0, i1, self.step = subunit_range(min(rise, rise_end), z0, z1, max_subunits)
+    self.complete = self.step == 1
+    self.i = np.arange(i0, i1+1, self.step)
+    self.i0 = np.maximum(np.floor(z0/self.rise)-1, i0).astype(int)
+    self.i1 = np.minimum(np.ceil(z1/self.rise)+1, i1).astype(int)
+    shown = (self.i >= self.i0[:, None]) & (self.i <= self.i1[:, None])
+    self.phase = np.where(shown[:, None, :], self.twist[:, None, None]*self.i + (np.arange(csym)/csym*360)[None, :, None], np.nan)
+    self.z = np.where(shown, self.rise[:, None]*self.i, np.nan)[:, None, :].repeat(csym, axis=1)
+
+  def __len__(self):
+    return len(self.twist)
+
+  def unrolled(self):
+    return np.mod(self.phase, 360), self.z
+
+  def planar(self, r):
+    angle, z = self.unrolled()
+    return np.deg2rad(angle)*r, z
+
+  def cylinder(self, r):
+    phase = np.deg2rad(self.phase)
+    return r*np.cos(phase), r*np.sin(phase), self.z
+
+@lru_cache(maxsize=64)
+def helical_subunits(twist, rise, csym, z0, z1, max_subunits):
+  # the 3D and unrolled views of one parameter set are built in separate tasks: both get the same instance
+  return HelicalSubunits(twist, rise, csym, z0, z1, max_subunits)
+
+def pixel_size(extent, figure_height):
+  # Å per screen pixel when a scene spanning extent Å is drawn into figure_height pixels
+  return extent/max(figure_height, 1)
+
+def chord_angle(r, tolerance):
+  # largest angular step (radians) whose chord deviates at most tolerance from an arc of radius r
+  if r <= tolerance/2: return np.pi
+  return 2*np.arccos(1-tolerance/r)
+
+def circle_points(r, tolerance):
+  n = int(np.ceil(2*np.pi/chord_angle(r, tolerance)))+1
+  return int(np.clip(n, MIN_CIRCLE_POINTS, MAX_CIRCLE_POINTS))
+
+@lru_cache(maxsize=None)
+def unit_circle(n_points):
+  theta = np.linspace(0, 2*np.pi, n_points)
+  cos, sin = np.cos(theta), np.sin(theta)
+  cos.flags.writeable = False
+  sin.flags.writeable = False
+  return cos, sin
+
+@lru_cache(maxsize=None)
+def unit_cylinder(n_points):
+  # a cylinder is straight along its axis, so two rings (v=0 and v=1) describe the surface exactly
+  cos, sin = unit_circle(n_points)
+  x, y, v = np.tile(cos, (2, 1)), np.tile(sin, (2, 1)), np.repeat([[0.0], [1.0]], n_points, axis=1)
+  for a in (x, y, v):
+    a.flags.writeable = False
+  return x, y, v
+
+def view_window(length, view=None):
+  # z window [z0, z1] of a helix of this length that is shown in the view {"x": [x0, x1], "z": [z0, z1]} (None: all of it)
+  z0, z1 = -length/2, length/2
+  if view:
+    z0, z1 = max(z0, min(view["z"])), min(z1, max(view["z"]))
+    if z0 >= z1:
+      z0, z1 = -length/2, length/2
+  return z0, z1
+
+def circle(r, z, n_points):
+  cos, sin = unit_circle(n_points)
+  return r*cos, r*sin, np.full(n_points, float(z))
+
+def cylinder_surface(r, h, z0, n_points):
+  x, y, v = unit_cylinder(n_points)
+  return r*x, r*y, z0+h*v
+
+def helix_spirals(r, twist, rise, csym, i0, i1, tolerance, max_points=MAX_SPIRAL_POINTS):
+  # the csym helices through subunits i0..i1, sampled uniformly in angle to the chord tolerance, within max_points
+  # in total. Copies are separated by a NaN point so that they can share one trace; copy holds each point's copy index.
+  twist_rad = np.deg2rad(twist)
+  angle = abs(twist_rad*(i1-i0))
+  steps = int(np.ceil(angle/chord_angle(r, tolerance)))
+  steps = int(np.clip(steps, 1, max(1, max_points//csym-2)))
+  i = np.linspace(i0, i1, steps+1)
+  phase = (twist_rad*i)[None, :] + (np.arange(csym)*2*np.pi/csym)[:, None]
+  gap = np.full((csym, 1), np.nan)
+  x = np.hstack((r*np.cos(phase), gap)).ravel()[:-1]
+  y = np.hstack((r*np.sin(phase), gap)).ravel()[:-1]
+  z = np.hstack((np.tile(rise*i, (csym, 1)), gap)).ravel()[:-1]
+  copy = np.repeat(np.arange(csym), steps+2)[:-1]
+  return x, y, z, copy
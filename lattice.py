@@ -0,0 +1,584 @@
+"""
+Helical lattice <-> 2D lattice conversions, free of any UI dependency.
+
+The scalar functions are used by the Shiny app (app.py). The batch_* functions take arrays of
+parameter sets and return NumPy structured arrays, and the command line entry point streams
+CSV/Parquet tables through them in chunks:
+
+  python lattice.py helical2d candidates.csv results.csv
+  python lattice.py 2dhelical lattices.parquet results.parquet --chunksize 50000
+"""
+
+import numpy as np
+
+def convert_2d_lattice_to_helical_lattice(a=(1, 0), b=(0, 1), endpoint=(10, 0), method="exact"):
+  # method="exact": vectorized search over candidate vectors derived from the lattice geometry, valid for any na, nb
+  # method="reference": original double loop over the fixed window -10 <= i, j <= 10, kept for comparison
+  if method == "reference":
+    return convert_2d_lattice_to_helical_lattice_reference(a=a, b=b, endpoint=endpoint)
+  if method != "exact":
+    raise ValueError(f"unknown method {method!r}, must be 'exact' or 'reference'")
+  ret = batch_convert_2d_lattice_to_helical_lattice([a], [b], [endpoint])[0]
+  return float(ret["twist"]), float(ret["rise"]), int(ret["csym"]), float(ret["diameter"])
+
+def convert_2d_lattice_to_helical_lattice_reference(a=(1, 0), b=(0, 1), endpoint=(10, 0)):
+  def set_to_periodic_range(v, min=-180, max=180):
+    from math import fmod
+    tmp = fmod(v-min, max-min)
+    if tmp>=0: tmp+=min
+    else: tmp+=max
+    return tmp
+  def length(v):
+    return np.linalg.norm(v)
+  def transform_vector(v, vref=(1, 0)):
+    ang = np.arctan2(vref[1], vref[0])
+    cos = np.cos(ang)
+    sin = np.sin(ang)
+    m = [[cos, sin], [-sin, cos]]
+    v2 = np.dot(m, v.T)
+    return v2
+  def on_equator(v, epsilon=0.5):
+      # test if b vector is on the equator
+      if abs(v[1]) > epsilon: return 0
+      return 1
+  
+  a, b, endpoint = map(np.array, (a, b, endpoint))
+  na, nb = endpoint
+  v_equator = na*a + nb*b
+  circumference = length(v_equator)
+  va = transform_vector(a, v_equator)
+  vb = transform_vector(b, v_equator)
+  minLength = max(1.0, min(np.linalg.norm(va), np.linalg.norm(vb)) * 0.9)
+  vs_on_equator = []
+  vs_off_equator = []
+  epsilon = 0.5
+  maxI = 10
+  for i in range(-maxI, maxI + 1):
+      for j in range(-maxI, maxI + 1):
+          if i or j:
+              v = i * va + j * vb
+              v[0] = set_to_periodic_range(v[0], min=0, max=circumference)
+              if np.linalg.norm(v) > minLength:
+                  if v[1]<0: v *= -1
+                  if on_equator(v, epsilon=epsilon):
+                      vs_on_equator.append(v)
+                  else:
+                      vs_off_equator.append(v)
+  twist, rise, csym = 0, 0, 1
+  if vs_on_equator:
+      vs_on_equator.sort(key=lambda v: abs(v[0]))
+      best_spacing = abs(vs_on_equator[0][0])
+      csym_f = circumference / best_spacing
+      expected_spacing = circumference/round(csym_f)
+      if abs(best_spacing - expected_spacing)/expected_spacing < 0.05:
+          csym = int(round(csym_f))
+  if vs_off_equator:
+      vs_off_equator.sort(key=lambda v: (abs(round(v[1]/epsilon)), abs(v[0])))
+      twist, rise = vs_off_equator[0]
+      twist *= 360/circumference
+      twist = set_to_periodic_range(twist, min=-360/(2*csym), max=360/(2*csym))
+  diameter = circumference/np.pi
+  return twist, rise, csym, diameter
+
+def convert_helical_lattice_to_2d_lattice(twist=30, rise=20, csym=1, diameter=100, primitive_unitcell=False, horizontal=True, method="reduction"):
+  # method="reduction": Lagrange reduction of the unrolled lattice basis, cost independent of twist and csym
+  # method="reference": original search over ~10*360/|twist|*csym candidate vectors, kept for comparison
+  if method == "reference":
+    return convert_helical_lattice_to_2d_lattice_reference(twist=twist, rise=rise, csym=csym, diameter=diameter, primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+  if method != "reduction":
+    raise ValueError(f"unknown method {method!r}, must be 'reduction' or 'reference'")
+  ret = batch_convert_helical_lattice_to_2d_lattice(twist, rise, csym, diameter, primitive_unitcell=primitive_unitcell, horizontal=horizontal)[0]
+  va = np.array([ret["ax"], ret["ay"]])
+  vb = np.array([ret["bx"], ret["by"]])
+  return va, vb, (int(ret["na"]), int(ret["nb"]))
+
+def convert_helical_lattice_to_2d_lattice_reference(twist=30, rise=20, csym=1, diameter=100, primitive_unitcell=False, horizontal=True):
+  def angle90(v1, v2):  # angle between two vectors, ignoring vector polarity [0, 90]
+      p = np.dot(v1, v2)/(np.linalg.norm(v1)*np.linalg.norm(v2))
+      p = np.clip(abs(p), 0, 1)
+      ret = np.rad2deg(np.arccos(p))  # 0<=angle<90
+      return ret
+  def transform_vector(v, vref=(1, 0)):
+    ang = np.arctan2(vref[1], vref[0])
+    cos = np.cos(ang)
+    sin = np.sin(ang)
+    m = [[cos, sin], [-sin, cos]]
+    v2 = np.dot(m, v.T)
+    return v2
+  
+  imax = int(5*360/abs(twist))
+  n = np.tile(np.arange(-imax, imax), reps=(2,1)).T
+  v = np.array([twist, rise], dtype=float) * n
+  if csym>1:
+    vs = []
+    for ci in range(csym):
+      tmp = v * 1.0
+      tmp[:, 0] += ci/csym * 360
+      vs.append(tmp)
+    v = np.vstack(vs)
+  v[:, 0] = np.fmod(v[:, 0], 360)
+  v[v[:, 0]<0, 0] += 360
+  v[:, 0] *= np.pi*diameter/360 # convert x-axis values from angles to distances
+  dist = np.linalg.norm(v, axis=1)
+  dist_indices = np.argsort(dist)
+
+  v = v[dist_indices] # now sorted from short to long distance
+  err = 1.0 # max angle between 2 vectors to consider non-parallel
+  vb = v[1]
+  for i in range(1, len(v)):
+    if angle90(vb, v[i])> err:
+      va = v[i]
+      break
+
+  ve = np.array([np.pi*diameter, 0])
+  m = np.vstack((va, vb)).T
+  na, nb = np.linalg.solve(m, ve)
+  endpoint = (round(na), round(nb))
+  
+  if not primitive_unitcell:
+    # find alternative unit cell vector pairs that has smallest angular difference to the helical equator
+    vabs = []
+    for ia in range(-1, 2):
+      for ib in range(-1, 2):
+        vabs.append(ia*va+ib*vb)
+    vabs_good = []
+    area = np.linalg.norm( np.cross(va, vb) )
+    for vai, vatmp in enumerate(vabs):
+      for vbi in range(vai+1, len(vabs)):
+        vbtmp = vabs[vbi]
+        areatmp = np.linalg.norm( np.cross(vatmp, vbtmp) )
+        if abs(areatmp-area)>err: continue
+        vabs_good.append( (vatmp, vbtmp) )
+    dist = []
+    for vi, (vatmp, vbtmp) in enumerate(vabs_good):
+        m = np.vstack((vatmp, vbtmp)).T
+        na, nb = np.linalg.solve(m, ve)
+        if abs(na-round(na))>1e-3: continue
+        if abs(nb-round(nb))>1e-3: continue
+        dist.append((abs(na)+abs(nb), -round(na), -round(nb), round(na), round(nb), vatmp, vbtmp))
+    if len(dist):
+      dist.sort(key=lambda x: x[:3])
+      na, nb, va, vb = dist[0][3:]
+      if np.linalg.norm(vb)>np.linalg.norm(va):
+        va, vb = vb, va
+        na, nb = nb, na
+      endpoint = (na, nb)
+
+  if va[0]<0:
+    va *= -1
+    vb *= -1
+    na *= -1
+    nb *= -1
+
+  if horizontal:
+    vb = transform_vector(vb, vref=va)
+    va = np.array([np.linalg.norm(va), 0.0])
+
+  return va, vb, endpoint
+
+HELICAL_DTYPE = np.dtype([("twist", "f8"), ("rise", "f8"), ("csym", "i8"), ("diameter", "f8")])
+LATTICE_2D_DTYPE = np.dtype([("ax", "f8"), ("ay", "f8"), ("bx", "f8"), ("by", "f8"), ("na", "i8"), ("nb", "i8")])
+
+def set_to_periodic_range(v, min=-180, max=180):
+  # array version of the scalar helper in convert_2d_lattice_to_helical_lattice: fmod keeps the sign of v-min
+  tmp = np.fmod(v-min, max-min)
+  return np.where(tmp>=0, tmp+min, tmp+max)
+
+def extended_gcd(p, q):
+  # vectorized extended Euclid for integer arrays: g, x, y with p*x + q*y = g = gcd(p, q) >= 0
+  old_r, r = np.array(p, dtype=np.int64), np.array(q, dtype=np.int64)
+  old_x, x = np.ones_like(old_r), np.zeros_like(old_r)
+  old_y, y = np.zeros_like(old_r), np.ones_like(old_r)
+  while np.any(r != 0):
+    nz = r != 0
+    quotient = np.where(nz, old_r // np.where(nz, r, 1), 0)
+    old_r, r = np.where(nz, r, old_r), np.where(nz, old_r - quotient*r, r)
+    old_x, x = np.where(nz, x, old_x), np.where(nz, old_x - quotient*x, x)
+    old_y, y = np.where(nz, y, old_y), np.where(nz, old_y - quotient*y, y)
+  sign = np.where(old_r < 0, -1, 1)
+  return old_r*sign, old_x*sign, old_y*sign
+
+MAX_RISE_LEVELS = 100000  # guards nearly degenerate lattices whose smallest rise is vanishingly small
+
+def rise_levels(va, vb, na, nb, circumference, minLength, epsilon):
+  # The lattice points lie on lines parallel to the equator at rises k*dy, dy = |a x b|*g/circumference, g = gcd(na, nb).
+  # The search result lies on the lowest line that is off the equator (rise > epsilon) with a vector longer than
+  # minLength, or on a line rounding to the same multiple of epsilon; k_max bounds all of them.
+  g = np.maximum(np.gcd(na, nb), 1)
+  area = np.abs(va[:, 0]*vb[:, 1] - va[:, 1]*vb[:, 0])
+  with np.errstate(divide="ignore", invalid="ignore"):
+    dy = area*g/circumference
+    k_max = np.floor(np.maximum(minLength, epsilon)/dy) + np.ceil(epsilon/dy) + 2
+  k_max = np.where(np.isfinite(k_max), np.minimum(k_max, MAX_RISE_LEVELS), 0).astype(np.int64)
+  return g, k_max
+
+def geometric_candidates(na, nb, g, k_max):
+  # (i, j) of the candidate vectors on rise lines -k_max..k_max, with a validity mask; shape (N, M).
+  # Line k is the family (i, j) = k*(i0, j0) + t*(na, nb)/g with na*j0 - nb*i0 = g. Its members t = 0..g-1
+  # cover every distinct position along the circumference; further members only repeat them one turn later.
+  _, j0, i0 = extended_gcd(na, -nb)
+  counts = (2*k_max + 1)*g
+  n = np.arange(counts.max())[None, :]
+  k = n // g[:, None] - k_max[:, None]
+  t = n % g[:, None]
+  t = np.where(k == 0, t+1, t)  # on the equator line t=0 is the zero vector, use t=g instead
+  i = k*i0[:, None] + t*(na//g)[:, None]
+  j = k*j0[:, None] + t*(nb//g)[:, None]
+  return i, j, n < counts[:, None]
+
+def batch_convert_2d_lattice_to_helical_lattice(a, b, endpoint, maxI=None, max_candidates=250000):
+  # vectorized convert_2d_lattice_to_helical_lattice over N parameter sets
+  # a, b: (N, 2) unit cell vectors; endpoint: (N, 2) integers (na, nb)
+  # maxI=None derives the candidate vectors from the lattice geometry (exact for any na, nb);
+  # maxI=10 reproduces the fixed -maxI <= i, j <= maxI window of the reference implementation
+  a = np.atleast_2d(np.asarray(a, dtype=float))
+  b = np.atleast_2d(np.asarray(b, dtype=float))
+  endpoint = np.atleast_2d(np.asarray(endpoint)).astype(np.int64)
+  a, b, endpoint = np.broadcast_arrays(a, b, endpoint)
+  na = endpoint[:, 0]
+  nb = endpoint[:, 1]
+  v_equator = na[:, None]*a + nb[:, None]*b
+  circumference = np.linalg.norm(v_equator, axis=1)
+  ang = np.arctan2(v_equator[:, 1], v_equator[:, 0])
+  cos = np.cos(ang)[:, None]
+  sin = np.sin(ang)[:, None]
+  va = np.hstack((cos*a[:, 0:1]+sin*a[:, 1:2], -sin*a[:, 0:1]+cos*a[:, 1:2]))
+  vb = np.hstack((cos*b[:, 0:1]+sin*b[:, 1:2], -sin*b[:, 0:1]+cos*b[:, 1:2]))
+  minLength = np.maximum(1.0, np.minimum(np.linalg.norm(va, axis=1), np.linalg.norm(vb, axis=1)) * 0.9)
+  epsilon = 0.5
+
+  ret = np.empty(len(a), dtype=HELICAL_DTYPE)
+  if maxI is not None:
+    # all (i, j) in the same order as the reference double loop, so that ties resolve identically
+    i, j = np.meshgrid(np.arange(-maxI, maxI+1), np.arange(-maxI, maxI+1), indexing="ij")
+    keep = (i != 0) | (j != 0)
+    i = np.broadcast_to(i[keep], (len(a), keep.sum()))
+    j = np.broadcast_to(j[keep], (len(a), keep.sum()))
+    select_helical_parameters(ret, np.arange(len(a)), i, j, np.ones(i.shape, dtype=bool), va, vb, circumference, minLength, epsilon)
+    return ret
+
+  # rows are processed in blocks of similar candidate counts to bound the memory of the padded (rows, M) arrays;
+  # blocks small enough to stay in the CPU cache are several times faster than a few large ones
+  g, k_max = rise_levels(va, vb, na, nb, circumference, minLength, epsilon)
+  sizes = (2*k_max + 1)*g
+  order = np.argsort(sizes, kind="stable")
+  start = 0
+  while start < len(order):
+    stop = start + 1
+    while stop < len(order) and (stop-start+1)*sizes[order[stop]] <= max_candidates:
+      stop += 1
+    rows = order[start:stop]
+    i, j, mask = geometric_candidates(na[rows], nb[rows], g[rows], k_max[rows])
+    select_helical_parameters(ret, rows, i, j, mask, va[rows], vb[rows], circumference[rows], minLength[rows], epsilon)
+    start = stop
+  return ret
+
+def select_helical_parameters(ret, rows, i, j, mask, va, vb, circumference, minLength, epsilon):
+  # the selection rules of the reference implementation applied to candidate vectors i*va+j*vb, (n, M) each
+  C = circumference[:, None]
+  x = set_to_periodic_range(i*va[:, 0:1] + j*vb[:, 0:1], min=0, max=C)
+  y = i*va[:, 1:2] + j*vb[:, 1:2]
+  valid = mask & (np.hypot(x, y) > minLength[:, None])
+  flip = y < 0
+  x = np.where(flip, -x, x)
+  y = np.where(flip, -y, y)
+  on = valid & (np.abs(y) <= epsilon)
+  off = valid & ~on
+
+  n = len(rows)
+  csym = np.ones(n, dtype=np.int64)
+  has_on = on.any(axis=1)
+  best_spacing = np.where(on, np.abs(x), np.inf).min(axis=1)
+  with np.errstate(divide="ignore", invalid="ignore"):
+    csym_f = circumference / best_spacing
+    expected_spacing = circumference / np.round(csym_f)
+    good = has_on & (np.abs(best_spacing - expected_spacing)/expected_spacing < 0.05)
+  csym[good] = np.round(csym_f[good]).astype(np.int64)
+
+  twist = np.zeros(n)
+  rise = np.zeros(n)
+  has_off = off.any(axis=1)
+  level = np.where(off, np.abs(np.round(y/epsilon)), np.inf)
+  lowest = off & (level == level.min(axis=1, keepdims=True))
+  best = np.argmin(np.where(lowest, np.abs(x), np.inf), axis=1)
+  idx = np.arange(n)
+  twist[has_off] = x[idx, best][has_off] * 360/circumference[has_off]
+  rise[has_off] = y[idx, best][has_off]
+  twist[has_off] = set_to_periodic_range(twist[has_off], min=-360/(2*csym[has_off]), max=360/(2*csym[has_off]))
+
+  ret["twist"][rows] = twist
+  ret["rise"][rows] = rise
+  ret["csym"][rows] = csym
+  ret["diameter"][rows] = circumference/np.pi
+
+def reduce_lattice_basis(b1, b2, max_iterations=100):
+  # Lagrange (Gauss) reduction of N 2D bases (N, 2): returns b1, b2 with |b1| <= |b2| and |b1.b2| <= |b1|^2/2,
+  # i.e. b1 is a shortest lattice vector and b2 a shortest vector not parallel to b1
+  b1 = np.array(b1, dtype=float)
+  b2 = np.array(b2, dtype=float)
+  swap = (b2*b2).sum(axis=1) < (b1*b1).sum(axis=1)
+  b1[swap], b2[swap] = b2[swap], b1[swap].copy()
+  active = np.ones(len(b1), dtype=bool)
+  for _ in range(max_iterations):
+    if not active.any(): break
+    p1 = b1[active]
+    p2 = b2[active]
+    mu = np.round((p1*p2).sum(axis=1)/(p1*p1).sum(axis=1))
+    p2 = p2 - mu[:, None]*p1
+    shorter = (p2*p2).sum(axis=1) < (p1*p1).sum(axis=1)
+    b1[active] = np.where(shorter[:, None], p2, p1)
+    b2[active] = np.where(shorter[:, None], p1, p2)
+    active[active] = shorter
+  return b1, b2
+
+def batch_convert_helical_lattice_to_2d_lattice(twist, rise, csym, diameter, primitive_unitcell=False, horizontal=True, method="reduction"):
+  # vectorized convert_helical_lattice_to_2d_lattice over N parameter sets
+  twist, rise, csym, diameter = np.broadcast_arrays(*(np.atleast_1d(np.asarray(v, dtype=float)) for v in (twist, rise, csym, diameter)))
+  ret = np.empty(len(twist), dtype=LATTICE_2D_DTYPE)
+  if method == "reference":
+    # the size of the candidate set of the reference algorithm depends on each row's twist, so rows are solved one at a time
+    for k in range(len(twist)):
+      va, vb, (na, nb) = convert_helical_lattice_to_2d_lattice_reference(twist=twist[k], rise=rise[k], csym=int(csym[k]), diameter=diameter[k], primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+      ret[k] = (va[0], va[1], vb[0], vb[1], na, nb)
+    return ret
+  if method != "reduction":
+    raise ValueError(f"unknown method {method!r}, must be 'reduction' or 'reference'")
+
+  # the unrolled helical lattice is generated by the csym-fold equatorial vector and the (twist, rise) vector
+  circumference = np.pi*diameter
+  u1 = np.column_stack((circumference/csym, np.zeros(len(twist))))
+  u2 = np.column_stack((np.fmod(twist/360, 1/csym)*circumference, rise))
+  vb, va = reduce_lattice_basis(u1, u2)
+  # same polarity as the reference search, which only considers vectors with x in [0, circumference)
+  for v in (va, vb):
+    v[(v[:, 0] < 0) | ((v[:, 0] == 0) & (v[:, 1] < 0))] *= -1
+
+  def solve_endpoint(va, vb):
+    # (na, nb) such that na*va + nb*vb = (circumference, 0), Cramer's rule over any leading dimensions
+    det = va[..., 0]*vb[..., 1] - va[..., 1]*vb[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+      na = circumference.reshape(circumference.shape + (1,)*(det.ndim-1)) * vb[..., 1]/det
+      nb = -circumference.reshape(circumference.shape + (1,)*(det.ndim-1)) * va[..., 1]/det
+    return na, nb
+
+  na, nb = solve_endpoint(va, vb)
+  na = np.round(na)
+  nb = np.round(nb)
+
+  if not primitive_unitcell:
+    # alternative unit cells from pairs of the 9 vectors ia*va+ib*vb (ia, ib in -1..1) with the same area,
+    # choosing the one whose endpoint has the smallest |na|+|nb|, as the reference does, for all rows at once
+    err = 1.0
+    ia, ib = np.meshgrid([-1, 0, 1], [-1, 0, 1], indexing="ij")
+    vabs = ia.reshape(1, -1, 1)*va[:, None, :] + ib.reshape(1, -1, 1)*vb[:, None, :]  # (N, 9, 2)
+    pa, pb = np.triu_indices(9, k=1)
+    vatmp = vabs[:, pa]  # (N, 36, 2)
+    vbtmp = vabs[:, pb]
+    area = np.abs(va[:, 0]*vb[:, 1] - va[:, 1]*vb[:, 0])[:, None]
+    areatmp = np.abs(vatmp[..., 0]*vbtmp[..., 1] - vatmp[..., 1]*vbtmp[..., 0])
+    natmp, nbtmp = solve_endpoint(vatmp, vbtmp)
+    # parallel pairs have no endpoint solution (inf/nan), they are excluded by their zero area
+    good = np.abs(areatmp-area) <= err
+    with np.errstate(invalid="ignore"):
+      good &= np.abs(natmp-np.round(natmp)) <= 1e-3
+      good &= np.abs(nbtmp-np.round(nbtmp)) <= 1e-3
+    natmp = np.where(good, np.round(natmp), 0)
+    nbtmp = np.where(good, np.round(nbtmp), 0)
+    # lexicographic minimum of (|na|+|nb|, -na, -nb) as in the reference. Remaining exact ties, which the reference
+    # resolves by floating point noise in its unrounded |na|+|nb|, go to the most compact cell, then to the first pair
+    best = good
+    compactness = (vatmp*vatmp).sum(axis=-1) + (vbtmp*vbtmp).sum(axis=-1)
+    for key in (np.abs(natmp)+np.abs(nbtmp), -natmp, -nbtmp, np.round(compactness, 6)):
+      key = np.where(best, key, np.inf)
+      best = best & (key == key.min(axis=1, keepdims=True))
+    found = best.any(axis=1)
+    pick = np.argmax(best, axis=1)
+    rows = np.arange(len(twist))
+    va = np.where(found[:, None], vatmp[rows, pick], va)
+    vb = np.where(found[:, None], vbtmp[rows, pick], vb)
+    na = np.where(found, natmp[rows, pick], na)
+    nb = np.where(found, nbtmp[rows, pick], nb)
+    swap = found & ((vb*vb).sum(axis=1) > (va*va).sum(axis=1))
+    va[swap], vb[swap] = vb[swap], va[swap].copy()
+    na[swap], nb[swap] = nb[swap], na[swap].copy()
+  # like the reference, the returned endpoint is taken before the polarity of va, vb is normalized below
+  flip = va[:, 0] < 0
+  va[flip] *= -1
+  vb[flip] *= -1
+
+  if horizontal:
+    ang = np.arctan2(va[:, 1], va[:, 0])
+    cos, sin = np.cos(ang), np.sin(ang)
+    vb = np.column_stack((cos*vb[:, 0]+sin*vb[:, 1], -sin*vb[:, 0]+cos*vb[:, 1]))
+    va = np.column_stack((np.hypot(va[:, 0], va[:, 1]), np.zeros(len(va))))
+
+  ret["ax"], ret["ay"] = va[:, 0], va[:, 1]
+  ret["bx"], ret["by"] = vb[:, 0], vb[:, 1]
+  ret["na"], ret["nb"] = na, nb
+  return ret
+
+CHIRALITY_DTYPE = np.dtype([("na", "i8"), ("nb", "i8"), ("twist", "f8"), ("rise", "f8"), ("csym", "i8"), ("diameter", "f8")])
+MAX_CHIRALITY_ENDPOINTS = 200000
+
+def chirality_endpoints(a, b, min_diameter, max_diameter, max_endpoints=MAX_CHIRALITY_ENDPOINTS):
+  # all endpoints (na, nb) whose equator na*a+nb*b has a circumference in [pi*min_diameter, pi*max_diameter], (n, 2).
+  # (na, nb) and (-na, -nb) roll up the same helix, so only the one with nb > 0 (or nb == 0, na > 0) is kept.
+  # For each nb, the admissible na form an interval: the roots of |na*a+nb*b|^2 = (pi*max_diameter)^2
+  a = np.asarray(a, dtype=float)
+  b = np.asarray(b, dtype=float)
+  area = abs(a[0]*b[1]-a[1]*b[0])
+  if area == 0:
+    raise ValueError("unit cell vectors a and b must not be parallel")
+  c_min, c_max = np.pi*max(min_diameter, 0), np.pi*max_diameter
+  n_estimate = np.pi*(c_max**2-c_min**2)/2/area
+  if n_estimate > max_endpoints:
+    raise ValueError(f"~{int(n_estimate)} endpoints exceed max_endpoints={max_endpoints}, narrow the diameter range")
+  aa, ab, bb = a@a, a@b, b@b
+  nb = np.arange(0, int(np.floor(c_max*np.sqrt(aa/(aa*bb-ab*ab))))+1)
+  disc = np.maximum(ab*ab*nb*nb - aa*(bb*nb*nb-c_max**2), 0)
+  lo = np.ceil((-ab*nb-np.sqrt(disc))/aa)
+  hi = np.floor((-ab*nb+np.sqrt(disc))/aa)
+  lo[0] = max(lo[0], 1)  # nb == 0: na > 0 only
+  counts = np.maximum(hi-lo+1, 0).astype(np.int64)
+  nb = np.repeat(nb, counts)
+  na = (np.repeat(lo, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts)-counts, counts))).astype(np.int64)
+  circumference = np.hypot(na*a[0]+nb*b[0], na*a[1]+nb*b[1])
+  keep = (circumference >= c_min) & (circumference <= c_max)
+  return np.column_stack((na[keep], nb[keep]))
+
+def chirality_map(a, b, min_diameter, max_diameter, max_endpoints=MAX_CHIRALITY_ENDPOINTS):
+  # the helical lattices rolled up from one 2D lattice along every endpoint within the diameter range, in one batch
+  endpoint = chirality_endpoints(a, b, min_diameter, max_diameter, max_endpoints=max_endpoints)
+  ret = np.empty(len(endpoint), dtype=CHIRALITY_DTYPE)
+  ret["na"], ret["nb"] = endpoint[:, 0], endpoint[:, 1]
+  if len(endpoint):
+    helical = batch_convert_2d_lattice_to_helical_lattice(a, b, endpoint)
+    for name in HELICAL_DTYPE.names:
+      ret[name] = helical[name]
+  return ret
+
+CONVERSION_COLUMNS = {
+  "helical2d": ("twist", "rise", "csym", "diameter"),
+  "2dhelical": ("ax", "ay", "bx", "by", "na", "nb"),
+}
+INTEGER_COLUMNS = ("csym", "na", "nb")
+
+def column_dtype(name):
+  return np.int64 if name in INTEGER_COLUMNS else float
+
+def run_batch(conversion, columns, primitive_unitcell=False, horizontal=True):
+  # columns: dict of 1D arrays keyed by the conversion's input column names
+  if conversion == "helical2d":
+    return batch_convert_helical_lattice_to_2d_lattice(columns["twist"], columns["rise"], columns["csym"], columns["diameter"], primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+  a = np.column_stack((columns["ax"], columns["ay"]))
+  b = np.column_stack((columns["bx"], columns["by"]))
+  endpoint = np.column_stack((columns["na"], columns["nb"]))
+  return batch_convert_2d_lattice_to_helical_lattice(a, b, endpoint)
+
+def iter_csv_chunks(path, names, chunksize):
+  import csv
+  import sys
+  f = sys.stdin if path == "-" else open(path, newline="")
+  try:
+    reader = csv.DictReader(f)
+    missing = [n for n in names if n not in (reader.fieldnames or [])]
+    if missing:
+      raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+    first_row = 1
+    while True:
+      rows = [row for _, row in zip(range(chunksize), reader)]
+      if not rows: break
+      yield {n: csv_column(path, rows, n, first_row) for n in names}
+      first_row += len(rows)
+  finally:
+    if f is not sys.stdin: f.close()
+
+def csv_column(path, rows, name, first_row):
+  # rows are numbered from 1, the first row after the header
+  try:
+    return np.array([float(row[name]) for row in rows]).astype(column_dtype(name))
+  except (TypeError, ValueError):
+    for k, row in enumerate(rows):
+      try:
+        float(row[name])
+      except (TypeError, ValueError):
+        raise ValueError(f"{path}: row {first_row+k}, column {name}: {'empty' if not row[name] else repr(row[name])} is not a number") from None
+    raise
+
+def iter_parquet_chunks(path, names, chunksize):
+  import pyarrow.parquet as pq
+  for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=list(names)):
+    yield {n: batch.column(n).to_numpy(zero_copy_only=False).astype(column_dtype(n)) for n in names}
+
+class CsvChunkWriter:
+  def __init__(self, path):
+    import csv
+    import sys
+    self.f = sys.stdout if path == "-" else open(path, "w", newline="")
+    self.writer = csv.writer(self.f)
+    self.header_written = False
+  def write(self, columns):
+    names = list(columns)
+    if not self.header_written:
+      self.writer.writerow(names)
+      self.header_written = True
+    self.writer.writerows(zip(*(columns[n].tolist() for n in names)))
+  def close(self):
+    if self.f.name != "<stdout>": self.f.close()
+
+class ParquetChunkWriter:
+  def __init__(self, path):
+    self.path = path
+    self.writer = None
+  def write(self, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.table(columns)
+    if self.writer is None:
+      self.writer = pq.ParquetWriter(self.path, table.schema)
+    self.writer.write_table(table)
+  def close(self):
+    if self.writer is not None: self.writer.close()
+
+def is_parquet(path):
+  return path.lower().endswith((".parquet", ".pq"))
+
+def convert_table(conversion, input_path, output_path, chunksize=10000, primitive_unitcell=False, horizontal=True):
+  # stream the input table through the batch conversion chunk by chunk; memory use is bounded by chunksize
+  names = CONVERSION_COLUMNS[conversion]
+  chunks = (iter_parquet_chunks if is_parquet(input_path) else iter_csv_chunks)(input_path, names, chunksize)
+  writer = ParquetChunkWriter(output_path) if is_parquet(output_path) else CsvChunkWriter(output_path)
+  n = 0
+  try:
+    for columns in chunks:
+      result = run_batch(conversion, columns, primitive_unitcell=primitive_unitcell, horizontal=horizontal)
+      out = dict(columns)
+      out.update({name: result[name] for name in result.dtype.names})
+      writer.write(out)
+      n += len(result)
+  finally:
+    writer.close()
+  return n
+
+def main(argv=None):
+  import argparse
+  parser = argparse.ArgumentParser(description="Batch helical lattice <-> 2D lattice conversion of CSV/Parquet tables")
+  parser.add_argument("conversion", choices=sorted(CONVERSION_COLUMNS), help="helical2d: columns twist,rise,csym,diameter; 2dhelical: columns ax,ay,bx,by,na,nb")
+  parser.add_argument("input", help="input .csv or .parquet file ('-' for CSV on stdin)")
+  parser.add_argument("output", help="output .csv or .parquet file ('-' for CSV on stdout)")
+  parser.add_argument("--chunksize", type=int, default=10000, help="rows converted per batch (default: %(default)s)")
+  parser.add_argument("--primitive-unitcell", action="store_true", help="helical2d: use the primitive unit cell")
+  parser.add_argument("--no-horizontal", dest="horizontal", action="store_false", help="helical2d: do not rotate unit cell vector a onto the x-axis")
+  args = parser.parse_args(argv)
+  if is_parquet(args.input) or is_parquet(args.output):
+    try:
+      import pyarrow  # noqa: F401
+    except ImportError:
+      parser.error("Parquet input/output requires the pyarrow package")
+  try:
+    convert_table(args.conversion, args.input, args.output, chunksize=args.chunksize, primitive_unitcell=args.primitive_unitcell, horizontal=args.horizontal)
+  except ValueError as e:  # missing columns or cells that are not numbers
+    parser.error(str(e))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,131 @@
+"""
+Reverse lookup from a measured helical symmetry to the 2D lattices and endpoints (na, nb) that roll up into it.
+
+An index is built once from a catalog of known 2D lattices, each with the range of helical diameters to consider,
+by converting every endpoint in that range in one batch per lattice (lattice.chirality_map). It is stored as a
+compressed .npz file with float32 parameters. The entries are sorted by csym and rise, so a query only looks at
+the entries within its rise tolerance and answers in milliseconds even for millions of entries:
+
+  python lattice_index.py build catalog.csv index.npz     # columns: name, ax, ay, bx, by, min_diameter, max_diameter
+  python lattice_index.py query index.npz --twist -81.1 --rise 19.4 --csym 1 --diameter 290
+"""
+
+import numpy as np
+
+import lattice
+
+CATALOG_COLUMNS = ("name", "ax", "ay", "bx", "by", "min_diameter", "max_diameter")
+LATTICE_DTYPE = np.dtype([("ax", "f8"), ("ay", "f8"), ("bx", "f8"), ("by", "f8")])
+ENTRY_DTYPE = np.dtype([("lattice", "i4"), ("na", "i4"), ("nb", "i4"), ("csym", "i4"), ("twist", "f4"), ("rise", "f4"), ("diameter", "f4")])
+MATCH_DTYPE = np.dtype([("name", "O"), ("ax", "f8"), ("ay", "f8"), ("bx", "f8"), ("by", "f8"), ("na", "i8"), ("nb", "i8"), ("twist", "f8"), ("rise", "f8"), ("csym", "i8"), ("diameter", "f8"), ("distance", "f8")])
+
+def read_catalog(path):
+  import csv
+  with open(path, newline="") as f:
+    reader = csv.DictReader(f)
+    missing = [n for n in CATALOG_COLUMNS if n not in (reader.fieldnames or [])]
+    if missing:
+      raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+    return [{n: row[n] if n == "name" else float(row[n]) for n in CATALOG_COLUMNS} for row in reader]
+
+class LatticeIndex:
+  def __init__(self, names, lattices, entries):
+    self.names = np.asarray(names, dtype=str)
+    self.lattices = lattices
+    order = np.lexsort((entries["rise"], entries["csym"]))
+    self.entries = entries[order]
+    self.csym_values, self.csym_start = np.unique(self.entries["csym"], return_index=True)
+
+  @classmethod
+  def build(cls, catalog, max_endpoints=lattice.MAX_CHIRALITY_ENDPOINTS):
+    # catalog: rows with the CATALOG_COLUMNS, e.g. from read_catalog
+    lattices = np.empty(len(catalog), dtype=LATTICE_DTYPE)
+    entries = []
+    for k, row in enumerate(catalog):
+      a, b = (row["ax"], row["ay"]), (row["bx"], row["by"])
+      lattices[k] = (*a, *b)
+      helices = lattice.chirality_map(a, b, row["min_diameter"], row["max_diameter"], max_endpoints=max_endpoints)
+      e = np.empty(len(helices), dtype=ENTRY_DTYPE)
+      e["lattice"] = k
+      for name in ("na", "nb", "csym", "twist", "rise", "diameter"):
+        e[name] = helices[name]
+      entries.append(e)
+    entries = np.concatenate(entries) if entries else np.empty(0, dtype=ENTRY_DTYPE)
+    return cls([row["name"] for row in catalog], lattices, entries)
+
+  def save(self, path):
+    np.savez_compressed(path, names=self.names, lattices=self.lattices, entries=self.entries)
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path, allow_pickle=False) as f:
+      return cls(f["names"], f["lattices"], f["entries"])
+
+  def __len__(self):
+    return len(self.entries)
+
+  def query(self, twist, rise, csym=1, diameter=None, twist_tolerance=1.0, rise_tolerance=0.5, diameter_tolerance=None, limit=20):
+    # entries of this csym within all tolerances, nearest first by the distance in units of the tolerances.
+    # Twist is compared modulo 360/csym; diameter is ignored when it or its tolerance is None
+    k = np.searchsorted(self.csym_values, csym)
+    if k == len(self.csym_values) or self.csym_values[k] != csym:
+      return np.empty(0, dtype=MATCH_DTYPE)
+    start = self.csym_start[k]
+    stop = self.csym_start[k+1] if k+1 < len(self.csym_start) else len(self.entries)
+    rises = self.entries["rise"][start:stop]
+    lo = start + np.searchsorted(rises, rise-rise_tolerance, side="left")
+    hi = start + np.searchsorted(rises, rise+rise_tolerance, side="right")
+    candidates = self.entries[lo:hi]
+
+    period = 360/csym
+    d_twist = lattice.set_to_periodic_range(candidates["twist"]-twist, min=-period/2, max=period/2)/twist_tolerance
+    d_rise = (candidates["rise"]-rise)/rise_tolerance
+    distance = d_twist**2 + d_rise**2
+    keep = (np.abs(d_twist) <= 1) & (np.abs(d_rise) <= 1)
+    if diameter is not None and diameter_tolerance is not None:
+      d_diameter = (candidates["diameter"]-diameter)/diameter_tolerance
+      distance += d_diameter**2
+      keep &= np.abs(d_diameter) <= 1
+    best = np.flatnonzero(keep)
+    best = best[np.argsort(distance[best], kind="stable")[:limit]]
+
+    found = candidates[best]
+    ret = np.empty(len(found), dtype=MATCH_DTYPE)
+    ret["name"] = self.names[found["lattice"]]
+    for name in LATTICE_DTYPE.names:
+      ret[name] = self.lattices[name][found["lattice"]]
+    for name in ("na", "nb", "twist", "rise", "csym", "diameter"):
+      ret[name] = found[name]
+    ret["distance"] = np.sqrt(distance[best])
+    return ret
+
+def main(argv=None):
+  import argparse
+  parser = argparse.ArgumentParser(description="Index of the helical lattices of a catalog of 2D lattices, and nearest-match queries")
+  commands = parser.add_subparsers(dest="command", required=True)
+  build = commands.add_parser("build", help="build an index from a CSV catalog")
+  build.add_argument("catalog", help="CSV file with columns " + ", ".join(CATALOG_COLUMNS))
+  build.add_argument("index", help="output .npz file")
+  query = commands.add_parser("query", help="list the entries of an index that match a helical symmetry")
+  query.add_argument("index", help=".npz file written by build")
+  query.add_argument("--twist", type=float, required=True, help="twist (°)")
+  query.add_argument("--rise", type=float, required=True, help="rise (Å)")
+  query.add_argument("--csym", type=int, default=1, help="axial symmetry (default: %(default)s)")
+  query.add_argument("--diameter", type=float, help="helical diameter (Å)")
+  query.add_argument("--twist-tolerance", type=float, default=1.0, help="(default: %(default)s °)")
+  query.add_argument("--rise-tolerance", type=float, default=0.5, help="(default: %(default)s Å)")
+  query.add_argument("--diameter-tolerance", type=float, default=20.0, help="(default: %(default)s Å)")
+  query.add_argument("--limit", type=int, default=20, help="number of matches listed (default: %(default)s)")
+  args = parser.parse_args(argv)
+  if args.command == "build":
+    index = LatticeIndex.build(read_catalog(args.catalog))
+    index.save(args.index)
+    print(f"{len(index)} helical lattices from {len(index.lattices)} 2D lattices")
+    return
+  matches = LatticeIndex.load(args.index).query(args.twist, args.rise, args.csym, args.diameter, args.twist_tolerance, args.rise_tolerance, args.diameter_tolerance, args.limit)
+  print("name,na,nb,twist,rise,csym,diameter,distance")
+  for m in matches:
+    print(f"{m['name']},{m['na']},{m['nb']},{m['twist']:.3f},{m['rise']:.3f},{m['csym']},{m['diameter']:.2f},{m['distance']:.3f}")
+
+if __name__ == "__main__":
+  main()
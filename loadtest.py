@@ -0,0 +1,265 @@
+"""
+Load test of one app worker with many concurrent sessions, entirely offline.
+
+The app is served in-process by uvicorn on a local port (or --url points at a running worker), and each simulated
+session speaks Shiny's websocket protocol like a browser: it sends the initial input values, marks the plot outputs
+visible, then replays a script of input edits with think time between them: twist and rise edits typed a few
+characters at a time, plot height changes and switches between the Helical⇒2D and 2D⇒Helical modes. Per output,
+the time from an edit to the last message that renders or patches the output is recorded. The report lists its
+p50/p95/p99, the throughput, and the CPU time and memory of the worker process (in-process only; the simulated
+clients run in the same process and are included, they only scan message headers):
+
+  python loadtest.py --sessions 20 --duration 60
+  python loadtest.py --sessions 50 --max-p95 2.0           # exit status 1 if any output's p95 exceeds 2 s
+  python loadtest.py --url ws://127.0.0.1:8000/websocket/ --sessions 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+
+OUTPUTS = {
+  "Helical⇒2D": ("plot_helix", "plot_helix_unrolled", "plot_2d"),
+  "2D⇒Helical": ("plot_2d_2D_to_Helical", "plot_helix_unrolled_2D_to_Helical", "plot_helix_2D_to_Helical"),
+}
+COMM_ID = re.compile(r'comm_id\\?"\s*:\s*\\?"([0-9a-f]+)')
+
+def typed(name, value):
+  # the values an input takes while value is typed into it, one keystroke at a time
+  text = f"{value:g}"
+  return [{name: float(text[:k])} for k in range(1, len(text)+1) if text[:k] not in ("-", "-0", "0", "0.")]
+
+def session_script(rng, steps, values):
+  # a list of (edits sent a keystroke apart, output ids expected to re-render); every edit changes its input
+  script = []
+  values = dict(values)
+  mode = "Helical⇒2D"
+  while len(script) < steps:
+    action = rng.choices(("twist", "rise", "figure_height", "radio", "ax"), weights=(4, 3, 1, 1, 2))[0]
+    if action == "radio":
+      mode = "2D⇒Helical" if mode == "Helical⇒2D" else "Helical⇒2D"
+      script.append(([{"radio": mode}], OUTPUTS[mode]))
+      continue
+    if action == "figure_height":
+      value = rng.choice((600, 700, 800, 900))
+    elif mode == "Helical⇒2D" and action == "twist":
+      value = round(rng.uniform(-179, 179), 1)
+    elif mode == "Helical⇒2D" and action == "rise":
+      value = round(rng.uniform(2, 40), 1)
+    elif mode == "2D⇒Helical" and action == "ax":
+      value = round(rng.uniform(20, 50), 2)
+    else:
+      continue
+    if value == values[action]: continue
+    values[action] = value
+    script.append(([{action: value}] if action == "figure_height" else typed(action, value), OUTPUTS[mode]))
+  return script
+
+class Session:
+  def __init__(self, url, index, stats, rng, think, settle, timeout):
+    self.url, self.index, self.stats, self.rng = url, index, stats, rng
+    self.think, self.settle, self.timeout = think, settle, timeout
+    self.models = {}  # widget model id -> output id
+
+  def outputs_in(self, message):
+    # the output ids a server message renders: values of outputs, or widget messages for their models
+    if message.startswith('{"values"'):
+      values = json.loads(message)["values"]
+      for output_id, value in values.items():
+        if isinstance(value, dict) and "model_id" in value:
+          self.models[value["model_id"]] = output_id
+      return list(values)
+    if message.startswith('{"custom"'):
+      m = COMM_ID.search(message[:1000])
+      if m and m.group(1) in self.models:
+        return [self.models[m.group(1)]]
+    return []
+
+  async def step(self, ws, edits, expected):
+    # send the edits a keystroke apart, then wait until the expected outputs have rendered and the session is quiet
+    t0 = time.perf_counter()
+    for k, edit in enumerate(edits):
+      if k: await asyncio.sleep(0.1)
+      await ws.send(json.dumps({"method": "update", "data": edit}))
+    last = {}
+    deadline = t0 + self.timeout
+    while True:
+      wait = self.settle if set(expected) <= set(last) else deadline - time.perf_counter()
+      try:
+        message = await asyncio.wait_for(ws.recv(), max(wait, 0.001))
+      except asyncio.TimeoutError:
+        break
+      now = time.perf_counter()
+      for output_id in self.outputs_in(message):
+        last[output_id] = now - t0
+      if now > deadline: break
+    for output_id in expected:
+      if output_id in last:
+        self.stats.record(output_id, last[output_id])
+      else:
+        self.stats.record_timeout(output_id)
+
+  async def run(self, script, stop_time):
+    import websockets
+    import app
+    init = {
+      ".clientdata_url_protocol": "http:", ".clientdata_url_hostname": "127.0.0.1", ".clientdata_url_port": "",
+      ".clientdata_url_pathname": "/", ".clientdata_url_search": "", "sidebar_accordion": None,
+      "radio": "Helical⇒2D", "manual_apply": False, "apply": 0,
+      **{name: value for name, value in app.DEFAULT_PARAMETERS.items() if name != "view"},
+    }
+    for output_id in ("conditional_inputs", "dynamic_plot", "compute_status", *OUTPUTS["Helical⇒2D"], *OUTPUTS["2D⇒Helical"]):
+      init[f".clientdata_output_{output_id}_hidden"] = False
+    async with websockets.connect(self.url, max_size=None) as ws:
+      await ws.send(json.dumps({"method": "init", "data": init}))
+      await self.step(ws, [], OUTPUTS["Helical⇒2D"])
+      for edits, expected in script:
+        if time.perf_counter() > stop_time: break
+        await asyncio.sleep(self.rng.expovariate(1/self.think) if self.think > 0 else 0)
+        await self.step(ws, edits, expected)
+        self.stats.steps += 1
+
+class Stats:
+  def __init__(self):
+    self.latencies = {}
+    self.timeouts = {}
+    self.steps = 0
+
+  def record(self, output_id, seconds):
+    self.latencies.setdefault(output_id, []).append(seconds)
+
+  def record_timeout(self, output_id):
+    self.timeouts[output_id] = self.timeouts.get(output_id, 0) + 1
+
+  def summary(self):
+    import numpy as np
+    ret = {}
+    for output_id in sorted(set(self.latencies) | set(self.timeouts)):
+      v = np.array(self.latencies.get(output_id, []))
+      p50, p95, p99 = np.percentile(v, (50, 95, 99)) if len(v) else (np.nan,)*3
+      ret[output_id] = {"renders": len(v), "timeouts": self.timeouts.get(output_id, 0), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+    return ret
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+def start_server(port):
+  # serve app.app from a background thread of this process, so that its CPU time and memory can be measured
+  import uvicorn
+  import app
+  server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning", ws_max_size=2**30))
+  thread = threading.Thread(target=server.run, daemon=True)
+  thread.start()
+  while not server.started:
+    if not thread.is_alive():
+      raise RuntimeError(f"the app server did not start on port {port}")
+    time.sleep(0.05)
+  return server, thread
+
+def wait_for_sessions_to_end(timeout):
+  # the app ends a session once it sees its websocket closed, and the server should only stop after that
+  import session_memory
+  deadline = time.perf_counter() + timeout
+  while session_memory.SESSIONS and time.perf_counter() < deadline:
+    time.sleep(0.05)
+
+def rss_bytes():
+  # resident memory of this process (Linux), or its peak where /proc is not available
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+  except OSError:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*(1 if sys.platform == "darwin" else 1024)
+
+async def run_sessions(url, args):
+  import app
+  stats = Stats()
+  rng = random.Random(args.seed)
+  stop_time = time.perf_counter() + args.duration
+  sessions = []
+  for k in range(args.sessions):
+    session_rng = random.Random(rng.random())
+    script = session_script(session_rng, args.steps, app.DEFAULT_PARAMETERS)
+    sessions.append(Session(url, k, stats, session_rng, args.think, args.settle, args.timeout).run(script, stop_time))
+    await asyncio.sleep(args.ramp/max(args.sessions, 1))
+  results = await asyncio.gather(*sessions, return_exceptions=True)
+  errors = [r for r in results if isinstance(r, BaseException)]
+  return stats, errors
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Load test one HelicalLattice worker with concurrent simulated sessions")
+  parser.add_argument("--sessions", type=int, default=10, help="concurrent sessions (default: %(default)s)")
+  parser.add_argument("--duration", type=float, default=30, help="seconds after which sessions stop taking new steps (default: %(default)s)")
+  parser.add_argument("--steps", type=int, default=20, help="input edits per session at most (default: %(default)s)")
+  parser.add_argument("--think", type=float, default=1.0, help="mean pause between edits in seconds (default: %(default)s)")
+  parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which the sessions are started (default: %(default)s)")
+  parser.add_argument("--settle", type=float, default=0.3, help="quiet time after which an edit counts as fully rendered (default: %(default)s)")
+  parser.add_argument("--timeout", type=float, default=60, help="seconds an output may take to render (default: %(default)s)")
+  parser.add_argument("--debounce", type=float, help="in-process only: HELICALLATTICE_DEBOUNCE_SECONDS of the app (default: the app's)")
+  parser.add_argument("--seed", type=int, default=0, help="random seed of the session scripts (default: %(default)s)")
+  parser.add_argument("--url", help="websocket URL of a running worker instead of serving the app in-process")
+  parser.add_argument("--max-p95", type=float, help="exit with status 1 if any output's p95 time to render exceeds this many seconds")
+  parser.add_argument("--json", help="also write the results to this JSON file")
+  args = parser.parse_args(argv)
+
+  import warnings
+  warnings.simplefilter("ignore")  # e.g. plot_2d_lattice's point budget warning
+
+  server = None
+  url = args.url
+  if url is None:
+    if args.debounce is not None:
+      os.environ["HELICALLATTICE_DEBOUNCE_SECONDS"] = str(args.debounce)
+    port = free_port()
+    server, thread = start_server(port)
+    url = f"ws://127.0.0.1:{port}/websocket/"
+
+  rss0 = rss_bytes()
+  cpu0, t0 = time.process_time(), time.perf_counter()
+  stats, errors = asyncio.run(run_sessions(url, args))
+  wall, cpu = time.perf_counter()-t0, time.process_time()-cpu0
+  rss1 = rss_bytes()
+  if server is not None:
+    wait_for_sessions_to_end(10)
+    server.should_exit = True
+    thread.join(10)
+
+  results = {"outputs": stats.summary(), "sessions": args.sessions, "steps": stats.steps, "seconds": wall, "errors": [repr(e) for e in errors]}
+  results["steps_per_second"] = stats.steps/wall
+  results["renders_per_second"] = sum(r["renders"] for r in results["outputs"].values())/wall
+  if server is not None:
+    results.update(cpu_seconds=cpu, cpu_utilization=cpu/wall, rss_bytes=rss1, rss_growth_bytes=rss1-rss0)
+
+  print(f"{'output':40s} {'renders':>8s} {'timeouts':>8s} {'p50':>9s} {'p95':>9s} {'p99':>9s}")
+  for output_id, r in results["outputs"].items():
+    print(f"{output_id:40s} {r['renders']:8d} {r['timeouts']:8d} {r['p50']*1e3:7.0f}ms {r['p95']*1e3:7.0f}ms {r['p99']*1e3:7.0f}ms")
+  print(f"{args.sessions} sessions, {stats.steps} edits in {wall:.1f} s: {results['steps_per_second']:.2f} edits/s, {results['renders_per_second']:.2f} renders/s")
+  if server is not None:
+    print(f"worker CPU {cpu:.1f} s ({results['cpu_utilization']:.2f} cores), RSS {rss1/2**20:.0f} MiB ({(rss1-rss0)/2**20:+.0f} MiB)")
+  for e in errors:
+    print(f"session error: {e!r}")
+
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=1)
+
+  failed = bool(errors) or any(r["timeouts"] for r in results["outputs"].values())
+  if args.max_p95 is not None:
+    slow = {output_id: r["p95"] for output_id, r in results["outputs"].items() if r["p95"] > args.max_p95}
+    for output_id, p95 in slow.items():
+      print(f"CAPACITY {output_id}: p95 {p95:.2f} s > {args.max_p95:g} s")
+    failed = failed or bool(slow)
+  return 1 if failed else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
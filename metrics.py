@@ -0,0 +1,160 @@
+"""
+Minimal in-process metrics for the Shiny app, exposed in the Prometheus text exposition format.
+
+Each worker process keeps its own registry; app.py mounts metrics_endpoint at /metrics on the app's
+Starlette router, so every worker can be scraped (or simply curl'ed) without any external service.
+Setting HELICALLATTICE_SLOW_RENDER_SECONDS logs renders slower than that many seconds, with their
+parameters, to the "helicallattice.slow_render" logger.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POINTS_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+BYTES_BUCKETS = (1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+REGISTRY = []
+
+def format_labels(labels):
+  if not labels: return ""
+  return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def format_value(v):
+  if v == float("inf"): return "+Inf"
+  return repr(float(v)) if isinstance(v, float) else str(v)
+
+class Histogram:
+  def __init__(self, name, documentation, buckets, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.buckets = tuple(buckets) + (float("inf"),)
+    self.labelnames = tuple(labelnames)
+    self.series = {}  # label values -> [bucket counts..., sum, count]
+    self.lock = threading.Lock()
+    REGISTRY.append(self)
+
+  def observe(self, value, **labels):
+    key = tuple(str(labels[n]) for n in self.labelnames)
+    with self.lock:
+      series = self.series.setdefault(key, [0]*len(self.buckets) + [0.0, 0])
+      for i, upper in enumerate(self.buckets):
+        if value <= upper: series[i] += 1
+      series[-2] += value
+      series[-1] += 1
+
+  def collect(self):
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+    with self.lock:
+      items = sorted(self.series.items())
+    for key, series in items:
+      labels = list(zip(self.labelnames, key))
+      for upper, count in zip(self.buckets, series):
+        lines.append(f"{self.name}_bucket{format_labels(labels + [('le', format_value(upper))])} {count}")
+      lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(series[-2])}")
+      lines.append(f"{self.name}_count{format_labels(labels)} {series[-1]}")
+    return lines
+
+class Counter:
+  def __init__(self, name, documentation, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.series = {}
+    self.lock = threading.Lock()
+    REGISTRY.append(self)
+
+  def inc(self, amount=1, **labels):
+    key = tuple(str(labels[n]) for n in self.labelnames)
+    with self.lock:
+      self.series[key] = self.series.get(key, 0) + amount
+
+  def collect(self):
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+    with self.lock:
+      items = sorted(self.series.items())
+    for key, value in items:
+      lines.append(f"{self.name}{format_labels(list(zip(self.labelnames, key)))} {format_value(value)}")
+    return lines
+
+class CallbackMetric:
+  # values computed at scrape time: callback() returns {tuple of label values: value}
+  def __init__(self, name, documentation, metric_type, callback, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.metric_type = metric_type
+    self.callback = callback
+    self.labelnames = tuple(labelnames)
+    REGISTRY.append(self)
+
+  def collect(self):
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+    for key, value in sorted(self.callback().items()):
+      lines.append(f"{self.name}{format_labels(list(zip(self.labelnames, key)))} {format_value(value)}")
+    return lines
+
+def exposition():
+  lines = []
+  for metric in REGISTRY:
+    lines.extend(metric.collect())
+  return "\n".join(lines) + "\n"
+
+async def metrics_endpoint(request):
+  from starlette.responses import PlainTextResponse
+  return PlainTextResponse(exposition(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+RENDER_SECONDS = Histogram("helicallattice_render_seconds", "Time to build the figure of an output, or to load it from the figure cache (source)", SECONDS_BUCKETS, ("output", "source"))
+CONVERSION_SECONDS = Histogram("helicallattice_conversion_seconds", "Time of a lattice conversion, including cache lookup", SECONDS_BUCKETS, ("conversion",))
+FIGURE_POINTS = Histogram("helicallattice_figure_points", "Number of data points in the figure of an output", POINTS_BUCKETS, ("output", "backend", "source"))
+FIGURE_CACHE_LOOKUPS = Counter("helicallattice_figure_cache_lookups_total", "Lookups in the on-disk figure cache", ("result",))
+PAYLOAD_BYTES_SAVED = Counter("helicallattice_payload_bytes_saved_total", "Serialized bytes saved by the compact payload mode in the figures built", ("output",))
+FIGURE_BYTES = Histogram("helicallattice_figure_bytes", "Serialized bytes sent to the browser per render (full figure or in-place patch)", BYTES_BUCKETS, ("output", "kind"))
+
+slow_render_logger = logging.getLogger("helicallattice.slow_render")
+
+def slow_render_seconds():
+  value = os.environ.get("HELICALLATTICE_SLOW_RENDER_SECONDS")
+  return float(value) if value else None
+
+@contextmanager
+def timed(histogram, **labels):
+  t0 = time.perf_counter()
+  try:
+    yield
+  finally:
+    histogram.observe(time.perf_counter() - t0, **labels)
+
+def log_if_slow(output_id, seconds, parameters):
+  threshold = slow_render_seconds()
+  if threshold is not None and seconds > threshold:
+    slow_render_logger.warning("slow render of %s: %.3f s > %.3f s, parameters: %s", output_id, seconds, threshold, parameters)
+
+def typed_array_bytes(value):
+  # decoded size of a plotly typed array {"dtype": ..., "bdata": base64}, as in figures read back from JSON
+  bdata = value["bdata"]
+  return len(bdata)*3//4 - (len(bdata) - len(bdata.rstrip("=")))
+
+def array_size(value):
+  if isinstance(value, dict) and "bdata" in value:
+    return typed_array_bytes(value)//np.dtype(value["dtype"]).itemsize
+  return np.size(value)
+
+def figure_point_count(fig):
+  return int(sum(array_size(trace.x) for trace in fig.data if getattr(trace, "x", None) is not None))
+
+def widget_message_bytes(msg):
+  # size of a plotly FigureWidget message as sent over the widget comm: JSON text plus binary array buffers
+  from plotly.serializers import _py_to_js
+  buffers = []
+  def default(o):
+    if isinstance(o, memoryview):
+      buffers.append(o.nbytes)
+      return None
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+  return len(json.dumps(_py_to_js(msg, None), default=default)) + sum(buffers)
@@ -0,0 +1,113 @@
+"""
+Approximate memory retained by the Shiny sessions of a worker process, per session and per output.
+
+Each session registers a SessionMemory and records the bytes its outputs hold: the data arrays of the figure built
+for a widget output plus those of its FigureWidget, or the HTML of an animation. The numbers only count data arrays
+and text, not Python object overhead, so they are a lower bound that tracks how figures grow with the inputs.
+app.py evicts the figures of sessions idle for longer than its threshold and rebuilds them when the session is used
+again. The registry is exposed as gauges on /metrics and per session at /sessions, in JSON:
+
+  curl localhost:8000/sessions
+"""
+
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+ARRAY_PROPERTIES = ("x", "y", "z", "customdata", "text", "hovertext")
+
+def array_bytes(value):
+  if isinstance(value, np.ndarray):
+    return value.nbytes
+  if isinstance(value, str):
+    return len(value)
+  if isinstance(value, (list, tuple)):
+    return sum(array_bytes(v) if isinstance(v, (str, list, tuple, dict, np.ndarray)) else 8 for v in value)
+  if isinstance(value, dict) and "bdata" in value:  # typed arrays of figures read back from the figure cache
+    return metrics.typed_array_bytes(value)
+  if isinstance(value, dict):
+    return sum(array_bytes(v) for v in value.values())
+  return 0
+
+def figure_bytes(fig):
+  # bytes of the data arrays of a figure or FigureWidget, including marker and line color arrays
+  if fig is None:
+    return 0
+  total = 0
+  for trace in fig.data:
+    total += sum(array_bytes(getattr(trace, name, None)) for name in ARRAY_PROPERTIES)
+    for part in ("marker", "line"):
+      total += array_bytes(getattr(getattr(trace, part, None), "color", None))
+  return total
+
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+class SessionMemory:
+  def __init__(self, session_id):
+    self.session_id = session_id
+    self.outputs = {}  # output id -> approximate bytes retained
+    self.last_active = time.monotonic()
+    self.evicted = False
+    with SESSIONS_LOCK:
+      SESSIONS[session_id] = self
+
+  def touch(self):
+    self.last_active = time.monotonic()
+
+  def idle_seconds(self):
+    return time.monotonic() - self.last_active
+
+  def record(self, output_id, nbytes):
+    self.outputs[output_id] = int(nbytes)
+
+  def total(self):
+    return sum(self.outputs.values())
+
+  def close(self):
+    with SESSIONS_LOCK:
+      SESSIONS.pop(self.session_id, None)
+
+  def report(self):
+    # session ids let a client act on a session, so they are only shown hashed
+    return {
+      "session": hashlib.sha256(self.session_id.encode()).hexdigest()[:12],
+      "idle_seconds": round(self.idle_seconds(), 1),
+      "evicted": self.evicted,
+      "bytes": self.total(),
+      "outputs": dict(sorted(self.outputs.items())),
+    }
+
+def sessions():
+  with SESSIONS_LOCK:
+    return list(SESSIONS.values())
+
+def report():
+  items = sorted((memory.report() for memory in sessions()), key=lambda r: -r["bytes"])
+  return {"sessions": len(items), "bytes": sum(r["bytes"] for r in items), "by_session": items}
+
+async def sessions_endpoint(request):
+  from starlette.responses import JSONResponse
+  return JSONResponse(report())
+
+def retained_bytes_by_output():
+  totals = {}
+  for memory in sessions():
+    for output_id, nbytes in list(memory.outputs.items()):
+      totals[(output_id,)] = totals.get((output_id,), 0) + nbytes
+  return totals
+
+def session_counts():
+  counts = {("active",): 0, ("evicted",): 0}
+  for memory in sessions():
+    counts[("evicted",) if memory.evicted else ("active",)] += 1
+  return counts
+
+metrics.CallbackMetric("helicallattice_session_retained_bytes", "Approximate bytes of figure data held by the sessions of this worker", "gauge", retained_bytes_by_output, ("output",))
+metrics.CallbackMetric("helicallattice_sessions", "Sessions of this worker, by whether their figures are evicted", "gauge", session_counts, ("state",))
+EVICTIONS = metrics.Counter("helicallattice_session_evictions_total", "Idle sessions whose figures were evicted")
+EVICTED_BYTES = metrics.Counter("helicallattice_session_evicted_bytes_total", "Approximate bytes of figure data released by evicting idle sessions")